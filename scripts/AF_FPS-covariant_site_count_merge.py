@@ -6,82 +6,93 @@
 import os
 import sys
 import pandas as pd
-from natsort import order_by_index, index_natsorted
+import concurrent.futures
+from natsort import natsorted
+from AF_FPS_partitioned_output import index_filename, iter_motif_tables
+from AF_FPS_async_writer import compression_suffixes, filter_suffix, read_table, resolve_table
 ####################
 
-# check if the input directory (correlation-tests sig tsvs) and output directory are provided
-if len(sys.argv) != 3:
-    print("Usage: python3 AF_FPS-covariant_site_count_merge.py <input_dir> <output_dir>")
-    sys.exit(1)
-
-# set the input directory (where the correlation-tests directory is located)
-input_dir = sys.argv[1]
-
-# grab all the files with the name *significant.tsv
-files = [f for f in os.listdir(input_dir) if f.endswith("sig.tsv")]
-print(len(files))
-
-# initialize the master df
-master_df = pd.DataFrame()
-
-# load each file into a df, if the df is empty, skip it
-for index, file in enumerate(files):
+# define a function to load one significant correlation file into a df with the motif id attached
+def load_sig_file(input_dir, file):
     # get the file path
     filepath = os.path.join(input_dir, file)
-    # extract motif id from filename
-    motif_id = file.replace('_correlation_test_results_fdr-corrected_sig.tsv', '')
-    print(f"Processing file no. {index+1} of {len(files)} files...")
-    print(f"Motif ID: {motif_id}")
+    # extract motif id from filename, which may carry a compression suffix or be a filter view of the full table
+    motif_id = file.split('_correlation_test_results_fdr-corrected_sig.tsv')[0]
     # load the file into a df
-    print(f"Loading {file} into a df...")
-    df = pd.read_csv(filepath, sep="\t")
+    return format_sig_df(read_table(filepath, sep="\t"), motif_id)
+
+# define a function to bring one motif's significant correlations into the combined layout
+def format_sig_df(df, motif_id):
     # if the df is empty, skip it
     if df.empty:
-        print(f"{file} no. {index+1} is empty, skipping...")
-        continue
+        return None
+    # rename the original index column and the pvalue column
+    df = df.rename(columns={'Unnamed: 0': 'orig_index', 'pvalue': 'pvalues'})
+    # add the motif id to the df
+    df["motif_id"] = motif_id
+    # then move the motif id to the second column
+    return df[['orig_index', 'motif_id', 'region_id', 'corr_coeff', 'pvalues', 'adj_pvalues']]
+
+# define a function to sort the master df by motif id and then naturally by genomic position of the region id
+def natural_region_sort(master_df):
+    # precompute integer sort keys from the region id (chrom:start-end) instead of natural-sorting the strings
+    coords = master_df['region_id'].str.extract(r'^(?P<chrom>.+):(?P<start>\d+)-(?P<end>\d+)$')
+    chrom_order = {chrom: rank for rank, chrom in enumerate(natsorted(coords['chrom'].dropna().unique()))}
+    sort_keys = pd.DataFrame({
+        'motif_id': master_df['motif_id'],
+        'chrom_rank': coords['chrom'].map(chrom_order),
+        'start': coords['start'].astype('int64'),
+        'end': coords['end'].astype('int64'),
+    })
+    order = sort_keys.sort_values(by=['motif_id', 'chrom_rank', 'start', 'end'], kind='stable').index
+    return master_df.loc[order]
+
+if __name__ == "__main__":
+    # check if the input directory (correlation-tests sig tsvs) and output directory are provided
+    if len(sys.argv) != 3:
+        print("Usage: python3 AF_FPS-covariant_site_count_merge.py <input_dir> <output_dir>")
+        sys.exit(1)
+
+    # set the input directory (the correlation-tests directory, or the datasets directory of the partitioned output)
+    input_dir = sys.argv[1]
+
+    if os.path.exists(os.path.join(input_dir, index_filename)):
+        # a partitioned output dataset holds the significant correlations of all motifs in a few files
+        print("Partitioned output dataset found. Loading the significant correlations of all motifs...")
+        sig_dfs = [format_sig_df(df, motif_id) for motif_id, df in iter_motif_tables(input_dir, 'fdr_corrected_sig')]
+        dfs = [df for df in sig_dfs if df is not None]
+        print(f"{len(sig_dfs) - len(dfs)} motifs had no significant correlations and have been skipped.")
     else:
-        # rename the original index column
-        print(f"Renaming original index column...")
-        df = df.rename(columns={'Unnamed: 0': 'orig_index'})
-        # rename pvalue column
-        print(f"Renaming pvalue column...")
-        df = df.rename(columns={'pvalue': 'pvalues'})
-        # add the motif id to the df
-        print(f"Adding motif id to the df...")
-        df["motif_id"] = motif_id
-        # then move the motif id to the second column
-        df = df[['orig_index', 'motif_id', 'region_id', 'corr_coeff', 'pvalues', 'adj_pvalues']]
-        print(df.head())
-
-        # merge the current df with the master df
-        print(f"Now merging {file} df with the master df...")
-        master_df = pd.concat([master_df, df], ignore_index=True)
-
-# print the master df
-print(master_df.head())
-print(master_df.shape)
-
-# sort the master df by motif id and then by region id, preserving the sorting of motif id
-print("Sorting the master df by motif id and region id...")
-
-# Sort by 'motif_id' first
-master_df = master_df.sort_values(by=['motif_id', 'region_id'])
-
-# master_df['region_id'] = master_df['region_id'].astype(str)
-# master_df = master_df.iloc[order_by_index(master_df.index, index_natsorted(master_df['region_id']))]
-
-# Reset the index
-master_df = master_df.reset_index(drop=True)
-
-print(master_df.head())
-
-# save the master df to a file
-print("Saving the master df to a file...")
-output_dir = sys.argv[2]
-output_file = f"{output_dir}/AF_FPS-covariant_sites_significant.combined.tsv"
-
-master_df.to_csv(output_file, sep="\t", index=False)
-
-
-
-        
\ No newline at end of file
+        # grab all the files with the name *sig.tsv, compressed or written as filter views
+        sig_endings = tuple(f"sig.tsv{suffix}" for suffix in [*compression_suffixes.values(), filter_suffix])
+        sig_name = '_correlation_test_results_fdr-corrected_sig.tsv'
+        # one file per motif: if an earlier run in another output mode left its copy behind, the newest one is read
+        motif_ids = sorted({f.split(sig_name)[0] for f in os.listdir(input_dir) if f.endswith(sig_endings)})
+        files = [os.path.basename(resolve_table(os.path.join(input_dir, f"{motif_id}{sig_name}"))) for motif_id in motif_ids]
+        print(f"{len(files)} significant correlation files found. Loading them concurrently...")
+
+        # the files are small, so reading is I/O bound and threads are enough to overlap it
+        with concurrent.futures.ThreadPoolExecutor(max_workers=16) as executor:
+            dfs = [df for df in executor.map(load_sig_file, [input_dir] * len(files), files) if df is not None]
+        print(f"{len(files) - len(dfs)} files were empty and have been skipped.")
+
+    # concatenate all dfs once instead of growing the master df file by file
+    columns = ['orig_index', 'motif_id', 'region_id', 'corr_coeff', 'pvalues', 'adj_pvalues']
+    master_df = pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame(columns=columns)
+    print(master_df.shape)
+
+    # sort the master df by motif id and then by region id, preserving the sorting of motif id
+    print("Sorting the master df by motif id and region id...")
+    master_df = natural_region_sort(master_df)
+
+    # Reset the index
+    master_df = master_df.reset_index(drop=True)
+
+    print(master_df.head())
+
+    # save the master df to a file
+    print("Saving the master df to a file...")
+    output_dir = sys.argv[2]
+    output_file = f"{output_dir}/AF_FPS-covariant_sites_significant.combined.tsv"
+
+    master_df.to_csv(output_file, sep="\t", index=False)
@@ -7,61 +7,64 @@
 import os
 import sys
 import logging
+import numpy as np
 import pandas as pd
-import seaborn as sns
 import itertools as it
-import matplotlib.pyplot as plt
 import concurrent.futures as cf
 
 from pathlib import Path
-from scipy.stats import spearmanr
 from natsort import index_natsorted
-from sklearn.preprocessing import MinMaxScaler
-from statsmodels.stats.multitest import multipletests
-
-####################
-# define globals #
-####################
-
-# Set color values
-dutchfield = ["#e60049", "#0bb4ff", "#87bc45", "#ef9b20", "#b33dc6"]
-
-springpastel = ["#fd7f6f", "#7eb0d5", "#b2e061", "#bd7ebe", "#ffb55a"] 
-
-gray = 'lightgray'
-
-dutchfield_colordict = {'S6R691V_her2': "#e60049", 'ANAB5F7_basal': "#0bb4ff", '98JKPD8_lumA': "#87bc45", 'PU24GB8_lumB': "#ef9b20", '2GAMBDQ_norm': "#b33dc6"}
-
-gray_colordict = {'S6R691V_her2': gray, 'ANAB5F7_basal': gray, '98JKPD8_lumA': gray, 'PU24GB8_lumB': gray, '2GAMBDQ_norm': gray}
-
-#############################
-# define plotting functions #
-#############################
-
-def plot_jointplot(dataframe, motif_id, output_path):
-	# plot scatter plot of AF_var vs FPS_scaled_var
-	g = sns.jointplot(data=dataframe, x='AF', y='FPS_scaled', kind='scatter', hue='sample_id', height=12)
-	plt.xlim(-0.1, 1.1)
-	g.figure.suptitle(f"Jointpot of AF and scaled FPS values of {motif_id}", fontsize=14)
-	# save the plot
-	logging.info(f'Saving {motif_id} jointplot of AF and scaled FPS...')
-	g.savefig(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AF_vs_FPS-scaled_jointplot.pdf', dpi=150, bbox_inches="tight")
-	# close the plot
-	plt.close("all")
-	del g
-	logging.info('Plot space closed and plots have been saved to file.')
-
+from AF_FPS_stage_cache import file_digest, accumulator_source, stage_cache_path, cache_load, cache_store
+from AF_FPS_threshold_sweep import parse_grid, upper_fences, sweep_counts
+from AF_FPS_partitioned_output import dataset_dirname, legacy_tables, write_motif_tables
+from AF_FPS_results_store import open_store, add_motif, span_digest
+from AF_FPS_plot_rendering import write_plot_data
+from AF_FPS_summary_records import afps_histogram, write_summary_record
+from AF_FPS_region_extrema import find_region_extrema, winner_pairs
+from AF_FPS_async_writer import write_table, write_filter, wait_for, flush_writers
+from AF_FPS_kernels import spearman_rows, kernel_name
+from AF_FPS_frame_backends import select_frame_backend, merged_stat_polars
+from AF_FPS_profiling import profile_hook
 
 #########################
 # define util functions #
 #########################
 
 def process_input_tsv(root_dir):
-	# Find all *.tsv files in root_dir
+	# Find all wide matrix *.tsv files in root_dir
 	target_dir = Path(root_dir)
-	tsv_files = target_dir.glob('*.tsv')
+	tsv_files = target_dir.glob('*_fpscore-af-varsites-combined-matrix-wide.tsv')
+	# block-compressed matrices (the bgzip mode of the overlap) serve region lookups only and are not read here
+	bgzip_files = list(target_dir.glob('*_fpscore-af-varsites-combined-matrix-wide.tsv.gz'))
+	if bgzip_files:
+		logging.warning(f'Skipping {len(bgzip_files)} block-compressed wide matrices in {root_dir}; rerun the overlap without bgzip (or with index) to extract their covariant sites.')
 	return tsv_files
 
+def save_table(df, motif_id, output_path, table, tables=None, compression=None):
+	# collect the table for a single dataset commit of the motif, or queue it for the writer threads as a per-motif TSV and return its path
+	if tables is not None:
+		tables[table] = df
+		return None
+	subdir, suffix = legacy_tables[table]
+	return write_table(df, f'{output_path}/{subdir}/{motif_id}{suffix}', compression, sep='\t', index=True)
+
+def load_accumulators(tsv_filepath, dt_afps):
+	# load the per-region Welford accumulators written when samples are appended to a wide matrix, if there are any
+	acc_filepath = str(tsv_filepath).replace('_fpscore-af-varsites-combined-matrix-wide.tsv', '_region-variance-accumulators.txt')
+	if not os.path.exists(acc_filepath):
+		return None
+	# only trust the accumulators if they were written for this very matrix; a rerun of the overlap stage keeps the regions and samples but changes the values
+	if accumulator_source(acc_filepath) != file_digest(tsv_filepath):
+		logging.warning(f'Accumulators in {acc_filepath} were not written for the current wide matrix. Recomputing variances instead.')
+		return None
+	accumulators = pd.read_csv(acc_filepath, sep='\t', comment='#').set_index('region_id')
+	# and only if they describe exactly its regions and samples
+	n_samples = len(dt_afps.filter(regex='_AF$').columns)
+	if len(accumulators) != len(dt_afps) or not accumulators.index.isin(dt_afps['region_id']).all() or not (accumulators['n'] == n_samples).all():
+		logging.warning(f'Accumulators in {acc_filepath} do not match the wide matrix. Recomputing variances instead.')
+		return None
+	return accumulators
+
 def load_datatable(tsv_filepath):
 	# import the data
 	dt_afps = pd.read_csv(tsv_filepath, sep='\t')
@@ -89,6 +92,8 @@ def load_datatable(tsv_filepath):
 
 def scale_merge_data(dt_afps, afps_df_lpv, motif_id, output_path):
 	# scale the FPS values to a range of 0-1
+	# sklearn is only imported here, so that workers that reuse cached stages never load it
+	from sklearn.preprocessing import MinMaxScaler
 	# Initialize a MinMaxScaler
 	scaler = MinMaxScaler()
 	# copy df
@@ -123,8 +128,6 @@ def scale_merge_data(dt_afps, afps_df_lpv, motif_id, output_path):
 	# merge the AF-FPS and FPS-scaled dataframes on region_id and sample_id
 	afps_full_dfl = afps_df_lpv.merge(fps_df_scaled_lpv, on=['region_id', 'sample_id'])
 	logging.info('Dataframes have been scaled and merged.')
-	# print('Plotting jointplot...')
-	# plot_jointplot(afps_full_dfl, motif_id, output_path)
 	return fps_df_scaled, fps_df_scaled_lpv, afps_full_dfl
 
 def filter_zero(afps_full_dfl):
@@ -133,7 +136,7 @@ def filter_zero(afps_full_dfl):
 	merged_filt_dfl = afps_full_dfl.groupby('region_id').filter(lambda x: x['FPS'].sum() > 0 and x['AF'].sum() > 0)
 	return merged_filt_dfl
 
-def calculate_variance(dt, fps_df_scaled, motif_id, merged_filt_dfl):
+def calculate_variance(dt, fps_df_scaled, motif_id, merged_filt_dfl, accumulators=None):
 	# calculate the variance of AF and FPS scaled values across sample_ids per region_id
 	logging.info(f'Wrangling {motif_id} data for calculations...')
 	# extract af columns
@@ -151,7 +154,11 @@ def calculate_variance(dt, fps_df_scaled, motif_id, merged_filt_dfl):
 	af_df_filt_idx = af_df_filt.set_index('region_id')
 	# calculate variance of af values across samples per region_id and add to a new column called 'af_var'
 	logging.info(f'Calculating {motif_id} AF variances...')
-	af_df_filt_idx['AF_var'] = af_df_filt_idx.var(axis=1)
+	if accumulators is not None:
+		# sample variance from the Welford accumulators: M2 / (n - 1)
+		af_df_filt_idx['AF_var'] = accumulators.loc[af_df_filt_idx.index, 'AF_M2'] / (accumulators.loc[af_df_filt_idx.index, 'n'] - 1)
+	else:
+		af_df_filt_idx['AF_var'] = af_df_filt_idx.var(axis=1)
 
 	# do the same for fps scaled values
 	fps_df_scaled_filt = fps_df_scaled[fps_df_scaled.index.isin(merged_filt_uniq_regid)]
@@ -160,7 +167,10 @@ def calculate_variance(dt, fps_df_scaled, motif_id, merged_filt_dfl):
 	fps_df_scaled_filt_idx = fps_df_scaled_filt.copy()
 	# calculate variance of fps_scaled values across samples per region_id and add to a new column called 'fps_scaled_var'
 	logging.info(f'Calculating {motif_id} FPS_scaled variances...')
-	fps_df_scaled_filt_idx['FPS_scaled_var'] = fps_df_scaled_filt_idx.var(axis=1)
+	if accumulators is not None:
+		fps_df_scaled_filt_idx['FPS_scaled_var'] = accumulators.loc[fps_df_scaled_filt_idx.index, 'FPS_scaled_M2'] / (accumulators.loc[fps_df_scaled_filt_idx.index, 'n'] - 1)
+	else:
+		fps_df_scaled_filt_idx['FPS_scaled_var'] = fps_df_scaled_filt_idx.var(axis=1)
 	return af_df_filt_idx, fps_df_scaled_filt_idx
 
 def merged_stats_df(af_df_filt_idx, fps_df_scaled_filt_idx, merged_filt_dfl):
@@ -177,7 +187,7 @@ def merged_stats_df(af_df_filt_idx, fps_df_scaled_filt_idx, merged_filt_dfl):
 	merged_stat = merged_stat[['sample_id', 'AF', 'FPS_scaled', 'AF_var', 'FPS_scaled_var']]
 	return merged_stat
 	
-def get_covariant_sites(merged_stat, motif_id, output_path):
+def get_covariant_sites(merged_stat, motif_id, output_path, iqr_multiplier=1.5, tables=None, compression=None):
 	logging.info('Getting unique region IDs and extracting only AF_var and FPS_scaled_var columns...')
 	# subset merged_stat
 	merged_stat_vars = merged_stat[['AF_var', 'FPS_scaled_var']].copy().drop_duplicates()
@@ -187,15 +197,15 @@ def get_covariant_sites(merged_stat, motif_id, output_path):
 	q1_vaf = merged_stat_vars['AF_var'].quantile(0.25)
 	q3_vaf = merged_stat_vars['AF_var'].quantile(0.75)
 	iqr_vaf = q3_vaf - q1_vaf
-	lower_bound_outliers_vaf = q1_vaf - (1.5 * iqr_vaf)
-	upper_bound_outliers_vaf = q3_vaf + (1.5 * iqr_vaf)
+	lower_bound_outliers_vaf = q1_vaf - (iqr_multiplier * iqr_vaf)
+	upper_bound_outliers_vaf = q3_vaf + (iqr_multiplier * iqr_vaf)
 
 	# calculate IQR for FPS_scaled_var
 	q1_vfps = merged_stat_vars['FPS_scaled_var'].quantile(0.25)
 	q3_vfps = merged_stat_vars['FPS_scaled_var'].quantile(0.75)
 	iqr_vfps = q3_vfps - q1_vfps
-	lower_bound_outliers_vfps = q1_vfps - (1.5 * iqr_vfps)
-	upper_bound_outliers_vfps = q3_vfps + (1.5 * iqr_vfps)
+	lower_bound_outliers_vfps = q1_vfps - (iqr_multiplier * iqr_vfps)
+	upper_bound_outliers_vfps = q3_vfps + (iqr_multiplier * iqr_vfps)
 
 	logging.info(f'Outlier bounds for {motif_id} AF variance: {lower_bound_outliers_vaf, upper_bound_outliers_vaf}')
 
@@ -218,104 +228,239 @@ def get_covariant_sites(merged_stat, motif_id, output_path):
 
 	# save to file
 	logging.info(f'Saving {motif_id} covariant sites to file...')
-	covar_sites.to_csv(f'{output_path}/covariant-sites/{motif_id}_covariant_sites.tsv', sep='\t', index=True)
+	save_table(covar_sites, motif_id, output_path, 'covariant_sites', tables, compression)
 
 	return covar_sites_sorted
 
-def test_correlation_spearman(covar_sites_sorted, motif_id, output_path):
-	# test for Spearman correlation between AF_var and FPS_scaled_var for each covariant site across sample_ids
+def correlate_sites(covar_sites_sorted, motif_id, cache_path=None):
+	# reuse the correlations of an earlier run with the same input and IQR multiplier if they are cached
+	corr_df_allcovarsites = cache_load(cache_path)
+	if corr_df_allcovarsites is not None:
+		logging.info(f'Reusing cached {motif_id} correlation test results...')
+		return corr_df_allcovarsites
 
 	# drop variance columns
 	covar_sites_sorted_novars = covar_sites_sorted.drop(columns=['AF_var', 'FPS_scaled_var'])
 	# reset index
 	covar_sites_sorted_novars = covar_sites_sorted_novars.reset_index()
-	# group by region_id and calculate spearman correlation
-	correlations = covar_sites_sorted_novars.groupby('region_id').apply(lambda group: spearmanr(group['AF'], group['FPS_scaled']), include_groups=False)
 	logging.info(f'Testing for correlation between AF_var and FPS_scaled_var for {motif_id}...')
-	# that returned a pandas Series, so convert to dataframe
-	correlations_df = pd.DataFrame(correlations, columns=['corr_coeff_and_pvalue'])
-	# split the 'corr_coeff_and_pvalue' column into two separate columns using apply() and pd.Series
-	correlations_df[['corr_coeff', 'pvalue']] = correlations_df['corr_coeff_and_pvalue'].apply(pd.Series)
-	# drop the original column
-	correlations_df = correlations_df.drop(columns=['corr_coeff_and_pvalue']).reset_index()
+	# lay out the samples of every region as one row of a regions x samples array, so that all regions are ranked and correlated in one pass
+	region_codes, region_ids = pd.factorize(covar_sites_sorted_novars['region_id'], sort=True)
+	sample_slots = covar_sites_sorted_novars.groupby(region_codes).cumcount().to_numpy()
+	af_rows = np.full((len(region_ids), sample_slots.max(initial=-1) + 1), np.nan)
+	fps_rows = af_rows.copy()
+	af_rows[region_codes, sample_slots] = covar_sites_sorted_novars['AF'].to_numpy(dtype=float)
+	fps_rows[region_codes, sample_slots] = covar_sites_sorted_novars['FPS_scaled'].to_numpy(dtype=float)
+	corr_coeffs, pvalues = spearman_rows(af_rows, fps_rows)
+	# a missing value in a region makes its correlation undefined, as in scipy.stats.spearmanr
+	has_nan = np.bincount(region_codes, weights=covar_sites_sorted_novars[['AF', 'FPS_scaled']].isna().any(axis=1).to_numpy(), minlength=len(region_ids)) > 0
+	corr_coeffs[has_nan] = np.nan
+	pvalues[has_nan] = np.nan
+	correlations_df = pd.DataFrame({'region_id': region_ids, 'corr_coeff': corr_coeffs, 'pvalue': pvalues})
 	# sort region_ids naturally
 	correlations_df_sorted = correlations_df.reindex(index=index_natsorted(correlations_df['region_id']))
 	# reset index
 	corr_df_allcovarsites = correlations_df_sorted.reset_index(drop=True)
+	cache_store(cache_path, corr_df_allcovarsites)
+	return corr_df_allcovarsites
+
+def test_correlation_spearman(covar_sites_sorted, motif_id, output_path, cache_path=None, tables=None, compression=None):
+	# test for Spearman correlation between AF_var and FPS_scaled_var for each covariant site across sample_ids
+	corr_df_allcovarsites = correlate_sites(covar_sites_sorted, motif_id, cache_path)
 
 	# save to file
 	logging.info(f'Saving {motif_id} correlation test results to file...')
-	corr_df_allcovarsites.to_csv(f'{output_path}/correlation-tests/{motif_id}_correlation_test_results.tsv', sep='\t', index=True)
+	save_table(corr_df_allcovarsites.copy(), motif_id, output_path, 'correlation_tests', tables, compression)
 
 	return corr_df_allcovarsites
 
-def correct_for_fdr(corr_df_allcovarsites, motif_id, output_path):
+def correct_for_fdr(corr_df_allcovarsites, motif_id, output_path, alpha=0.05, tables=None, compression=None, dedup=False):
 	# perform FDR correction on the p-values
 	logging.info(f'Performing FDR correction on {motif_id} p-values...')
 	# extract the p-values
 	pvalues = corr_df_allcovarsites['pvalue']
 	# perform FDR correction
-	fdr_corrected = multipletests(pvalues, alpha=0.05, method='fdr_bh')
+	from statsmodels.stats.multitest import multipletests
+	fdr_corrected = multipletests(pvalues, alpha=alpha, method='fdr_bh')
 	# add the corrected p-values to the dataframe
 	corr_df_allcovarsites['adj_pvalues'] = fdr_corrected[1]
 
 	# save to file
 	logging.info(f'Saving {motif_id} FDR corrected p-values to file...')
-	corr_df_allcovarsites.to_csv(f'{output_path}/correlation-tests/{motif_id}_correlation_test_results_fdr-corrected.tsv', sep='\t', index=True)
+	fdr_path = save_table(corr_df_allcovarsites, motif_id, output_path, 'fdr_corrected', tables, compression)
 
 	# filter for significant correlations
-	significant_corr = corr_df_allcovarsites[corr_df_allcovarsites['adj_pvalues'] < 0.05]
+	significant_corr = corr_df_allcovarsites[corr_df_allcovarsites['adj_pvalues'] < alpha]
 	logging.info(f'Number of significant correlations for {motif_id}: {len(significant_corr)}')
 	# save to file
 	logging.info(f'Saving {motif_id} significant correlations to file...')
-	significant_corr.to_csv(f'{output_path}/correlation-tests/{motif_id}_correlation_test_results_fdr-corrected_sig.tsv', sep='\t', index=True)
-
-def process_data(tsv_filepath, output_path):
+	if dedup and fdr_path is not None:
+		# the significant table is a row filter of the full table, so only the filter is written
+		subdir, suffix = legacy_tables['fdr_corrected_sig']
+		write_filter(f'{output_path}/{subdir}/{motif_id}{suffix}', fdr_path, 'adj_pvalues', alpha)
+	else:
+		save_table(significant_corr, motif_id, output_path, 'fdr_corrected_sig', tables, compression)
+	return fdr_path
+
+def build_merged_stat(tsv_filepath, output_path, backend=None):
+	# the polars backend runs the stages below as one lazy query; pandas is the reference
+	if select_frame_backend(backend) == 'polars':
+		return merged_stat_polars(tsv_filepath)
 	# load the data
 	dt_afps, motif_id, afps_df_lpv = load_datatable(tsv_filepath)
 	# scale and merge the data
 	fps_df_scaled, _, afps_full_dfl = scale_merge_data(dt_afps, afps_df_lpv, motif_id, output_path)
 	# filter out unique region_id rows that have fps == 0 across the sample_ids and AF == 0
 	merged_filt_dfl = filter_zero(afps_full_dfl)
-	# calculate variance of AF and FPS scaled values across sample_ids per region_id
-	af_df_filt_idx, fps_df_scaled_filt_idx = calculate_variance(dt_afps, fps_df_scaled, motif_id, merged_filt_dfl)
+	# calculate variance of AF and FPS scaled values across sample_ids per region_id, reusing the Welford accumulators of appended samples if present
+	accumulators = load_accumulators(tsv_filepath, dt_afps)
+	af_df_filt_idx, fps_df_scaled_filt_idx = calculate_variance(dt_afps, fps_df_scaled, motif_id, merged_filt_dfl, accumulators)
 	# merge the stats columns
 	merged_stat = merged_stats_df(af_df_filt_idx, fps_df_scaled_filt_idx, merged_filt_dfl)
+	return merged_stat
+
+def cached_merged_stat(tsv_filepath, output_path, motif_id, cache_dir=None):
+	# the threshold-free stages (loading, scaling, zero filtering, variances) are cached on the input content and the code version only
+	input_digest = file_digest(tsv_filepath) if cache_dir is not None else None
+	acc_filepath = str(tsv_filepath).replace('_fpscore-af-varsites-combined-matrix-wide.tsv', '_region-variance-accumulators.txt')
+	acc_digest = file_digest(acc_filepath) if cache_dir is not None and os.path.exists(acc_filepath) else None
+	stat_cache_path = stage_cache_path(cache_dir, 'merged_stat', input_digest, {'accumulators': acc_digest, 'backend': select_frame_backend()}, code_version())
+	merged_stat = cache_load(stat_cache_path)
+	if merged_stat is None:
+		merged_stat = build_merged_stat(tsv_filepath, output_path)
+		cache_store(stat_cache_path, merged_stat)
+	else:
+		logging.info(f'Reusing cached {motif_id} variance statistics...')
+	return merged_stat, input_digest, acc_digest
+
+def record_summaries(merged_stat, covar_sites_sorted, motif_id, output_path):
+	# emit the mergeable summary record of the motif for the cohort tables: the variant sites per subtype and the AF/FPS_scaled histogram of the non-zero regions, and the regions each subtype has the maximum AF and FPS_scaled of among the covariant sites
+	# a later data-viz run of the motif appends records over its own high-AF subsets, which replace these fields in the reducer
+	merged_long = merged_stat.reset_index()
+	variant_site_counts = merged_long[merged_long['AF'] > 0].groupby('sample_id')['region_id'].nunique().reindex(sorted(merged_long['sample_id'].unique()), fill_value=0)
+	extrema_df, wins_df = find_region_extrema(covar_sites_sorted.reset_index())
+	common_max = winner_pairs(extrema_df, 'AF_max').merge(winner_pairs(extrema_df, 'FPS_scaled_max'), on=['region_id', 'sample_id'], how='inner')
+	write_summary_record(output_path, motif_id,
+		variant_site_counts={str(sample_id): int(count) for sample_id, count in variant_site_counts.items()},
+		afps_histogram=afps_histogram(merged_long),
+		max_af_region_counts={str(sample_id): int(count) for sample_id, count in wins_df['AF_max'].items()},
+		max_fps_region_counts={str(sample_id): int(count) for sample_id, count in wins_df['FPS_scaled_max'].items()},
+		common_max_regions=[[str(region_id), str(sample_id)] for region_id, sample_id in common_max.itertuples(index=False)])
+
+@profile_hook('covariant', '_fpscore-af-varsites-combined-matrix-wide.tsv')
+def process_data(tsv_filepath, output_path, iqr_multiplier=1.5, fdr_alpha=0.05, cache_dir=None, dataset_output=False, store_path=None, plot_data=False, compression=None, dedup=False):
+	motif_id = os.path.basename(tsv_filepath).replace('_fpscore-af-varsites-combined-matrix-wide.tsv', '')
+	merged_stat, input_digest, acc_digest = cached_merged_stat(tsv_filepath, output_path, motif_id, cache_dir)
+	# the jointplot is drawn later by the plot rendering stage from a small plot data file
+	if plot_data:
+		write_plot_data(output_path, motif_id, 'jointplot', f'{motif_id}_AF_vs_FPS-scaled_jointplot.pdf', merged_stat[['sample_id', 'AF', 'FPS_scaled']])
+	# in dataset mode the tables of the motif are collected and committed to the partitioned dataset together
+	tables = {} if dataset_output else None
 	# get covariant sites
-	covar_sites_sorted = get_covariant_sites(merged_stat, motif_id, output_path)
-	# test for correlation between AF_var and FPS_scaled_var for each covariant site across sample_ids
-	corr_df_allcovarsites = test_correlation_spearman(covar_sites_sorted, motif_id, output_path)
+	covar_sites_sorted = get_covariant_sites(merged_stat, motif_id, output_path, iqr_multiplier, tables, compression)
+	# test for correlation between AF_var and FPS_scaled_var for each covariant site across sample_ids; these depend on the IQR multiplier but not on the FDR alpha
+	# the variance statistics depend on the dataframe backend and the ranks on the kernels, so both are part of the key
+	corr_cache_path = stage_cache_path(cache_dir, 'correlations', input_digest, {'accumulators': acc_digest, 'backend': select_frame_backend(), 'kernels': kernel_name(), 'iqr_multiplier': iqr_multiplier}, code_version())
+	corr_df_allcovarsites = test_correlation_spearman(covar_sites_sorted, motif_id, output_path, corr_cache_path, tables, compression)
+	record_summaries(merged_stat, covar_sites_sorted, motif_id, output_path)
 	# perform FDR correction on the p-values
-	correct_for_fdr(corr_df_allcovarsites, motif_id, output_path)
+	fdr_path = correct_for_fdr(corr_df_allcovarsites, motif_id, output_path, fdr_alpha, tables, compression, dedup)
+	if tables is not None:
+		spans = write_motif_tables(os.path.join(output_path, dataset_dirname), motif_id, tables)
+		source_digest = span_digest(*spans['fdr_corrected'])
+	else:
+		# the digest needs the finished file; the other tables keep writing in the background
+		wait_for(fdr_path)
+		source_digest = file_digest(fdr_path)
+	# load the finished motif into the results store, so that it can be queried while the other motifs are still running
+	if store_path is not None:
+		conn = open_store(store_path)
+		add_motif(conn, motif_id, corr_df_allcovarsites, source_digest)
+		conn.close()
+	# the worker returns only once all tables of the motif are on disk
+	flush_writers()
 	logging.info(f'Processing of {motif_id} data is complete.')
 
+def sweep_data(tsv_filepath, output_path, multipliers, fdr_alphas, cache_dir=None, af_cutoffs=(0.0,)):
+	motif_id = os.path.basename(tsv_filepath).replace('_fpscore-af-varsites-combined-matrix-wide.tsv', '')
+	merged_stat, input_digest, acc_digest = cached_merged_stat(tsv_filepath, output_path, motif_id, cache_dir)
+	logging.info(f'Sweeping {len(multipliers)} IQR multipliers x {len(af_cutoffs)} AF cutoffs x {len(fdr_alphas)} FDR alphas for {motif_id}...')
+	# one row per region with its variances and maximum AF across sample_ids
+	region_stats = merged_stat.groupby(level=0).agg(AF_var=('AF_var', 'first'), FPS_scaled_var=('FPS_scaled_var', 'first'), max_AF=('AF', 'max'))
+	fences = upper_fences(merged_stat[['AF_var', 'FPS_scaled_var']].drop_duplicates(), multipliers)
+	# the covariant sites of the smallest multiplier contain those of all the others, so correlations are computed once for them
+	loosest = int(np.argmin(multipliers))
+	candidate_mask = (region_stats['AF_var'] > fences[loosest, 0]) & (region_stats['FPS_scaled_var'] > fences[loosest, 1])
+	candidate_sites = merged_stat[merged_stat.index.isin(region_stats.index[candidate_mask])]
+	corr_cache_path = stage_cache_path(cache_dir, 'correlations', input_digest, {'accumulators': acc_digest, 'backend': select_frame_backend(), 'kernels': kernel_name(), 'iqr_multiplier': multipliers[loosest]}, code_version())
+	corr_df = correlate_sites(candidate_sites, motif_id, corr_cache_path)
+	region_stats['pvalue'] = corr_df.set_index('region_id')['pvalue'].reindex(region_stats.index)
+	# evaluate the whole grid as vectorized comparisons
+	sweep_df = sweep_counts(region_stats, fences, multipliers, af_cutoffs, fdr_alphas)
+	sweep_df.insert(0, 'motif_id', motif_id)
+	logging.info(f'Threshold sweep of {motif_id} data is complete.')
+	return sweep_df
+
 
 ##################
 # load arguments #
 ##################
-# check for the required arguments
-if len(sys.argv) < 3:
-	print(f'ERROR: Missing required arguments!')
-	print(f'USAGE: python3 AF_FPS_covariant_site_extraction.py <directory where the motif matrix tsv files are stored> <top directory for output files>')
-	sys.exit(1)
-else:
-    root_dir = sys.argv[1]
-    output_dir = sys.argv[2]
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-
-# ##################
-# # define globals #
-# ##################
 
-if __name__ == '__main__':
+# create a function to get the code version of the stage cache keys; any edit to this script or to the pipeline modules it imports invalidates the cached stages
+def code_version():
+	# the imported modules (kernels, frame backends, threshold sweep, ...) compute parts of the cached stages too, so they are found from the functions this script imported from them
+	modules = sorted({obj.__module__ for obj in globals().values() if callable(obj) and getattr(obj, '__module__', '').startswith('AF_FPS') and obj.__module__ != __name__})
+	# file_digest memoizes the hashes, so they are only computed once per process
+	return ','.join([file_digest(__file__), *(file_digest(sys.modules[name].__file__) for name in modules)])
+
+# create a function to set up logging, in the main process and in every pool worker
+def setup_logging():
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def main():
+	# check for the required arguments
+	if len(sys.argv) < 3:
+		print(f'ERROR: Missing required arguments!')
+		print(f'USAGE: python3 AF_FPS_covariant_site_extraction.py <directory where the motif matrix tsv files are stored> <top directory for output files> [IQR multiplier(s) (default: 1.5)] [FDR alpha(s) (default: 0.05)] [stage cache directory] [max AF cutoff(s) (default: 0)] [output options: comma-separated tsv or dataset, plots, gzip or zstd, and dedup (default: tsv)] [results store db]')
+		print(f'Comma-separated lists of multipliers, alphas or AF cutoffs run a threshold sweep instead of the full pipeline. Pass - to skip an optional argument.')
+		sys.exit(1)
+
+	root_dir = sys.argv[1]
+	output_dir = sys.argv[2]
+	iqr_multipliers = parse_grid(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3] != '-' else [1.5]
+	fdr_alphas = parse_grid(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4] != '-' else [0.05]
+	cache_dir = sys.argv[5] if len(sys.argv) > 5 and sys.argv[5] != '-' else None
+	af_cutoffs = parse_grid(sys.argv[6]) if len(sys.argv) > 6 and sys.argv[6] != '-' else [0.0]
+	sweep_mode = max(len(iqr_multipliers), len(fdr_alphas), len(af_cutoffs)) > 1 or (len(sys.argv) > 6 and sys.argv[6] != '-')
+	output_options = sys.argv[7].split(',') if len(sys.argv) > 7 else ['tsv']
+	dataset_output = 'dataset' in output_options
+	plot_data = 'plots' in output_options
+	# per-motif TSVs can be compressed, and the significant table can be written as a filter of the full FDR table
+	compression = next((option for option in ('gzip', 'zstd') if option in output_options), None)
+	dedup = 'dedup' in output_options
+	store_path = sys.argv[8] if len(sys.argv) > 8 else None
+
+	setup_logging()
 	inputs = process_input_tsv(root_dir)
 	# uncomment this to run serially
 	# for target_file in inputs:
 	# 	process_data(target_file, output_dir, 'iqr', True)
 
-	# uncomment this to run in parallel
-	with cf.ProcessPoolExecutor(max_workers=8) as executor:
-		executor.map(process_data, inputs, it.repeat(output_dir))
+	# uncomment this to run in parallel; the workers import nothing but this module's light dependencies, whichever start method is used
+	if sweep_mode:
+		with cf.ProcessPoolExecutor(max_workers=8, initializer=setup_logging) as executor:
+			sweep_dfs = list(executor.map(sweep_data, inputs, it.repeat(output_dir), it.repeat(iqr_multipliers), it.repeat(fdr_alphas), it.repeat(cache_dir), it.repeat(af_cutoffs)))
+		# save the compact table of counts per motif per setting
+		sweep_df = pd.concat(sweep_dfs, ignore_index=True) if sweep_dfs else pd.DataFrame()
+		sweep_df.to_csv(f'{output_dir}/AF_FPS-covariant_threshold_sweep_counts.tsv', sep='\t', index=False)
+		logging.info(f'Threshold sweep counts of {len(sweep_dfs)} motifs have been saved to file.')
+	else:
+		# consuming the results re-raises the errors of the workers here
+		with cf.ProcessPoolExecutor(max_workers=8, initializer=setup_logging) as executor:
+			for _ in executor.map(process_data, inputs, it.repeat(output_dir), it.repeat(iqr_multipliers[0]), it.repeat(fdr_alphas[0]), it.repeat(cache_dir), it.repeat(dataset_output), it.repeat(store_path), it.repeat(plot_data), it.repeat(compression), it.repeat(dedup)):
+				pass
 
 	print ("Pipeline finished! All footprint matrices have been processed.")
+
+if __name__ == '__main__':
+	main()
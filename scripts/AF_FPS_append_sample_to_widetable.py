@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import pandas as pd
+import pyranges as pr
+import concurrent.futures
+import itertools
+
+from pathlib import Path
+from AF_FPS_overlap_raw_matrices_into_widetable import tfbs_suffix, load_tfbs, load_vcf, find_files, pair_vcf_paths, pyrange_obj_overlap, finalise_wide_matrix
+from AF_FPS_stage_cache import file_digest, accumulator_source
+
+####################
+# define globals #
+####################
+
+wide_suffix = "_fpscore-af-varsites-combined-matrix-wide.tsv"
+
+accumulator_suffix = "_region-variance-accumulators.txt"
+
+####################
+# define functions #
+####################
+
+# create a function to min-max scale every column of an array to the range 0-1, as MinMaxScaler does
+def minmax_scale(values):
+    col_min = values.min(axis=0)
+    col_range = values.max(axis=0) - col_min
+    # columns with a constant value are scaled to 0, as in MinMaxScaler
+    col_range[col_range == 0] = 1
+    return (values - col_min) / col_range
+
+# create a function to initialise the per-region Welford accumulators from the columns of a wide matrix
+def init_accumulators(wide_df):
+    accumulators = pd.DataFrame({"region_id": wide_df["region_id"]})
+    af_values = wide_df.filter(regex='_AF$').to_numpy(dtype=float)
+    fps_scaled_values = minmax_scale(wide_df.filter(regex='_fps$').to_numpy(dtype=float))
+    accumulators["n"] = af_values.shape[1]
+    for name, values in (("AF", af_values), ("FPS_scaled", fps_scaled_values)):
+        mean = values.mean(axis=1)
+        accumulators[f"{name}_mean"] = mean
+        accumulators[f"{name}_M2"] = ((values - mean[:, None]) ** 2).sum(axis=1)
+    return accumulators
+
+# create a function to add one new sample value per region to the Welford accumulators
+def update_accumulators(accumulators, af_new, fps_scaled_new):
+    accumulators = accumulators.copy()
+    accumulators["n"] = accumulators["n"] + 1
+    n = accumulators["n"].to_numpy()
+    for name, new in (("AF", af_new), ("FPS_scaled", fps_scaled_new)):
+        delta = new - accumulators[f"{name}_mean"].to_numpy()
+        accumulators[f"{name}_mean"] = accumulators[f"{name}_mean"].to_numpy() + delta / n
+        accumulators[f"{name}_M2"] = accumulators[f"{name}_M2"].to_numpy() + delta * (new - accumulators[f"{name}_mean"].to_numpy())
+    return accumulators
+
+# define concurrent function to append the new sample to the wide matrix of one motif
+def append_sample(wide_file, fps_path, af_path, dataset_id, output_path):
+    motif_id = os.path.basename(wide_file).replace(wide_suffix, '')
+    print(f"Appending {dataset_id} to the wide matrix of {motif_id}...")
+    # the existing columns are kept as text so that they are written back as they were read; read as numbers, the NULL variant positions would turn the positions into floats
+    wide_df = pd.read_csv(wide_file, sep="\t", dtype=str, keep_default_na=False)
+    wide_df[["Start", "End"]] = wide_df[["Start", "End"]].astype("int64")
+    if f"{dataset_id}_AF" in wide_df.columns:
+        print(f"{dataset_id} is already in the wide matrix of {motif_id}. Skipping...")
+        return
+
+    # load the existing accumulators if they were written for exactly this matrix, or initialise them from the matrix before it is extended
+    accumulator_file = os.path.join(os.path.dirname(wide_file), f"{motif_id}{accumulator_suffix}")
+    if os.path.exists(accumulator_file) and accumulator_source(accumulator_file) == file_digest(wide_file):
+        accumulators = pd.read_csv(accumulator_file, sep="\t", comment="#")
+    else:
+        if os.path.exists(accumulator_file):
+            print(f"Accumulators of {motif_id} were not written for the current wide matrix. Initialising them from the matrix instead...")
+        accumulators = init_accumulators(wide_df)
+
+    # take the footprint scores of the new sample from the regenerated TFBS matrix
+    _, df_fps = load_tfbs(os.path.join(fps_path, f"{motif_id}{tfbs_suffix}"))
+    accession = dataset_id.split('_')[0]
+    new_fps_cols = [col for col in df_fps.columns if col.startswith(f"{accession}_") and col.endswith("_fps")]
+    if len(new_fps_cols) != 1:
+        print(f"ERROR: Expected one footprint score column for {dataset_id} in the TFBS matrix of {motif_id}, found {len(new_fps_cols)}!")
+        print("Exiting prematurely...")
+        sys.exit(1)
+    new_fps_col = new_fps_cols[0]
+
+    # place the new footprint scores after the existing ones, as the overlap step would
+    base_df = wide_df.drop(columns=["region_id"]).merge(df_fps[["Chromosome", "Start", "End", new_fps_col]], on=["Chromosome", "Start", "End"], how="left")
+    new_fps = base_df.pop(new_fps_col)
+    last_fps_pos = max(base_df.columns.get_loc(col) for col in base_df.columns if col.endswith("_fps"))
+    base_df.insert(last_fps_pos + 1, new_fps_col, new_fps)
+
+    # overlap only the variants of the new sample
+    vcf_paths = pair_vcf_paths(find_files(af_path, f"*{motif_id}*.txt"), [dataset_id])
+    grs = {dataset_id: pr.PyRanges(load_vcf(vcf_paths[dataset_id]))}
+    target_df = pyrange_obj_overlap(pr.PyRanges(base_df), grs).df
+    target_df = finalise_wide_matrix(target_df)
+
+    # update the accumulators with the new sample, aligned on region_id
+    target_df_idx = target_df.set_index("region_id").loc[accumulators["region_id"]]
+    af_new = target_df_idx[f"{dataset_id}_AF"].to_numpy(dtype=float)
+    fps_scaled_new = minmax_scale(target_df_idx.filter(regex=f"^{accession}_.*_fps$").to_numpy(dtype=float))[:, 0]
+    accumulators = update_accumulators(accumulators, af_new, fps_scaled_new)
+
+    # write to temporary files first so that an interrupted run never leaves a half-written matrix behind
+    out_wide = os.path.join(output_path, f"{motif_id}{wide_suffix}")
+    out_acc = os.path.join(output_path, f"{motif_id}{accumulator_suffix}")
+    target_df.to_csv(f"{out_wide}.tmp", sep="\t", index=False, na_rep='NULL')
+    # the accumulators record the digest of the matrix they describe, so that a rerun of the overlap stage invalidates them
+    with open(f"{out_acc}.tmp", "w") as file:
+        file.write(f"# wide_digest\t{file_digest(f'{out_wide}.tmp')}\n")
+        accumulators.to_csv(file, sep="\t", index=False)
+    os.replace(f"{out_wide}.tmp", out_wide)
+    os.replace(f"{out_acc}.tmp", out_acc)
+    print(f"Shape of the current motif ID ({motif_id}) after appending {dataset_id}: {target_df.shape}")
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 5:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_append_sample_to_widetable.py <wide_matrix_dir> <fps_path> <af_path> <new_dataset_id> [output_path]")
+        sys.exit(1)
+
+    wide_path = sys.argv[1] # path to where the existing wide matrices are stored
+
+    fps_path = sys.argv[2] # path to where the filtered matrices of footprinting scores (with the new sample) are stored
+
+    af_path = sys.argv[3] # path to where the allelic frequency variant data are stored
+
+    dataset_id = sys.argv[4] # dataset ID of the new sample, e.g. 2GAMBDQ_norm
+
+    output_path = sys.argv[5] if len(sys.argv) > 5 else wide_path # by default the matrices are updated in place
+
+    wide_files = Path(wide_path).glob(f"*{wide_suffix}")
+
+    # run concurrent processes; consuming the results re-raises the errors and exits of the workers here
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        for _ in executor.map(append_sample, wide_files, itertools.repeat(fps_path), itertools.repeat(af_path), itertools.repeat(dataset_id), itertools.repeat(output_path)):
+            pass
+
+    print(f"{dataset_id} has been appended to all wide matrices!")
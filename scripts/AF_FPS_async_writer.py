@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import gzip
+import json
+import queue
+import threading
+import pandas as pd
+import concurrent.futures as cf
+
+####################
+# define globals #
+####################
+
+# output compressions and the suffix each one adds to the table path
+compression_suffixes = {None: "", "gzip": ".gz", "zstd": ".zst"}
+
+# writer threads per process, and the number of tables that may wait for them before a caller blocks
+n_writer_threads = 2
+max_pending = 8
+
+# threads compressing one table, and the size of the blocks they compress independently; gzip blocks become the members of a multi-member gzip file
+n_compress_threads = 4
+block_size = 4 << 20
+
+# a table that is a row filter of another table is written as a small JSON view next to where the table would be
+filter_suffix = ".filter.json"
+
+# per-process writer state: the bounded queue, its threads, the pending paths and the errors to raise on the next flush
+_writer = {}
+
+####################
+# define functions #
+####################
+
+# create a function to compress a byte string with gzip, block by block on a thread pool (zlib releases the GIL)
+def compress_gzip(data, threads=n_compress_threads):
+    blocks = [data[start:start + block_size] for start in range(0, len(data), block_size)] or [b""]
+    if len(blocks) == 1:
+        return gzip.compress(blocks[0], mtime=0)
+    with cf.ThreadPoolExecutor(max_workers=threads) as executor:
+        return b"".join(executor.map(lambda block: gzip.compress(block, mtime=0), blocks))
+
+# create a function to compress a byte string with zstd on the compressor's own threads
+def compress_zstd(data, threads=n_compress_threads):
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd output needs the zstandard package; use gzip output instead.")
+    return zstandard.ZstdCompressor(threads=threads).compress(data)
+
+# create a function to render a table and write it atomically, so that readers never see a partial file
+def write_now(df, path, compression=None, **to_csv_kwargs):
+    data = df.to_csv(None, **to_csv_kwargs).encode()
+    if compression == "gzip":
+        data = compress_gzip(data)
+    elif compression == "zstd":
+        data = compress_zstd(data)
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as file:
+        file.write(data)
+    os.replace(tmp_path, path)
+    remove_stale_variants(path[:len(path) - len(compression_suffixes[compression])], path)
+
+# create a function to list the paths a table may have been written to: plain, compressed or as a filter view
+def table_variants(path):
+    return [f"{path}{suffix}" for suffix in [*compression_suffixes.values(), filter_suffix]]
+
+# create a function to remove the other variants of a table once it has been written, so that a change of output mode between runs never leaves two copies of one table
+def remove_stale_variants(path, written_path):
+    for variant in table_variants(path):
+        if variant != written_path:
+            try:
+                os.remove(variant)
+            except FileNotFoundError:
+                pass
+
+# create a function to find the one variant of a table on disk; the newest wins when outputs of an older run are still next to it
+def resolve_table(path):
+    existing = [variant for variant in table_variants(path) if os.path.exists(variant)]
+    return max(existing, key=os.path.getmtime) if existing else None
+
+# create a function to drain the queue of a writer thread
+def writer_loop(jobs):
+    while True:
+        df, path, compression, to_csv_kwargs, done = jobs.get()
+        try:
+            write_now(df, path, compression, **to_csv_kwargs)
+        except Exception as e:
+            _writer["errors"].append((path, e))
+        finally:
+            done.set()
+            jobs.task_done()
+
+# create a function to start the writer threads of this process once; they are daemon threads, so flush_writers must be called before the results are used
+def start_writers(threads=n_writer_threads, pending=max_pending):
+    if _writer.get("pid") == os.getpid():
+        return
+    # a forked worker inherits the state of its parent but not its threads
+    _writer.update({"pid": os.getpid(), "jobs": queue.Queue(maxsize=pending), "pending": {}, "errors": []})
+    for _ in range(threads):
+        threading.Thread(target=writer_loop, args=(_writer["jobs"],), daemon=True).start()
+
+# create a function to queue a table for writing and return the path it will have; the caller must not modify the dataframe afterwards
+def write_table(df, path, compression=None, **to_csv_kwargs):
+    if compression not in compression_suffixes:
+        raise ValueError(f'Invalid compression. Please choose one of {", ".join(str(key) for key in compression_suffixes)}.')
+    start_writers()
+    path = f"{path}{compression_suffixes[compression]}"
+    done = threading.Event()
+    _writer["pending"][path] = done
+    # blocks while the queue is full, so that the pending tables never outgrow the memory of the worker
+    _writer["jobs"].put((df, path, compression, to_csv_kwargs, done))
+    return path
+
+# create a function to write a table as a row filter of another table, keeping only the rows where a column is below a threshold
+def write_filter(path, source_path, column, below):
+    tmp_path = f"{path}{filter_suffix}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as file:
+        json.dump({"source": os.path.basename(source_path), "column": column, "below": below}, file)
+    os.replace(tmp_path, f"{path}{filter_suffix}")
+    remove_stale_variants(path, f"{path}{filter_suffix}")
+    return f"{path}{filter_suffix}"
+
+# create a function to wait until one queued table has been written
+def wait_for(path):
+    done = _writer.get("pending", {}).get(path) if _writer.get("pid") == os.getpid() else None
+    if done is not None:
+        done.wait()
+    raise_errors()
+
+# create a function to wait for all queued tables of this process
+def flush_writers():
+    if _writer.get("pid") == os.getpid():
+        _writer["jobs"].join()
+        _writer["pending"].clear()
+        raise_errors()
+
+# create a function to raise the first error of the writer threads in the calling thread
+def raise_errors():
+    if _writer.get("errors"):
+        path, error = _writer["errors"][0]
+        _writer["errors"].clear()
+        raise OSError(f"Writing {path} failed: {error}") from error
+
+# create a function to read a table written by write_table or write_filter, whatever its compression
+def read_table(path, **read_csv_kwargs):
+    if path.endswith(filter_suffix):
+        with open(path) as file:
+            view = json.load(file)
+        source_df = read_table(os.path.join(os.path.dirname(path), view["source"]), **read_csv_kwargs)
+        return source_df[source_df[view["column"]] < view["below"]].reset_index(drop=True)
+    return pd.read_csv(path, **read_csv_kwargs)
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 2:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_async_writer.py <table or filter view written by the pipeline>")
+        print("Prints the table as a plain TSV.")
+        sys.exit(1)
+
+    read_table(sys.argv[1], sep="\t").to_csv(sys.stdout, sep="\t", index=False)
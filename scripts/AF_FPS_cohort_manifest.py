@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import fnmatch
+import logging
+import importlib.util
+import numpy as np
+import pandas as pd
+import pyranges as pr
+import concurrent.futures as cf
+import itertools as it
+
+from AF_FPS_overlap_raw_matrices_into_widetable import tfbs_suffix, find_files, load_vcf, pair_vcf_paths, pyrange_obj_overlap
+from AF_FPS_partitioned_output import legacy_tables
+from AF_FPS_async_writer import write_table, wait_for
+from AF_FPS_profiling import profile_hook
+
+####################
+# define globals #
+####################
+
+# one row per cohort: its name, the directory of its vcf extracts, the file listing its dataset IDs and its output directory
+manifest_columns = ["cohort", "af_path", "dataset_ids", "output_path"]
+
+# wide matrices of a cohort are written under {output_path}/wide-matrices/, and its covariant site tables next to them as usual
+wide_dirname = "wide-matrices"
+matrix_suffix = "_fpscore-af-varsites-combined-matrix-wide.tsv"
+
+# per-process listing of the vcf extracts of every AF directory, and the pipeline scripts loaded by path
+_af_listings = {}
+_modules = {}
+
+####################
+# define functions #
+####################
+
+# create a function to load the cohort manifest; relative paths are relative to the manifest
+def load_manifest(manifest_path):
+    manifest_df = pd.read_csv(manifest_path, sep="\t", comment="#", dtype=str)
+    missing = [col for col in manifest_columns if col not in manifest_df.columns]
+    if missing:
+        raise ValueError(f"Cohort manifest {manifest_path} is missing the columns: {', '.join(missing)}")
+    if manifest_df["cohort"].duplicated().any():
+        raise ValueError(f"Cohort manifest {manifest_path} lists a cohort more than once.")
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    cohorts = []
+    for row in manifest_df.itertuples(index=False):
+        ids_path = os.path.join(base_dir, row.dataset_ids)
+        with open(ids_path) as file:
+            dataset_ids = [line.rstrip('\n') for line in file if line.strip()]
+        cohorts.append({"cohort": row.cohort, "af_path": os.path.join(base_dir, row.af_path), "dataset_ids": dataset_ids, "output_path": os.path.join(base_dir, row.output_path)})
+    return cohorts
+
+# create a function to map the TFBS score columns of a cohort's samples to their <dataset ID>_fps names, by the accession prefix as for the vcf files
+def cohort_score_columns(tfbs_columns, dataset_ids):
+    score_columns = [col for col in tfbs_columns if col.endswith("_score") and col != "TFBS_score"]
+    renames = {}
+    for dataset in dataset_ids:
+        accession = dataset.split('_')[0]
+        matches = [col for col in score_columns if col.split('_')[0] == accession]
+        if len(matches) != 1:
+            raise ValueError(f"Expected one TFBS score column for dataset ID {dataset}, found {len(matches)}: {matches}")
+        renames[matches[0]] = f"{dataset}_fps"
+    # keep the column order of the TFBS matrix
+    return {col: renames[col] for col in score_columns if col in renames}
+
+# create a function to list the vcf extracts of an AF directory once per process
+def af_listing(af_path):
+    if af_path not in _af_listings:
+        _af_listings[af_path] = find_files(af_path, "*.txt")
+    return _af_listings[af_path]
+
+# create a function to load the covariant site extraction script once per process; its filename is hyphenated, so it is loaded by path
+def covariant_module():
+    if "covariant" not in _modules:
+        spec = importlib.util.spec_from_file_location("AF_FPS_covariant_site_extraction", os.path.join(os.path.dirname(os.path.abspath(__file__)), "AF_FPS-covariant_site_extraction.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules["covariant"] = module
+    return _modules["covariant"]
+
+# create a function to overlap one cohort's variant sites with the shared TFBS index of a motif and lay out its wide matrix
+def overlap_cohort(tfbs_df, gr_sites, motif_id, cohort):
+    vcf_paths = [path for path in af_listing(cohort["af_path"]) if fnmatch.fnmatch(os.path.basename(path), f"*{motif_id}*.txt")]
+    if len(vcf_paths) != len(cohort["dataset_ids"]):
+        raise ValueError(f"Number of vcf files ({len(vcf_paths)}) for {motif_id} in cohort {cohort['cohort']} does not match the number of dataset IDs ({len(cohort['dataset_ids'])})!")
+    grs = {dataset: pr.PyRanges(load_vcf(path)) for dataset, path in pair_vcf_paths(vcf_paths, cohort["dataset_ids"]).items()}
+    # the overlap depends only on the coordinates, so the cohort's scores are attached to the surviving TFBS rows afterwards
+    overlap_df = pyrange_obj_overlap(gr_sites, grs).df
+    renames = cohort_score_columns(tfbs_df.columns, cohort["dataset_ids"])
+    scores_df = tfbs_df[list(renames)].rename(columns=renames).iloc[overlap_df["tfbs_row"].to_numpy()].reset_index(drop=True)
+    target_df = pd.concat([overlap_df[["Chromosome", "Start", "End"]], scores_df, overlap_df.drop(columns=["Chromosome", "Start", "End", "tfbs_row"])], axis=1)
+    target_df["region_id"] = target_df["Chromosome"].astype(str) + ":" + target_df["Start"].astype(str) + "-" + target_df["End"].astype(str)
+    return target_df
+
+# create a function to process one motif for every cohort: parse and index its TFBS once, then overlap and analyze each cohort against it
+@profile_hook("cohort", tfbs_suffix)
+def process_motif(file, cohorts, suffix=tfbs_suffix, analyze=True, iqr_multiplier=1.5, fdr_alpha=0.05):
+    motif_id = os.path.basename(file).replace(suffix, '')
+    tfbs_df = pd.read_csv(file, sep="\t")
+    sites_df = tfbs_df[["TFBS_chr", "TFBS_start", "TFBS_end"]].rename(columns={"TFBS_chr": "Chromosome", "TFBS_start": "Start", "TFBS_end": "End"})
+    sites_df["tfbs_row"] = np.arange(len(sites_df))
+    gr_sites = pr.PyRanges(sites_df)
+    logging.info(f"TFBS index of {motif_id} ({len(sites_df)} sites) is shared by {len(cohorts)} cohorts.")
+
+    results = []
+    for cohort in cohorts:
+        try:
+            target_df = overlap_cohort(tfbs_df, gr_sites, motif_id, cohort)
+            wide_dir = os.path.join(cohort["output_path"], wide_dirname)
+            os.makedirs(wide_dir, exist_ok=True)
+            outfile = write_table(target_df, os.path.join(wide_dir, f"{motif_id}{matrix_suffix}"), sep="\t", index=False, na_rep='NULL')
+            wait_for(outfile)
+            outputs = [outfile]
+            if analyze:
+                for subdir, _ in legacy_tables.values():
+                    os.makedirs(os.path.join(cohort["output_path"], subdir), exist_ok=True)
+                covariant_module().process_data(outfile, cohort["output_path"], iqr_multiplier, fdr_alpha)
+                outputs += [os.path.join(cohort["output_path"], subdir, f"{motif_id}{table_suffix}") for subdir, table_suffix in legacy_tables.values()]
+            results.append((cohort["cohort"], motif_id, "done", outputs))
+        # one cohort failing must not stop the others; the shared helpers exit on unpaired vcf files
+        except (Exception, SystemExit) as e:
+            logging.error(f"Cohort {cohort['cohort']} failed for {motif_id}: {e}")
+            results.append((cohort["cohort"], motif_id, "error", [repr(e)]))
+    return results
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_cohort_manifest.py <fps_path> <cohort manifest tsv> [stages: analyze or overlap (default: analyze)] [TFBS matrix suffix (default: %s)] [number of workers (default: 4)]" % tfbs_suffix)
+        print(f"The manifest has one row per cohort with the columns: {', '.join(manifest_columns)}")
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    fps_path = sys.argv[1]
+    cohorts = load_manifest(sys.argv[2])
+    analyze = (sys.argv[3] if len(sys.argv) > 3 else "analyze") != "overlap"
+    suffix = sys.argv[4] if len(sys.argv) > 4 and sys.argv[4] != '-' else tfbs_suffix
+    max_workers = int(sys.argv[5]) if len(sys.argv) > 5 else 4
+    logging.info(f"Cohorts to be processed: {[cohort['cohort'] for cohort in cohorts]}")
+
+    files = sorted(os.path.join(fps_path, name) for name in os.listdir(fps_path) if name.endswith(suffix))
+    summary = []
+    with cf.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for results in executor.map(process_motif, files, it.repeat(cohorts), it.repeat(suffix), it.repeat(analyze)):
+            summary += results
+
+    # one status row per motif and cohort
+    summary_df = pd.DataFrame(summary, columns=["cohort", "motif_id", "status", "outputs"])
+    summary_df["outputs"] = summary_df["outputs"].str.join(",")
+    for cohort in cohorts:
+        os.makedirs(cohort["output_path"], exist_ok=True)
+        summary_df[summary_df["cohort"] == cohort["cohort"]].to_csv(os.path.join(cohort["output_path"], "AF_FPS-cohort_run_status.tsv"), sep="\t", index=False)
+    n_failed = int((summary_df["status"] == "error").sum())
+    print(f"{len(files)} motifs have been processed for {len(cohorts)} cohorts; {n_failed} motif-cohort runs failed.")
+    sys.exit(1 if n_failed else 0)
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+from scipy.special import gammaln
+from AF_FPS_summary_records import contingency_fields, load_summary_records, summary_path
+
+####################
+# define globals #
+####################
+
+# relative tolerance for a table to count as at most as likely as the observed one in the two-sided p-value
+pmf_rtol = 1e-7
+
+# number of motifs whose hypergeometric supports are evaluated together; bounds the memory of one block
+chunk_size = 256
+
+####################
+# define functions #
+####################
+
+# create a function to get the motif IDs and the (n_motifs, 2, 2) array of region counts from the summary records
+def contingency_array(records):
+    motif_ids = sorted(motif_id for motif_id, record in records.items() if "contingency" in record)
+    tables = np.array([records[motif_id]["contingency"] for motif_id in motif_ids], dtype=np.int64).reshape(-1, 2, 2)
+    return motif_ids, tables
+
+# create a function for the log of the binomial coefficient
+def log_binom(n, k):
+    return gammaln(n + 1) - gammaln(k + 1) - gammaln(n - k + 1)
+
+# create a function to run two-sided Fisher exact tests on a stack of 2x2 tables, with the conventions of scipy.stats.fisher_exact
+def fisher_exact_batch(tables):
+    tables = np.asarray(tables, dtype=np.int64).reshape(-1, 2, 2)
+    a, b, c, d = tables[:, 0, 0], tables[:, 0, 1], tables[:, 1, 0], tables[:, 1, 1]
+    row1, row2, col1 = a + b, c + d, a + c
+    total = row1 + row2
+    # an empty row or column gives no information: the odds ratio is undefined and the p-value is 1
+    degenerate = (row1 == 0) | (row2 == 0) | (col1 == 0) | (b + d == 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        odds_ratios = np.where((b > 0) & (c > 0), (a * d) / (b * c).astype(float), np.inf)
+    odds_ratios[degenerate] = np.nan
+
+    # with the margins fixed, the top left count follows a hypergeometric distribution over [low, high]
+    low, high = np.maximum(0, col1 - row2), np.minimum(row1, col1)
+    pvalues = np.ones(len(tables))
+    for start in range(0, len(tables), chunk_size):
+        block = slice(start, start + chunk_size)
+        width = int((high[block] - low[block]).max(initial=0)) + 1
+        support = low[block, None] + np.arange(width)
+        valid = support <= high[block, None]
+        support = np.minimum(support, high[block, None])
+        log_pmf = log_binom(row1[block, None], support) + log_binom(row2[block, None], col1[block, None] - support) - log_binom(total[block, None], col1[block, None])
+        log_pmf_observed = log_binom(row1[block], a[block]) + log_binom(row2[block], c[block]) - log_binom(total[block], col1[block])
+        # the two-sided p-value sums the probabilities of all tables that are at most as likely as the observed one
+        as_extreme = valid & (log_pmf <= log_pmf_observed[:, None] + np.log1p(pmf_rtol))
+        pvalues[block] = np.minimum(np.where(as_extreme, np.exp(log_pmf), 0).sum(axis=1), 1.0)
+    pvalues[degenerate] = 1.0
+    return odds_ratios, pvalues
+
+# create a function to test all motifs of the summary records and correct the p-values for multiple testing
+def test_motifs(records):
+    motif_ids, tables = contingency_array(records)
+    odds_ratios, pvalues = fisher_exact_batch(tables)
+    adj_pvalues = stats.false_discovery_control(pvalues, method="bh") if len(pvalues) else pvalues
+    results_df = pd.DataFrame(tables.reshape(-1, 4), columns=contingency_fields)
+    results_df.insert(0, "motif_id", motif_ids)
+    results_df["odds_ratio"] = odds_ratios
+    results_df["pvalue"] = pvalues
+    results_df["adj_pvalue"] = adj_pvalues
+    return results_df
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_fisher_batch.py <top directory of the data-viz outputs> <output_path> [alpha (default: 0.05)]")
+        sys.exit(1)
+
+    records = load_summary_records(summary_path(sys.argv[1]))
+    output_path = sys.argv[2]
+    alpha = float(sys.argv[3]) if len(sys.argv) > 3 else 0.05
+
+    results_df = test_motifs(records)
+    print(f"Fisher exact tests of {len(results_df)} motifs have been computed.")
+    os.makedirs(output_path, exist_ok=True)
+    results_df.to_csv(f"{output_path}/AF-FPS_region_fisher_tests.tsv", sep="\t", index=False)
+    # keep the adjusted p-value dictionaries of the per-motif scripts
+    with open(f"{output_path}/AF-FPS_adjusted_pvalues_dictionary_ALL.tsv", "w") as file:
+        for motif_id, adj_pvalue in zip(results_df["motif_id"], results_df["adj_pvalue"]):
+            file.write("%s\t%s\n" % (motif_id, adj_pvalue))
+    sig_df = results_df[results_df["adj_pvalue"] < alpha]
+    with open(f"{output_path}/AF-FPS_adjusted_pvalues_dictionary_SIG.tsv", "w") as file:
+        for motif_id, adj_pvalue in zip(sig_df["motif_id"], sig_df["adj_pvalue"]):
+            file.write("%s\t%s\n" % (motif_id, adj_pvalue))
+    print(f"{len(sig_df)} motifs have an adjusted p-value below {alpha}.")
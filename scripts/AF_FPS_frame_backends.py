@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import time
+import logging
+import operator
+import functools
+import importlib.util
+import numpy as np
+import pandas as pd
+
+from natsort import index_natsorted
+from AF_FPS_stage_cache import file_digest, accumulator_source
+
+####################
+# define globals #
+####################
+
+# dataframe backend of the threshold-free covariant stages: 'pandas' is the reference, 'polars' runs them as one lazy multi-threaded query, and 'auto' uses Polars when it is installed
+frame_backend = os.environ.get("AF_FPS_FRAMES", "pandas")
+
+# strings read as missing values, as pandas does for the wide matrices ('NULL' is what the overlap stage writes); NaN strings are read as nulls so that sums skip them
+na_values = ["NULL", "NA", "N/A", "NaN", "nan", "-nan", "null", "None", "<NA>", ""]
+
+# columns of the merged statistics table, indexed by region_id
+stat_columns = ["sample_id", "AF", "FPS_scaled", "AF_var", "FPS_scaled_var"]
+
+# relative tolerance of the backend comparison when the results are not bit-identical
+compare_rtol = 1e-12
+
+# ranges below this are constant columns, which MinMaxScaler leaves unscaled
+scale_eps = 10 * np.finfo(np.float64).eps
+
+####################
+# define functions #
+####################
+
+# create a function to resolve the backend to run; Polars is only imported here, so that the pandas backend never loads it
+def select_frame_backend(backend=None):
+    backend = backend or frame_backend
+    if backend not in ("pandas", "polars", "auto"):
+        raise ValueError(f"Invalid dataframe backend {backend}. Please choose one of pandas, polars, auto.")
+    if backend == "pandas":
+        return "pandas"
+    try:
+        import polars
+    except ImportError:
+        if backend == "polars":
+            raise ImportError("The polars dataframe backend needs the polars package; use the pandas backend instead.")
+        return "pandas"
+    return "polars"
+
+# create a function to read the value columns of a wide matrix from its header, so that the scan can be told their types and read nothing else
+def wide_columns(tsv_filepath):
+    with open(tsv_filepath) as file:
+        header = file.readline().rstrip("\n").split("\t")
+    af_cols = [col for col in header if col.endswith("_AF")]
+    fps_cols = [col for col in header if col.endswith("_fps")]
+    return af_cols, fps_cols
+
+# create a function to scale a footprint score column to 0-1 with the arithmetic of MinMaxScaler: X * scale + min, where scale = 1 / range
+def scaled_expr(col):
+    import polars as pl
+    data_min = pl.col(col).min()
+    data_range = pl.col(col).max() - data_min
+    scale = 1.0 / pl.when(data_range < scale_eps).then(1.0).otherwise(data_range)
+    return pl.col(col) * scale + (0.0 - data_min * scale)
+
+# create a function to compute the sample variance across columns per row, skipping missing values, with the two-pass arithmetic of pandas' var(axis=1); the sums are left folds, as sum_horizontal may add in another order
+def variance_expr(cols):
+    import polars as pl
+    count = pl.sum_horizontal([pl.col(col).is_not_null() for col in cols])
+    mean = functools.reduce(operator.add, [pl.col(col).fill_null(0.0) for col in cols]) / count
+    squares = functools.reduce(operator.add, [((mean - pl.col(col)) ** 2).fill_null(0.0) for col in cols])
+    return pl.when(count > 1).then(squares / (count - 1)).otherwise(None)
+
+# create a function to load the per-region Welford accumulators of a wide matrix if they were written for it and describe exactly its regions and samples, as load_accumulators does
+def accumulator_frame(tsv_filepath, wide, n_samples):
+    import polars as pl
+    acc_filepath = str(tsv_filepath).replace("_fpscore-af-varsites-combined-matrix-wide.tsv", "_region-variance-accumulators.txt")
+    if not os.path.exists(acc_filepath):
+        return None
+    # a rerun of the overlap stage keeps the regions and samples but changes the values, so the accumulators must have been written for this very matrix
+    if accumulator_source(acc_filepath) != file_digest(tsv_filepath):
+        logging.warning(f"Accumulators in {acc_filepath} were not written for the current wide matrix. Recomputing variances instead.")
+        return None
+    accumulators = pl.read_csv(acc_filepath, separator="\t", comment_prefix="#", schema_overrides={"region_id": pl.String})
+    regions = wide.select("region_id").collect()["region_id"]
+    if accumulators.height != len(regions) or not accumulators["region_id"].is_in(regions.implode()).all() or not (accumulators["n"] == n_samples).all():
+        logging.warning(f"Accumulators in {acc_filepath} do not match the wide matrix. Recomputing variances instead.")
+        return None
+    return accumulators.lazy()
+
+# create a function to build the merged statistics table of a wide matrix as one lazy query: it reads only the region_id, _AF and _fps columns, and the melt, split, pivot and merge of the pandas backend become one stack of per-sample projections
+def merged_stat_polars(tsv_filepath):
+    import polars as pl
+    af_cols, fps_cols = wide_columns(tsv_filepath)
+    wide = pl.scan_csv(tsv_filepath, separator="\t", null_values=na_values, schema_overrides={"region_id": pl.String, **{col: pl.Float64 for col in af_cols + fps_cols}})
+    wide = wide.select(["region_id", *af_cols, *fps_cols])
+    # scaling is fitted on all regions, before the zero filter
+    wide = wide.with_columns([scaled_expr(col).alias(f"{col}_scaled") for col in fps_cols])
+    accumulators = accumulator_frame(tsv_filepath, wide, len(af_cols))
+    if accumulators is not None:
+        # sample variance from the Welford accumulators: M2 / (n - 1)
+        wide = wide.join(accumulators, on="region_id", how="left").with_columns(AF_var=pl.col("AF_M2") / (pl.col("n") - 1), FPS_scaled_var=pl.col("FPS_scaled_M2") / (pl.col("n") - 1))
+    else:
+        wide = wide.with_columns(AF_var=variance_expr(af_cols), FPS_scaled_var=variance_expr([f"{col}_scaled" for col in fps_cols]))
+
+    # one long frame of every sample with a footprint score column, in the sample order of the pivot
+    samples = sorted(col[:-len("_fps")] for col in fps_cols)
+    long = pl.concat([wide.select(
+        pl.col("region_id"),
+        pl.lit(sample, dtype=pl.String).alias("sample_id"),
+        (pl.col(f"{sample}_AF") if f"{sample}_AF" in af_cols else pl.lit(None, dtype=pl.Float64)).alias("AF"),
+        pl.col(f"{sample}_fps").alias("FPS"),
+        pl.col(f"{sample}_fps_scaled").alias("FPS_scaled"),
+        pl.col("AF_var"),
+        pl.col("FPS_scaled_var"),
+    ) for sample in samples])
+    # filter out the regions whose fps or AF sum to zero across the sample_ids
+    long = long.filter((pl.col("FPS").sum().over("region_id") > 0) & (pl.col("AF").sum().over("region_id") > 0))
+    merged = long.collect()
+
+    # sort the regions naturally and the samples of each region by name, as the pandas backend does
+    regions = merged["region_id"].unique(maintain_order=True).to_list()
+    region_order = pl.DataFrame({"region_id": [regions[i] for i in index_natsorted(regions)]}, schema={"region_id": pl.String}).with_row_index("region_rank")
+    merged = merged.join(region_order, on="region_id").sort(["region_rank", "sample_id"])
+    # converted column by column, so that pyarrow is not needed
+    merged_stat = pd.DataFrame({col: merged[col].to_numpy() for col in ["region_id", *stat_columns]}).set_index("region_id")
+    return merged_stat
+
+# create a function to load the covariant site extraction script, which holds the pandas reference; its filename is hyphenated, so it is loaded by path
+def covariant_module():
+    spec = importlib.util.spec_from_file_location("AF_FPS_covariant_site_extraction", os.path.join(os.path.dirname(os.path.abspath(__file__)), "AF_FPS-covariant_site_extraction.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# create a function to run both backends on the same wide matrix and check that their merged statistics are equal
+def compare_backends(tsv_filepath, covariant=None):
+    covariant = covariant or covariant_module()
+    results = {}
+    for backend in ("pandas", "polars"):
+        start = time.perf_counter()
+        results[backend] = covariant.build_merged_stat(tsv_filepath, None, backend)
+        print(f"{os.path.basename(str(tsv_filepath))}: {backend} backend {time.perf_counter() - start:.3f} s, {len(results[backend])} rows")
+    reference, candidate = results["pandas"], results["polars"]
+    if reference.equals(candidate) and reference.index.equals(candidate.index):
+        print("pandas and polars backends agree exactly.")
+        return True
+    same = reference.shape == candidate.shape and reference.index.equals(candidate.index) and reference["sample_id"].equals(candidate["sample_id"])
+    if same:
+        # pandas' default float parser is not correctly rounded for 17-digit values such as the Welford accumulators, so the variances read from them may differ in the last bit
+        diffs = {col: float(np.nanmax(np.abs(reference[col].to_numpy() - candidate[col].to_numpy()), initial=0.0)) for col in stat_columns[1:]}
+        same = all(np.allclose(reference[col].to_numpy(), candidate[col].to_numpy(), rtol=compare_rtol, atol=0.0, equal_nan=True) for col in stat_columns[1:])
+        print(f"Largest absolute differences: {diffs}")
+    print(f"pandas and polars backends {f'agree to a relative tolerance of {compare_rtol}' if same else 'DISAGREE'}.")
+    return same
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 2:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_frame_backends.py <wide matrix tsv> [more wide matrix tsv files ...]")
+        print("Builds the merged variance statistics with the pandas and polars backends and checks that they are equal.")
+        sys.exit(1)
+
+    select_frame_backend("polars")
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    covariant = covariant_module()
+    sys.exit(0 if all([compare_backends(path, covariant) for path in sys.argv[1:]]) else 1)
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import glob
+import shutil
+import logging
+import tempfile
+import warnings
+import contextlib
+import numpy as np
+import pandas as pd
+
+from natsort import index_natsorted
+from AF_FPS_overlap_raw_matrices_into_widetable import tfbs_suffix, load_tfbs, load_vcf, find_files, pair_vcf_paths, finalise_wide_matrix, tiebreak_order, process_file, process_batch
+from AF_FPS_partitioned_output import legacy_tables, dataset_dirname, export_motif_views
+from AF_FPS_async_writer import read_table, resolve_table
+from AF_FPS_worker_daemon import pipeline_module, overlap_job, covariant_job
+import AF_FPS_kernels
+import AF_FPS_frame_backends
+
+####################
+# define globals #
+####################
+
+# the demo inputs shipped with the repo
+demo_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "demo-data")
+
+# wide matrices of the overlap stage
+matrix_suffix = "_fpscore-af-varsites-combined-matrix-wide.tsv"
+
+# the stages in pipeline order, and the columns that identify a row of each stage's table; rows are compared by these keys, not by their order in the file
+stage_keys = {
+    "wide_matrix": ["region_id"],
+    "covariant_sites": ["region_id", "sample_id"],
+    "correlation_tests": ["region_id"],
+    "fdr_corrected": ["region_id"],
+    "fdr_corrected_sig": ["region_id"],
+}
+
+# numeric columns match when |candidate - legacy| <= atol + rtol * |legacy|; missing values only match missing values
+rtol = 1e-9
+atol = 1e-12
+
+# thresholds of the covariant stage
+iqr_multiplier = 1.5
+fdr_alpha = 0.05
+
+# subtypes of the synthetic samples; their score columns follow the <accession>_<subtype>_score pattern of the real matrices
+synthetic_subtypes = ["LumA", "LumB", "Basal", "Her2", "Norm"]
+synthetic_chroms = ["chr1", "chr2", "chr10", "chrX"]
+
+####################
+# define functions #
+####################
+
+# create a function to overlap a TFBS matrix with the variant sites of every dataset ID exactly as the original pyranges implementation did; it is kept frozen here as the reference for every faster overlap
+# with `tiebreak`, the joined rows are ordered by the tie-break of the current overlap before the max-AF selection, which changes only the winners of AF ties
+def legacy_overlap(gr_fpscore, grs_vcf_dict, tiebreak=False):
+    import pyranges as pr
+    count = 0
+    for key, val in grs_vcf_dict.items():
+        if count == 0:
+            overlap = gr_fpscore.join(val, how='left', suffix=f"_{key}_varsite_pos", preserve_order=True)
+        else:
+            overlap = filtered_gr.join(val, how='left', suffix=f"_{key}_varsite_pos", preserve_order=True)
+        overlap = overlap.drop([f"End_{key}_varsite_pos"])
+        overlap = overlap.cluster(slack=-1)
+        overlap_df = tiebreak_order(overlap.df, key) if tiebreak else overlap.df
+        filtered_df = overlap_df.loc[overlap_df.groupby('Cluster')['AF'].idxmax()]
+        filtered_df = filtered_df.rename(columns={f"Start_{key}_varsite_pos": f"{key}_varsite_pos", "ref_allele": f"{key}_REF_al", "alt_allele": f"{key}_ALT_al", "AF": f"{key}_AF"})
+        replace_dict = {f"{key}_varsite_pos": {-1: None}, f"{key}_REF_al": {str(-1): None}, f"{key}_ALT_al": {str(-1): None}, f"{key}_AF": {-1: 0}}
+        filtered_df = filtered_df.replace(replace_dict)
+        filtered_df = filtered_df.drop(columns=["Cluster"])
+        filtered_gr = pr.PyRanges(filtered_df)
+        count += 1
+    return filtered_gr
+
+# create a function to build the variance statistics of a wide matrix exactly as the original melt/pivot, MinMaxScaler and var(axis=1) stages did
+def legacy_merged_stat(tsv_filepath):
+    from sklearn.preprocessing import MinMaxScaler
+    dt_afps = pd.read_csv(tsv_filepath, sep='\t')
+    # long table of the AF and raw FPS values
+    afps_df_long = dt_afps.filter(regex='_AF$|_fps$|_id$').copy().melt(id_vars=["region_id"], var_name="variable", value_name="value")
+    afps_df_long[['sample_id', 'type']] = afps_df_long['variable'].str.rsplit('_', n=1, expand=True)
+    afps_df_long = afps_df_long.drop(columns=["variable"])
+    afps_df_lpv = afps_df_long.pivot(index=['region_id', 'sample_id'], columns='type', values='value').reset_index()
+    afps_df_lpv = afps_df_lpv.rename_axis(None, axis=1).rename(columns={'fps': 'FPS'})
+    afps_df_lpv = afps_df_lpv.reindex(index=index_natsorted(afps_df_lpv['region_id'])).reset_index(drop=True)
+    # FPS scaled to the range of each sample, in the same long format
+    fps_df_scaled = dt_afps.filter(regex='_fps$|_id$').copy().set_index('region_id')
+    fps_df_scaled = pd.DataFrame(MinMaxScaler().fit_transform(fps_df_scaled), columns=fps_df_scaled.columns, index=fps_df_scaled.index).add_suffix('_scaled')
+    fps_df_scaled_long = fps_df_scaled.reset_index().melt(id_vars=["region_id"], var_name="variable", value_name="value")
+    fps_df_scaled_long[['part1', 'part2', 'part3']] = fps_df_scaled_long['variable'].str.rsplit('_', n=2, expand=True)
+    fps_df_scaled_long['sample_id'] = fps_df_scaled_long['part1']
+    fps_df_scaled_long['type'] = fps_df_scaled_long['part2'].str.upper() + '_' + fps_df_scaled_long['part3']
+    fps_df_scaled_long = fps_df_scaled_long.drop(['variable', 'part1', 'part2', 'part3'], axis=1)
+    fps_df_scaled_lpv = fps_df_scaled_long.pivot(index=['region_id', 'sample_id'], columns='type', values='value').reset_index().rename_axis(None, axis=1)
+    fps_df_scaled_lpv = fps_df_scaled_lpv.reindex(index=index_natsorted(fps_df_scaled_lpv['region_id'])).reset_index(drop=True)
+    afps_full_dfl = afps_df_lpv.merge(fps_df_scaled_lpv, on=['region_id', 'sample_id'])
+    # drop the regions with all-zero FPS or AF, and take the variances across the samples of the wide tables
+    merged_filt_dfl = afps_full_dfl.groupby('region_id').filter(lambda x: x['FPS'].sum() > 0 and x['AF'].sum() > 0)
+    merged_filt_uniq_regid = merged_filt_dfl['region_id'].unique()
+    af_df = dt_afps.filter(regex='_AF$|_id$').copy()
+    af_df_filt_idx = af_df[af_df['region_id'].isin(merged_filt_uniq_regid)].set_index('region_id')
+    af_df_filt_idx['AF_var'] = af_df_filt_idx.var(axis=1)
+    fps_df_scaled_filt_idx = fps_df_scaled[fps_df_scaled.index.isin(merged_filt_uniq_regid)].copy()
+    fps_df_scaled_filt_idx['FPS_scaled_var'] = fps_df_scaled_filt_idx.var(axis=1)
+    merged_var = af_df_filt_idx.filter(regex='_var$|_id$').copy().merge(fps_df_scaled_filt_idx.filter(regex='_var$|_id$').copy(), left_index=True, right_index=True)
+    merged_stat = merged_filt_dfl.set_index('region_id').merge(merged_var, left_index=True, right_index=True)
+    return merged_stat[['sample_id', 'AF', 'FPS_scaled', 'AF_var', 'FPS_scaled_var']]
+
+# create a function to test every covariant site for Spearman correlation exactly as the original per-region scipy loop did
+def legacy_correlations(covar_sites_sorted):
+    from scipy.stats import spearmanr
+    covar_sites_sorted_novars = covar_sites_sorted.drop(columns=['AF_var', 'FPS_scaled_var']).reset_index()
+    columns = ['region_id', 'corr_coeff', 'pvalue']
+    if covar_sites_sorted_novars.empty:
+        return pd.DataFrame({col: pd.Series(dtype=object if col == 'region_id' else float) for col in columns})
+    # constant regions are expected and give NaN correlations
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        correlations = covar_sites_sorted_novars.groupby('region_id').apply(lambda group: spearmanr(group['AF'], group['FPS_scaled']), include_groups=False)
+    correlations_df = pd.DataFrame(correlations, columns=['corr_coeff_and_pvalue'])
+    correlations_df[['corr_coeff', 'pvalue']] = correlations_df['corr_coeff_and_pvalue'].apply(pd.Series)
+    correlations_df = correlations_df.drop(columns=['corr_coeff_and_pvalue']).reset_index()
+    return correlations_df.reindex(index=index_natsorted(correlations_df['region_id'])).reset_index(drop=True)
+
+# create a function to select the covariant sites exactly as the original upper-fence IQR filter did
+def legacy_covariant_sites(merged_stat, iqr_multiplier=iqr_multiplier):
+    merged_stat_vars = merged_stat[['AF_var', 'FPS_scaled_var']].copy().drop_duplicates()
+    fences = {}
+    for col in ['AF_var', 'FPS_scaled_var']:
+        q1, q3 = merged_stat_vars[col].quantile(0.25), merged_stat_vars[col].quantile(0.75)
+        fences[col] = q3 + iqr_multiplier * (q3 - q1)
+    outliers = merged_stat_vars[(merged_stat_vars['AF_var'] > fences['AF_var']) & (merged_stat_vars['FPS_scaled_var'] > fences['FPS_scaled_var'])]
+    covar_sites = merged_stat[merged_stat.index.isin(outliers.index.tolist())]
+    return covar_sites, covar_sites.sort_values(by=['AF_var', 'FPS_scaled_var'], ascending=[False, False])
+
+# create a function to get the path of one stage's table in an output layout, whatever compression or filter view it was written with
+def stage_path(wide_dir, output_path, motif_id, stage):
+    if stage == "wide_matrix":
+        return resolve_table(os.path.join(wide_dir, f"{motif_id}{matrix_suffix}"))
+    subdir, suffix = legacy_tables[stage]
+    return resolve_table(os.path.join(output_path, subdir, f"{motif_id}{suffix}"))
+
+# create a function to load one stage's table; the row number columns of the per-motif tables carry no information and are dropped
+def read_stage(path):
+    df = read_table(path, sep="\t")
+    return df.drop(columns=[col for col in df.columns if col.startswith("Unnamed")])
+
+# create a function to compare one stage's tables row by row on their keys; returns None when they match, and a description of the first difference otherwise
+def compare_tables(reference, candidate, keys, rtol=rtol, atol=atol):
+    if set(reference.columns) != set(candidate.columns):
+        return f"columns differ: only in legacy {sorted(set(reference.columns) - set(candidate.columns))}, only in candidate {sorted(set(candidate.columns) - set(reference.columns))}"
+    # the row order of a table is not part of its result
+    reference = reference.sort_values(by=keys, kind="stable").reset_index(drop=True)
+    candidate = candidate[reference.columns].sort_values(by=keys, kind="stable").reset_index(drop=True)
+    reference_keys = set(map(tuple, reference[keys].astype(str).to_numpy()))
+    candidate_keys = set(map(tuple, candidate[keys].astype(str).to_numpy()))
+    if reference_keys != candidate_keys:
+        only_reference, only_candidate = sorted(reference_keys - candidate_keys), sorted(candidate_keys - reference_keys)
+        return f"{len(only_reference)} rows only in legacy {only_reference[:3]}, {len(only_candidate)} rows only in candidate {only_candidate[:3]}"
+    if len(reference) != len(candidate):
+        return f"{len(reference)} rows in legacy but {len(candidate)} in candidate"
+    for col in reference.columns:
+        if pd.api.types.is_numeric_dtype(reference[col]) and pd.api.types.is_numeric_dtype(candidate[col]):
+            a, b = reference[col].to_numpy(dtype=float), candidate[col].to_numpy(dtype=float)
+            matches = np.isclose(b, a, rtol=rtol, atol=atol, equal_nan=True)
+        else:
+            a, b = reference[col].astype(str).where(reference[col].notna(), "NULL").to_numpy(), candidate[col].astype(str).where(candidate[col].notna(), "NULL").to_numpy()
+            matches = a == b
+        if not matches.all():
+            first = int(np.flatnonzero(~matches)[0])
+            return f"{col}: {int((~matches).sum())} of {len(matches)} values differ, first at {dict(reference.loc[first, keys])} (legacy {np.asarray(a[first]).item()!r}, candidate {np.asarray(b[first]).item()!r})"
+    return None
+
+# create a function to check whether two tables are identical to the last bit, beyond matching within the tolerances
+def identical_tables(reference, candidate, keys):
+    reference = reference.sort_values(by=keys, kind="stable").reset_index(drop=True)
+    candidate = candidate[reference.columns].sort_values(by=keys, kind="stable").reset_index(drop=True)
+    return reference.equals(candidate)
+
+# create a function to compare all stages of one motif in pipeline order and report the first stage that diverges
+def compare_motif(reference_dirs, candidate_dirs, motif_id):
+    statuses = []
+    for stage, keys in stage_keys.items():
+        reference_path, candidate_path = stage_path(*reference_dirs, motif_id, stage), stage_path(*candidate_dirs, motif_id, stage)
+        if reference_path is None or candidate_path is None:
+            return statuses, stage, f"missing output ({'legacy' if reference_path is None else 'candidate'})"
+        reference, candidate = read_stage(reference_path), read_stage(candidate_path)
+        difference = compare_tables(reference, candidate, keys)
+        if difference is not None:
+            return statuses, stage, difference
+        statuses.append((stage, "identical" if identical_tables(reference, candidate, keys) else "within tolerance"))
+    return statuses, None, None
+
+# create a function to write the wide matrices and covariant tables of the legacy path: the pyranges overlap, the melt/pivot variance statistics and the per-region scipy correlations
+# the vcf extracts are paired with their dataset IDs by accession; the original pairing followed the directory walk order, which depends on the filesystem
+def run_legacy(inputs, work_dir, tiebreak=False):
+    import pyranges as pr
+    from statsmodels.stats.multitest import multipletests
+    wide_dir = os.path.join(work_dir, "wide")
+    os.makedirs(wide_dir, exist_ok=True)
+    for subdir, _ in legacy_tables.values():
+        os.makedirs(os.path.join(work_dir, subdir), exist_ok=True)
+    for file in inputs["files"]:
+        motif_id, df_fps = load_tfbs(file)
+        vcf_paths = find_files(inputs["af_path"], f"*{motif_id}*.txt")
+        grs = {dataset: pr.PyRanges(load_vcf(path)) for dataset, path in pair_vcf_paths(vcf_paths, inputs["dataset_ids"]).items()}
+        target_df = finalise_wide_matrix(legacy_overlap(pr.PyRanges(df_fps), grs, tiebreak).df)
+        tsv_filepath = os.path.join(wide_dir, f"{motif_id}{matrix_suffix}")
+        target_df.to_csv(tsv_filepath, sep="\t", index=False, na_rep='NULL')
+
+        merged_stat = legacy_merged_stat(tsv_filepath)
+        covar_sites, covar_sites_sorted = legacy_covariant_sites(merged_stat)
+        covar_sites.to_csv(os.path.join(work_dir, *legacy_tables["covariant_sites"][:1], f"{motif_id}{legacy_tables['covariant_sites'][1]}"), sep="\t", index=True)
+        corr_df = legacy_correlations(covar_sites_sorted)
+        corr_df.to_csv(os.path.join(work_dir, legacy_tables["correlation_tests"][0], f"{motif_id}{legacy_tables['correlation_tests'][1]}"), sep="\t", index=True)
+        corr_df['adj_pvalues'] = multipletests(corr_df['pvalue'], alpha=fdr_alpha, method='fdr_bh')[1] if len(corr_df) else pd.Series(dtype=float)
+        corr_df.to_csv(os.path.join(work_dir, legacy_tables["fdr_corrected"][0], f"{motif_id}{legacy_tables['fdr_corrected'][1]}"), sep="\t", index=True)
+        corr_df[corr_df['adj_pvalues'] < fdr_alpha].to_csv(os.path.join(work_dir, legacy_tables["fdr_corrected_sig"][0], f"{motif_id}{legacy_tables['fdr_corrected_sig'][1]}"), sep="\t", index=True)
+    return wide_dir, work_dir
+
+# create a function to run the covariant stage of the current pipeline on every wide matrix of a directory
+def run_covariant(wide_dir, output_path, **options):
+    covariant = pipeline_module("covariant")
+    for subdir, _ in legacy_tables.values():
+        os.makedirs(os.path.join(output_path, subdir), exist_ok=True)
+    for tsv_filepath in sorted(glob.glob(os.path.join(wide_dir, f"*{matrix_suffix}"))):
+        covariant.process_data(tsv_filepath, output_path, iqr_multiplier, fdr_alpha, **options)
+
+# create a function to run the current overlap one motif at a time, then the current covariant stage
+def run_current(inputs, work_dir, index_mode=None, tiebreak=False):
+    wide_dir = os.path.join(work_dir, "wide")
+    os.makedirs(wide_dir, exist_ok=True)
+    for file in inputs["files"]:
+        process_file(file, inputs["af_path"], inputs["dataset_ids"], wide_dir, index_mode, tiebreak=tiebreak)
+    run_covariant(wide_dir, work_dir)
+    return wide_dir, work_dir
+
+# create a function to run the current pipeline with the binned coordinate index, which writes the wide matrices in coordinate order
+def run_indexed(inputs, work_dir):
+    return run_current(inputs, work_dir, "index")
+
+# create a function to run the batched overlap of all motifs in one pass, then the current covariant stage
+def run_batch(inputs, work_dir):
+    wide_dir = os.path.join(work_dir, "wide")
+    os.makedirs(wide_dir, exist_ok=True)
+    process_batch(inputs["files"], inputs["af_path"], inputs["dataset_ids"], wide_dir)
+    run_covariant(wide_dir, work_dir)
+    return wide_dir, work_dir
+
+# create a function to run one cohort through the cohort-manifest mode, which overlaps against a coordinate-only TFBS index
+def run_cohort(inputs, work_dir):
+    from AF_FPS_cohort_manifest import process_motif, wide_dirname
+    cohort = {"cohort": "harness", "af_path": inputs["af_path"], "dataset_ids": inputs["dataset_ids"], "output_path": work_dir}
+    for file in inputs["files"]:
+        for _, motif_id, status, outputs in process_motif(file, [cohort], iqr_multiplier=iqr_multiplier, fdr_alpha=fdr_alpha):
+            if status != "done":
+                raise RuntimeError(f"Cohort run of {motif_id} failed: {outputs[0]}")
+    return os.path.join(work_dir, wide_dirname), work_dir
+
+# create a function to run the jobs of the worker daemon in this process, with its warm variant store
+def run_daemon_jobs(inputs, work_dir):
+    wide_dir = os.path.join(work_dir, "wide")
+    for file in inputs["files"]:
+        overlap_job(file, inputs["af_path"], inputs["dataset_ids"], wide_dir)
+    for tsv_filepath in sorted(glob.glob(os.path.join(wide_dir, f"*{matrix_suffix}"))):
+        covariant_job(tsv_filepath, work_dir, iqr_multiplier, fdr_alpha)
+    return wide_dir, work_dir
+
+# create a function to run the covariant stage twice with a stage cache, comparing the run that reuses the cached stages
+def run_stage_cache(inputs, work_dir):
+    wide_dir, _ = run_current(inputs, os.path.join(work_dir, "cold"))
+    run_covariant(wide_dir, work_dir, cache_dir=os.path.join(work_dir, "cache"))
+    warm_dir = os.path.join(work_dir, "warm")
+    run_covariant(wide_dir, warm_dir, cache_dir=os.path.join(work_dir, "cache"))
+    return wide_dir, warm_dir
+
+# create a function to overlap the distinct regions of all motifs once through the region registry, then expand the per-motif views and run the current covariant stage
+def run_registry(inputs, work_dir):
+    from AF_FPS_region_registry import build_registry, overlap_registry, motif_view
+    wide_dir = os.path.join(work_dir, "wide")
+    os.makedirs(wide_dir, exist_ok=True)
+    regions, motif_index = build_registry(inputs["files"])
+    motif_ids = motif_index["motif_id"].unique().tolist()
+    registry = overlap_registry(regions, motif_ids, inputs["af_path"], inputs["dataset_ids"])
+    for motif_id in motif_ids:
+        motif_view(registry, motif_index, motif_id).to_csv(os.path.join(wide_dir, f"{motif_id}{matrix_suffix}"), sep="\t", index=False, na_rep='NULL')
+    run_covariant(wide_dir, work_dir)
+    return wide_dir, work_dir
+
+# create a function to overlap all samples but the last one, append the last one to the wide matrices, then run the current covariant stage
+def run_append(inputs, work_dir):
+    from AF_FPS_append_sample_to_widetable import append_sample
+    *first_ids, last_id = inputs["dataset_ids"]
+    accession = last_id.split('_')[0]
+    # stage the inputs of the first samples: the TFBS matrices without the score column of the last sample, and the vcf extracts of the other samples
+    fps_path, af_path = os.path.join(work_dir, "inputs", "fps"), os.path.join(work_dir, "inputs", "af")
+    os.makedirs(fps_path, exist_ok=True)
+    os.makedirs(af_path, exist_ok=True)
+    for file in inputs["files"]:
+        tfbs_df = pd.read_csv(file, sep="\t", dtype=str, keep_default_na=False)
+        tfbs_df.drop(columns=[col for col in tfbs_df.columns if col.startswith(f"{accession}_")]).to_csv(os.path.join(fps_path, os.path.basename(file)), sep="\t", index=False)
+    for path in find_files(inputs["af_path"], "*.txt"):
+        if not os.path.basename(path).startswith(f"{accession}_"):
+            shutil.copy(path, af_path)
+    wide_dir = os.path.join(work_dir, "wide")
+    os.makedirs(wide_dir, exist_ok=True)
+    for file in sorted(glob.glob(os.path.join(fps_path, f"*{tfbs_suffix}"))):
+        process_file(file, af_path, first_ids, wide_dir)
+    for tsv_filepath in sorted(glob.glob(os.path.join(wide_dir, f"*{matrix_suffix}"))):
+        append_sample(tsv_filepath, inputs["fps_path"], inputs["af_path"], last_id, wide_dir)
+    run_covariant(wide_dir, work_dir)
+    return wide_dir, work_dir
+
+# create a function to write the covariant tables into the partitioned dataset and export the per-motif views back out
+def run_dataset_output(inputs, work_dir):
+    wide_dir, _ = run_current(inputs, os.path.join(work_dir, "plain"))
+    run_covariant(wide_dir, work_dir, dataset_output=True)
+    export_dir = os.path.join(work_dir, "exported")
+    for tsv_filepath in glob.glob(os.path.join(wide_dir, f"*{matrix_suffix}")):
+        export_motif_views(os.path.join(work_dir, dataset_dirname), os.path.basename(tsv_filepath).replace(matrix_suffix, ""), export_dir)
+    return wide_dir, export_dir
+
+# create a function to write the covariant tables gzip-compressed, with the significant table as a filter view
+def run_gzip_dedup(inputs, work_dir):
+    wide_dir, _ = run_current(inputs, os.path.join(work_dir, "plain"))
+    run_covariant(wide_dir, work_dir, compression="gzip", dedup=True)
+    return wide_dir, work_dir
+
+# create a function to temporarily switch a module-level backend setting
+@contextlib.contextmanager
+def backend_setting(module, name, value):
+    previous = getattr(module, name)
+    setattr(module, name, value)
+    try:
+        yield
+    finally:
+        setattr(module, name, previous)
+
+# create a function to run the current pipeline with the NumPy kernels, whichever kernels are installed; the overlap uses the kernels on its tie-break path
+def run_numpy_kernels(inputs, work_dir):
+    with backend_setting(AF_FPS_kernels, "kernel_backend", "numpy"):
+        return run_current(inputs, work_dir, tiebreak=True)
+
+# create a function to run the current pipeline with the Numba kernels
+def run_numba_kernels(inputs, work_dir):
+    with backend_setting(AF_FPS_kernels, "kernel_backend", "numba"):
+        return run_current(inputs, work_dir, tiebreak=True)
+
+# create a function to run the current pipeline with the Polars dataframe backend for the variance stages
+def run_polars(inputs, work_dir):
+    with backend_setting(AF_FPS_frame_backends, "frame_backend", "polars"):
+        return run_current(inputs, work_dir)
+
+# create a function to check whether an optional package of a candidate is installed
+def installed(package):
+    import importlib.util
+    return importlib.util.find_spec(package) is not None
+
+# candidate paths, and the optional package each one needs
+candidates = {
+    "current": (run_current, None),
+    "numpy-kernels": (run_numpy_kernels, None),
+    "numba-kernels": (run_numba_kernels, "numba"),
+    "polars": (run_polars, "polars"),
+    "batch": (run_batch, None),
+    "indexed": (run_indexed, None),
+    "cohort": (run_cohort, None),
+    "daemon-jobs": (run_daemon_jobs, None),
+    "stage-cache": (run_stage_cache, None),
+    "dataset-output": (run_dataset_output, None),
+    "gzip-dedup": (run_gzip_dedup, None),
+    "registry": (run_registry, None),
+    "append": (run_append, None),
+}
+
+# create a function to derive the dataset IDs of a TFBS matrix from its score columns, one per vcf extract, matched by accession as the pipeline does
+def derive_dataset_ids(tfbs_file, vcf_paths):
+    _, df_fps = load_tfbs(tfbs_file)
+    fps_cols = [col for col in finalise_wide_matrix(df_fps.head(0).copy()).columns if col.endswith("_fps")]
+    dataset_ids = []
+    for path in sorted(vcf_paths):
+        accession = os.path.basename(path).split('_')[0]
+        matches = [col for col in fps_cols if col.split('_')[0] == accession]
+        if len(matches) != 1:
+            raise ValueError(f"Cannot derive the dataset ID of {os.path.basename(path)} from the score columns of {os.path.basename(tfbs_file)}")
+        dataset_ids.append(matches[0][:-len("_fps")])
+    return dataset_ids
+
+# create a function to stage a directory holding TFBS matrices and vcf extracts side by side (like demo-data) into separate input directories, as the pipeline expects
+def stage_inputs(source_dir, input_dir):
+    fps_path, af_path = os.path.join(input_dir, "fps"), os.path.join(input_dir, "af")
+    os.makedirs(fps_path, exist_ok=True)
+    os.makedirs(af_path, exist_ok=True)
+    files = sorted(glob.glob(os.path.join(source_dir, f"*{tfbs_suffix}")))
+    motif_ids = [os.path.basename(file).replace(tfbs_suffix, "") for file in files]
+    for file in files:
+        shutil.copy(file, fps_path)
+    for path in glob.glob(os.path.join(source_dir, "*.txt")):
+        if not path.endswith(tfbs_suffix) and any(motif_id in os.path.basename(path) for motif_id in motif_ids):
+            shutil.copy(path, af_path)
+    staged_files = sorted(glob.glob(os.path.join(fps_path, f"*{tfbs_suffix}")))
+    dataset_ids = derive_dataset_ids(staged_files[0], find_files(af_path, f"*{motif_ids[0]}*.txt"))
+    return {"fps_path": fps_path, "af_path": af_path, "dataset_ids": dataset_ids, "files": staged_files}
+
+# create a function to generate synthetic inputs that exercise the edge cases of the overlap and statistics: overlapping sites and sites with equal starts, several variants per site with AF ties and indels, variants on site boundaries, zero scores and constant regions
+def synthetic_inputs(input_dir, n_sites=2000, seed=0, n_samples=5, motif_ids=("SYN1_SYNTH.0.A", "SYN2_SYNTH.0.B")):
+    rng = np.random.default_rng(seed)
+    fps_path, af_path = os.path.join(input_dir, "fps"), os.path.join(input_dir, "af")
+    os.makedirs(fps_path, exist_ok=True)
+    os.makedirs(af_path, exist_ok=True)
+    accessions = ["".join(rng.choice(list("ABCDEFGHJKLMNPQRSTUVWXYZ0123456789"), 7)) for _ in range(n_samples)]
+    subtypes = [synthetic_subtypes[i % len(synthetic_subtypes)] for i in range(n_samples)]
+    dataset_ids = [f"{accession}_{subtype[0].lower()}{subtype[1:]}" for accession, subtype in zip(accessions, subtypes)]
+    afs = np.round(rng.integers(1, 9, 64) / rng.integers(8, 25, 64), 6).clip(0, 1)
+    alleles = [("C", "G"), ("T", "C"), ("A", "G"), ("GGCGC", "G"), ("G", "GTT")]
+
+    # every sample has one genome-wide set of variant calls, and the extract of a motif holds the calls inside its sites, as the per-motif extracts of real cohorts do
+    call_rows = {accession: [] for accession in accessions}
+    motif_sites = []
+    site_scores = {}
+    for motif_id in motif_ids:
+        chroms = rng.choice(synthetic_chroms, n_sites)
+        starts = np.empty(n_sites, dtype=np.int64)
+        ends = np.empty(n_sites, dtype=np.int64)
+        for chrom in synthetic_chroms:
+            in_chrom = np.flatnonzero(chroms == chrom)
+            starts[in_chrom] = rng.choice(np.arange(10000, 10000 + 40 * n_sites), len(in_chrom), replace=False)
+            ends[in_chrom] = starts[in_chrom] + rng.integers(8, 21, len(in_chrom))
+            # some sites share the start of another site of the chromosome; their ends are longer than any other site's, so that no two sites share both coordinates
+            shared = in_chrom[rng.uniform(size=len(in_chrom)) < 0.05]
+            originals = np.setdiff1d(in_chrom, shared)
+            if len(shared) and len(originals):
+                starts[shared] = starts[rng.choice(originals, len(shared))]
+                ends[shared] = starts[shared] + 21 + np.arange(len(shared))
+        motif_sites.append((chroms, starts, ends))
+        scores = np.round(rng.uniform(0, 1, (n_sites, n_samples)), 5)
+        scores[rng.uniform(size=(n_sites, n_samples)) < 0.3] = 0
+        scores[rng.uniform(size=n_sites) < 0.1] = 0
+        # footprint scores belong to a region, so a site that an earlier motif also has keeps the scores it had there
+        for site, coords in enumerate(zip(chroms, starts, ends)):
+            scores[site] = site_scores.setdefault(coords, scores[site])
+        tfbs_df = pd.DataFrame({"TFBS_chr": chroms, "TFBS_start": starts, "TFBS_end": ends, "TFBS_strand": rng.choice(["+", "-"], n_sites), "TFBS_score": np.round(rng.uniform(5, 10, n_sites), 5)})
+        for sample, (accession, subtype) in enumerate(zip(accessions, subtypes)):
+            tfbs_df[f"{accession}_{subtype}_score"] = scores[:, sample]
+        tfbs_df.to_csv(os.path.join(fps_path, f"{motif_id}{tfbs_suffix}"), sep="\t", index=False)
+
+        for site in np.flatnonzero(rng.uniform(size=n_sites) < 0.7):
+            # a pool of variants per site shared by the samples, with their positions inside the site or on its boundaries
+            positions = rng.integers(starts[site], ends[site] + 1, rng.integers(1, 4))
+            pool = [(chroms[site], int(pos), *alleles[rng.integers(len(alleles))]) for pos in positions]
+            for accession in accessions:
+                if rng.uniform() < 0.8:
+                    # in some sites all variants of a sample have the same AF, so that the max-AF selection meets ties
+                    tied_af = afs[rng.integers(len(afs))] if rng.uniform() < 0.3 else None
+                    for variant in pool:
+                        if rng.uniform() < 0.7:
+                            call_rows[accession].append((*variant, tied_af if tied_af is not None else afs[rng.integers(len(afs))]))
+
+    for accession in accessions:
+        calls_df = pd.DataFrame(call_rows[accession], columns=["#[1]CHROM", "[2]POS", "[3]REF", "[4]ALT", "[5]AF"]).drop_duplicates(subset=["#[1]CHROM", "[2]POS", "[3]REF", "[4]ALT"])
+        calls_df = calls_df.sort_values(by=["#[1]CHROM", "[2]POS"], kind="stable")
+        for motif_id, (chroms, starts, ends) in zip(motif_ids, motif_sites):
+            inside = np.zeros(len(calls_df), dtype=bool)
+            for chrom in synthetic_chroms:
+                in_chrom = (calls_df["#[1]CHROM"] == chrom).to_numpy()
+                order = np.argsort(starts[chroms == chrom])
+                chrom_starts, chrom_ends = starts[chroms == chrom][order], np.maximum.accumulate(ends[chroms == chrom][order])
+                if not len(chrom_starts):
+                    continue
+                positions = calls_df["[2]POS"].to_numpy()[in_chrom]
+                # a call is inside a site when the last site starting at or before it ends at or after it
+                last = np.searchsorted(chrom_starts, positions, side="right") - 1
+                inside[in_chrom] = (last >= 0) & (chrom_ends[np.maximum(last, 0)] >= positions)
+            calls_df[inside].to_csv(os.path.join(af_path, f"{accession}_{motif_id}_AF-per-site-with-indels.txt"), sep="\t", index=False)
+    return {"fps_path": fps_path, "af_path": af_path, "dataset_ids": dataset_ids, "files": sorted(glob.glob(os.path.join(fps_path, f"*{tfbs_suffix}")))}
+
+# create a function to run the legacy path and every selected candidate on the same inputs and report, per motif, the first stage where a candidate diverges
+# a candidate that differs from the legacy path but matches it once the tie-break of the current overlap is applied is reported separately, as a tie-break difference
+def run_harness(inputs, work_dir, selected=None):
+    reference_dirs = run_legacy(inputs, os.path.join(work_dir, "legacy"))
+    tiebreak_dirs = run_legacy(inputs, os.path.join(work_dir, "legacy-tiebreak"), tiebreak=True)
+    motif_ids = [os.path.basename(file).replace(tfbs_suffix, "") for file in inputs["files"]]
+    report, ties = [], []
+    for name in selected or candidates:
+        function, package = candidates[name]
+        if package is not None and not installed(package):
+            print(f"SKIP {name}: {package} is not installed")
+            continue
+        try:
+            candidate_dirs = function(inputs, os.path.join(work_dir, name))
+        # a candidate that crashes diverges at its first stage
+        except (Exception, SystemExit) as e:
+            report.append((name, "*", "run", repr(e)))
+            print(f"FAIL {name}: the candidate path raised {e!r}")
+            continue
+        for motif_id in motif_ids:
+            statuses, stage, difference = compare_motif(reference_dirs, candidate_dirs, motif_id)
+            if stage is not None:
+                tie_statuses, tie_stage, _ = compare_motif(tiebreak_dirs, candidate_dirs, motif_id)
+                if tie_stage is None:
+                    ties.append((name, motif_id, stage, difference))
+                    print(f"TIE  {name} {motif_id}: matches the legacy path up to the winners of AF ties; first difference in {stage}: {difference}")
+                    continue
+            if stage is None:
+                exactness = "identical" if all(status == "identical" for _, status in statuses) else "within tolerance (" + ", ".join(s for s, status in statuses if status != "identical") + ")"
+                print(f"OK   {name} {motif_id}: all stages match, {exactness}")
+            else:
+                report.append((name, motif_id, stage, difference))
+                print(f"FAIL {name} {motif_id}: first diverging stage is {stage}: {difference}")
+    return report, ties
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 2:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_golden_harness.py <inputs: demo | synthetic[:n_sites[:seed]] | fps_path,af_path,dataset_ids_file> [candidates, comma-separated (default: all)] [work directory (default: a temporary directory)]")
+        print(f"Candidates: {', '.join(candidates)}")
+        print("Runs the legacy pyranges/scipy path and every candidate path on the same inputs, compares the wide matrices, covariant sites, correlations, adjusted p-values and significant sites, and reports the first diverging stage.")
+        print("Candidates that match the legacy path only once AF ties are resolved by the tie-break of the current overlap are reported as TIE, apart from the diverging ones.")
+        sys.exit(1)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    selected = sys.argv[2].split(',') if len(sys.argv) > 2 and sys.argv[2] != '-' else None
+    unknown = [name for name in selected or [] if name not in candidates]
+    if unknown:
+        print(f"ERROR: Unknown candidates: {unknown}. Choose from: {', '.join(candidates)}")
+        sys.exit(1)
+    work_dir = sys.argv[3] if len(sys.argv) > 3 else tempfile.mkdtemp(prefix="AF_FPS_harness_")
+    os.makedirs(work_dir, exist_ok=True)
+
+    input_spec = sys.argv[1]
+    if input_spec == "demo":
+        inputs = stage_inputs(demo_path, os.path.join(work_dir, "inputs"))
+    elif input_spec.startswith("synthetic"):
+        params = [int(value) for value in input_spec.split(":")[1:]]
+        inputs = synthetic_inputs(os.path.join(work_dir, "inputs"), *params)
+    else:
+        fps_path, af_path, ids_file = input_spec.split(",")
+        with open(ids_file) as file:
+            dataset_ids = [line.rstrip('\n') for line in file if line.strip()]
+        inputs = {"fps_path": fps_path, "af_path": af_path, "dataset_ids": dataset_ids, "files": sorted(glob.glob(os.path.join(fps_path, f"*{tfbs_suffix}")))}
+    print(f"Inputs: {len(inputs['files'])} TFBS matrices, dataset IDs {inputs['dataset_ids']}; outputs in {work_dir}")
+
+    report, ties = run_harness(inputs, work_dir, selected)
+    if ties:
+        print(f"{len(ties)} candidate runs differ from the legacy path only in the winners of AF ties.")
+    print(f"{len(report)} candidate runs diverged from the legacy path." if report else "All candidate paths reproduce the legacy path" + (" up to AF ties." if ties else "."))
+    sys.exit(1 if report else 0)
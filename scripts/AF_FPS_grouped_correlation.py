@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import time
+import fcntl
+import numpy as np
+import pandas as pd
+import concurrent.futures as cf
+
+####################
+# define globals #
+####################
+
+# every motif appends its high-AF IQR outlier regions to this cohort-level long table under {output_path}/output-data/
+cohort_filename = "AF_FPS-high_AF_IQR_regions_cohort_longtable.tsv"
+
+cohort_columns = ["record", "motif_id", "region_id", "sample_id", "AF", "FPS_scaled"]
+
+output_filename = "AF-FPS_region_Spearman-corr-by-subtype-sorted-by-pval.tsv"
+
+####################
+# define functions #
+####################
+
+# create a function to get the cohort long table of an output directory
+def cohort_path(output_path):
+    return os.path.join(output_path, "output-data", cohort_filename)
+
+# create a function to append the rows of one motif to the cohort long table
+def append_cohort_rows(output_path, motif_id, long_df):
+    rows = long_df[["region_id", "sample_id", "AF", "FPS_scaled"]].copy()
+    # the record tag identifies this write, so that a rerun of a motif supersedes its earlier rows
+    rows.insert(0, "motif_id", motif_id)
+    rows.insert(0, "record", f"{os.getpid()}-{time.time_ns()}")
+    table_path = cohort_path(output_path)
+    os.makedirs(os.path.dirname(table_path), exist_ok=True)
+    with open(table_path, "a") as table_file:
+        # one writer at a time across the worker processes
+        fcntl.flock(table_file, fcntl.LOCK_EX)
+        try:
+            rows.to_csv(table_file, sep="\t", index=False, header=table_file.tell() == 0)
+            table_file.flush()
+        finally:
+            fcntl.flock(table_file, fcntl.LOCK_UN)
+
+# create a function to load the cohort long table, keeping only the latest rows of every motif
+def load_cohort_table(table_path):
+    cohort_df = pd.read_csv(table_path, sep="\t", dtype={"record": str, "motif_id": str, "region_id": str, "sample_id": str})
+    latest = cohort_df.groupby("motif_id", sort=False)["record"].last()
+    return cohort_df[cohort_df["record"] == cohort_df["motif_id"].map(latest)].drop(columns="record").reset_index(drop=True)
+
+# create a function to compute the Spearman correlation of x and y within every group of a long table, with the conventions of scipy.stats.spearmanr
+def grouped_spearman(long_df, keys=("motif_id", "sample_id"), x="FPS_scaled", y="AF"):
+    # scipy.stats is only needed here, so that the data-viz workers appending to the cohort table do not import it
+    import scipy.stats as stats
+    keys = list(keys)
+    if long_df.empty:
+        return pd.DataFrame(columns=[*keys, "correlation", "pvalue"])
+    long_df = long_df.sort_values(by=keys, kind="stable")
+    groups = long_df.groupby(keys, sort=False)
+    # rank both variables within every group in one batched pass; ties get their average rank like scipy.stats.rankdata
+    ranks = groups[[x, y]].rank(method="average").to_numpy()
+    # a missing value anywhere in a group makes its correlation undefined
+    ranks[long_df[[x, y]].isna().any(axis=1).to_numpy()] = np.nan
+
+    # the groups are contiguous after sorting, so segment sums give the Pearson correlation of the ranks of every group
+    sizes = groups.size().to_numpy()
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    rx, ry = ranks[:, 0], ranks[:, 1]
+    mean_x = np.add.reduceat(rx, starts) / sizes
+    mean_y = np.add.reduceat(ry, starts) / sizes
+    dx, dy = rx - np.repeat(mean_x, sizes), ry - np.repeat(mean_y, sizes)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = np.add.reduceat(dx * dy, starts) / np.sqrt(np.add.reduceat(dx * dx, starts) * np.add.reduceat(dy * dy, starts))
+        rs = np.clip(rs, -1, 1)
+        dof = sizes - 2
+        t = rs * np.sqrt((dof / ((rs + 1.0) * (1.0 - rs))).clip(0))
+        pvalues = 2 * stats.t.sf(np.abs(t), dof)
+
+    results_df = groups.size().index.to_frame(index=False)
+    results_df["correlation"] = rs
+    results_df["pvalue"] = pvalues
+    return results_df
+
+# create a function to split a long table into chunks of whole motifs
+def motif_chunks(long_df, n_chunks):
+    motif_ids = long_df["motif_id"].unique()
+    for chunk in np.array_split(motif_ids, max(min(n_chunks, len(motif_ids)), 1)):
+        yield long_df[long_df["motif_id"].isin(chunk)]
+
+# create a function to correlate every (motif, subtype) of the cohort on a pool of workers and sort the results by p-value
+def correlate_cohort(cohort_df, max_workers=8):
+    with cf.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        result_dfs = list(executor.map(grouped_spearman, motif_chunks(cohort_df, max_workers * 4)))
+    results_df = pd.concat(result_dfs, ignore_index=True).rename(columns={"sample_id": "subtype"})
+    return results_df[["motif_id", "subtype", "correlation", "pvalue"]].sort_values(by="pvalue", kind="stable")
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_grouped_correlation.py <top directory of the data-viz outputs> <output_path> [number of workers (default: 8)]")
+        sys.exit(1)
+
+    cohort_df = load_cohort_table(cohort_path(sys.argv[1]))
+    print(f"Cohort table of {cohort_df['motif_id'].nunique()} motifs has been loaded.")
+    output_path = sys.argv[2]
+    max_workers = int(sys.argv[3]) if len(sys.argv) > 3 else 8
+
+    results_df = correlate_cohort(cohort_df, max_workers)
+    os.makedirs(output_path, exist_ok=True)
+    results_df.to_csv(f"{output_path}/{output_filename}", sep="\t", index=False)
+    print(f"Spearman correlations of {len(results_df)} motif subtypes have been saved to file.")
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import time
+import numpy as np
+
+####################
+# define globals #
+####################
+
+# kernel backend: 'auto' uses the Numba-compiled kernels when Numba is installed and the NumPy kernels otherwise; set AF_FPS_KERNELS=numpy to force the fallback
+kernel_backend = os.environ.get("AF_FPS_KERNELS", "auto")
+
+# compiled kernels, built on first use so that importing this module never pays for Numba or its compilation
+_compiled = {}
+
+####################
+# define functions #
+####################
+
+# create a function to compile the Numba kernels once per process; returns None when Numba is not installed
+def numba_kernels():
+    if "kernels" in _compiled:
+        return _compiled["kernels"]
+    try:
+        import numba
+    except ImportError:
+        _compiled["kernels"] = None
+        return None
+
+    # left-join every site [start, end) to the sorted zero-length variants strictly inside it, in one sweep per site
+    @numba.njit(cache=True)
+    def overlap_pairs_numba(site_starts, site_ends, var_pos):
+        n_sites = site_starts.shape[0]
+        lo = np.searchsorted(var_pos, site_starts, side="right")
+        hi = np.searchsorted(var_pos, site_ends, side="left")
+        total = 0
+        for i in range(n_sites):
+            total += max(hi[i] - lo[i], 1)
+        site_index = np.empty(total, dtype=np.int64)
+        var_index = np.empty(total, dtype=np.int64)
+        k = 0
+        for i in range(n_sites):
+            if hi[i] <= lo[i]:
+                site_index[k] = i
+                var_index[k] = -1
+                k += 1
+            else:
+                for j in range(lo[i], hi[i]):
+                    site_index[k] = i
+                    var_index[k] = j
+                    k += 1
+        return site_index, var_index
+
+    # sweep the sorted intervals, opening a new cluster at every group change or when an interval starts at or after the furthest end so far
+    @numba.njit(cache=True)
+    def cluster_labels_numba(starts, ends, groups):
+        labels = np.empty(starts.shape[0], dtype=np.int64)
+        label = 0
+        max_end = 0
+        for i in range(starts.shape[0]):
+            if i == 0 or groups[i] != groups[i - 1] or starts[i] >= max_end:
+                label += 1
+                max_end = ends[i]
+            elif ends[i] > max_end:
+                max_end = ends[i]
+            labels[i] = label
+        return labels
+
+    # rank every row with average ranks for ties, leaving missing values missing
+    @numba.njit(cache=True)
+    def rank_rows_numba(values):
+        n_rows, n_cols = values.shape
+        ranks = np.full((n_rows, n_cols), np.nan)
+        for r in range(n_rows):
+            row = values[r]
+            order = np.argsort(row, kind="mergesort")
+            # NaNs sort last, so the ranked values are the first n_valid of the order
+            n_valid = 0
+            for c in range(n_cols):
+                if not np.isnan(row[c]):
+                    n_valid += 1
+            i = 0
+            while i < n_valid:
+                j = i
+                while j + 1 < n_valid and row[order[j + 1]] == row[order[i]]:
+                    j += 1
+                # the tied positions i..j share the mean of ranks i+1..j+1
+                average = 0.5 * (i + j) + 1.0
+                for k in range(i, j + 1):
+                    ranks[r, order[k]] = average
+                i = j + 1
+        return ranks
+
+    _compiled["kernels"] = {"overlap_pairs": overlap_pairs_numba, "cluster_labels": cluster_labels_numba, "rank_rows": rank_rows_numba}
+    return _compiled["kernels"]
+
+# create a function to pick the kernels of a backend ('auto', 'numba' or 'numpy')
+def select_kernels(backend=None):
+    backend = backend or kernel_backend
+    if backend not in ("auto", "numba", "numpy"):
+        raise ValueError("Invalid kernel backend. Please choose one of auto, numba, numpy.")
+    kernels = numba_kernels() if backend != "numpy" else None
+    if kernels is None and backend == "numba":
+        raise ImportError("The numba kernel backend was requested but Numba is not installed.")
+    return kernels
+
+# create a function to name the kernels a backend resolves to, for the cache keys of results computed with them
+def kernel_name(backend=None):
+    return "numpy" if select_kernels(backend) is None else "numba"
+
+# create a function to left-join sites [start, end) to sorted zero-length variants, which pyranges counts as overlapping when start < pos < end;
+# returns the (site index, variant index) pairs in site order, with variant index -1 for sites without a variant
+def overlap_pairs(site_starts, site_ends, var_pos, backend=None):
+    site_starts = np.ascontiguousarray(site_starts, dtype=np.int64)
+    site_ends = np.ascontiguousarray(site_ends, dtype=np.int64)
+    var_pos = np.ascontiguousarray(var_pos, dtype=np.int64)
+    kernels = select_kernels(backend)
+    if kernels is not None:
+        return kernels["overlap_pairs"](site_starts, site_ends, var_pos)
+
+    lo = np.searchsorted(var_pos, site_starts, side="right")
+    hi = np.maximum(np.searchsorted(var_pos, site_ends, side="left"), lo)
+    # every site keeps at least one row, the unmatched ones with variant index -1
+    counts = np.maximum(hi - lo, 1)
+    site_index = np.repeat(np.arange(len(site_starts), dtype=np.int64), counts)
+    offsets = np.arange(counts.sum(), dtype=np.int64) - np.repeat(np.cumsum(counts) - counts, counts)
+    var_index = np.repeat(lo, counts) + offsets
+    var_index[np.repeat(hi == lo, counts)] = -1
+    return site_index, var_index
+
+# create a function to label overlapping intervals with 1-based cluster ids, like pyranges cluster(slack=-1);
+# the intervals must be sorted by group and start, and intervals of different groups are never merged
+def cluster_labels(starts, ends, groups, backend=None):
+    starts = np.ascontiguousarray(starts, dtype=np.int64)
+    ends = np.ascontiguousarray(ends, dtype=np.int64)
+    groups = np.ascontiguousarray(groups, dtype=np.int64)
+    if len(starts) == 0:
+        return np.empty(0, dtype=np.int64)
+    kernels = select_kernels(backend)
+    if kernels is not None:
+        return kernels["cluster_labels"](starts, ends, groups)
+
+    # shift every group past the end of the previous one, so that one running maximum of the ends covers all groups
+    span = int(ends.max() - starts.min()) + 1
+    group_codes = np.cumsum(np.concatenate(([0], groups[1:] != groups[:-1])))
+    shifted_starts = group_codes * span + (starts - starts.min())
+    shifted_ends = group_codes * span + (ends - starts.min())
+    furthest_end = np.maximum.accumulate(shifted_ends)
+    new_cluster = np.concatenate(([True], shifted_starts[1:] >= furthest_end[:-1]))
+    return np.cumsum(new_cluster)
+
+# create a function to rank the values of every row of a 2D array with average ranks for ties (scipy.stats.rankdata), leaving missing values missing
+def rank_rows(values, backend=None):
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    kernels = select_kernels(backend)
+    if kernels is not None:
+        return kernels["rank_rows"](values)
+
+    n_rows, n_cols = values.shape
+    order = np.argsort(values, axis=1, kind="stable")
+    sorted_values = np.take_along_axis(values, order, axis=1)
+    # a tie group starts at every row start and wherever the sorted value changes; NaNs never compare equal, so each is its own group
+    new_group = np.ones((n_rows, n_cols), dtype=bool)
+    new_group[:, 1:] = sorted_values[:, 1:] != sorted_values[:, :-1]
+    group_ids = np.cumsum(new_group.ravel()) - 1
+    positions = np.tile(np.arange(1, n_cols + 1, dtype=np.float64), n_rows)
+    averages = np.bincount(group_ids, weights=positions) / np.bincount(group_ids)
+    ranks = np.empty((n_rows, n_cols))
+    np.put_along_axis(ranks, order, averages[group_ids].reshape(n_rows, n_cols), axis=1)
+    ranks[np.isnan(values)] = np.nan
+    return ranks
+
+# create a function to compute the Spearman correlation and two-sided p-value between the rows of two 2D arrays, with the arithmetic of scipy.stats.spearmanr;
+# missing values mark absent observations and are left out of their row
+def spearman_rows(x, y, backend=None):
+    from scipy.special import stdtr
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # an observation counts only when both of its values are present
+    present = ~(np.isnan(x) | np.isnan(y))
+    rank_x = rank_rows(np.where(present, x, np.nan), backend)
+    rank_y = rank_rows(np.where(present, y, np.nan), backend)
+    n_obs = present.sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # average ranks are multiples of 1/2, so the centred sums are exact and the rounding is that of numpy.corrcoef
+        dx = np.where(present, rank_x - ((n_obs + 1) / 2)[:, None], 0.0)
+        dy = np.where(present, rank_y - ((n_obs + 1) / 2)[:, None], 0.0)
+        factor = 1.0 / (n_obs - 1)
+        sxy, sxx, syy = (dx * dy).sum(axis=1) * factor, (dx * dx).sum(axis=1) * factor, (dy * dy).sum(axis=1) * factor
+        # spearmanr(x, y) reads the correlation from row y, column x of the correlation matrix, so it divides by the deviation of y first
+        rs = np.clip(sxy / np.sqrt(syy) / np.sqrt(sxx), -1, 1)
+        dof = n_obs - 2
+        t = rs * np.sqrt((dof / ((rs + 1.0) * (1.0 - rs))).clip(0))
+        pvalues = 2 * stdtr(dof, -np.abs(t))
+    # a constant row or fewer than two observations have no defined correlation
+    undefined = (n_obs <= 1) | (sxx == 0) | (syy == 0)
+    rs[undefined] = np.nan
+    pvalues[undefined] = np.nan
+    return rs, pvalues
+
+# create a function to run both kernel backends on the same inputs and check that they agree
+def compare_backends(site_starts, site_ends, var_pos, values):
+    results = {}
+    for backend in ("numpy", "numba"):
+        if backend == "numba" and numba_kernels() is None:
+            print("Numba is not installed; only the NumPy kernels were run.")
+            continue
+        start = time.perf_counter()
+        pairs = overlap_pairs(site_starts, site_ends, var_pos, backend)
+        labels = cluster_labels(site_starts, site_ends, np.zeros(len(site_starts), dtype=np.int64), backend)
+        ranks = rank_rows(values, backend)
+        results[backend] = (pairs, labels, ranks)
+        print(f"{backend} kernels: {time.perf_counter() - start:.3f} s")
+    if len(results) == 2:
+        (pairs_a, labels_a, ranks_a), (pairs_b, labels_b, ranks_b) = results["numpy"], results["numba"]
+        same = all(np.array_equal(a, b) for a, b in zip(pairs_a, pairs_b)) and np.array_equal(labels_a, labels_b) and np.array_equal(ranks_a, ranks_b, equal_nan=True)
+        print(f"NumPy and Numba kernels {'agree' if same else 'DISAGREE'}.")
+        return same
+    return True
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_kernels.py <filtered TFBS matrix> <vcf extract of the same motif>")
+        print("Runs the NumPy and (when installed) Numba kernels on the same inputs and checks that they agree.")
+        sys.exit(1)
+
+    import pandas as pd
+    from natsort import natsort_keygen
+    tfbs_df = pd.read_csv(sys.argv[1], sep="\t")
+    vcf_df = pd.read_csv(sys.argv[2], sep="\t")
+    chrom_col, pos_col = vcf_df.columns[0], vcf_df.columns[1]
+
+    # key the positions by chromosome so that one sorted array covers the whole genome
+    chroms = sorted(set(tfbs_df["TFBS_chr"].astype(str)) | set(vcf_df[chrom_col].astype(str)), key=natsort_keygen())
+    chrom_codes = {chrom: code for code, chrom in enumerate(chroms)}
+    span = int(max(tfbs_df["TFBS_end"].max(), vcf_df[pos_col].max())) + 1
+    tfbs_df = tfbs_df.assign(chrom_code=tfbs_df["TFBS_chr"].astype(str).map(chrom_codes)).sort_values(by=["chrom_code", "TFBS_start"], kind="stable")
+    site_starts = tfbs_df["chrom_code"].to_numpy() * span + tfbs_df["TFBS_start"].to_numpy()
+    site_ends = tfbs_df["chrom_code"].to_numpy() * span + tfbs_df["TFBS_end"].to_numpy()
+    var_pos = np.sort(vcf_df[chrom_col].astype(str).map(chrom_codes).to_numpy() * span + vcf_df[pos_col].to_numpy())
+    score_columns = [col for col in tfbs_df.columns if col.endswith("_score") and col != "TFBS_score"]
+
+    sys.exit(0 if compare_backends(site_starts, site_ends, var_pos, tfbs_df[score_columns].to_numpy(dtype=float)) else 1)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import io
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from natsort import natsorted
+from AF_FPS_kernels import cluster_labels
+
+####################
+# define globals #
+####################
+
+# combined significant sites written by the count merge script, and the per-locus summaries written next to them
+combined_filename = "AF_FPS-covariant_sites_significant.combined.tsv"
+loci_filename = "AF_FPS-covariant_sites_significant.loci.tsv"
+
+# only the columns the sweep needs are read from the combined table
+site_columns = ["motif_id", "region_id", "corr_coeff", "adj_pvalues"]
+
+####################
+# define functions #
+####################
+
+# create a function to parse region IDs (chrom:start-end) into chromosome codes in natural order and integer coordinates; every distinct region ID is parsed once
+def parse_regions(region_ids):
+    region_codes, regions = pd.factorize(region_ids)
+    # the C parser splits millions of region IDs in seconds; it only applies when every region ID has exactly one ':' and one '-', and chromosome names that contain them themselves fall back to the regular expression
+    regions_text = "\n".join(regions)
+    parsed = regions_text.count(":") == len(regions) and regions_text.count("-") == len(regions)
+    if parsed:
+        try:
+            coords = pd.read_csv(io.StringIO(regions_text.replace(":", "\t").replace("-", "\t")), sep="\t", header=None, names=["chrom", "start", "end"], index_col=False, dtype={"chrom": str, "start": np.int64, "end": np.int64}, na_filter=False, skip_blank_lines=False)
+            parsed = len(coords) == len(regions)
+        except (ValueError, pd.errors.ParserError):
+            parsed = False
+    if not parsed:
+        coords = pd.Series(regions).str.extract(r'^(?P<chrom>.+):(?P<start>\d+)-(?P<end>\d+)$')
+        if coords["chrom"].isna().any():
+            raise ValueError(f"Region IDs must look like chrom:start-end, found: {regions[coords['chrom'].isna().to_numpy()][0]}")
+    chrom_codes, chroms = pd.factorize(coords["chrom"])
+    # renumber the chromosomes in natural order
+    chrom_rank = np.argsort(np.array([chroms.get_loc(chrom) for chrom in natsorted(chroms)]))
+    chrom_codes = chrom_rank[chrom_codes]
+    return natsorted(chroms), chrom_codes[region_codes], coords["start"].astype(np.int64).to_numpy()[region_codes], coords["end"].astype(np.int64).to_numpy()[region_codes]
+
+# create a function to cluster the significant sites of all motifs into loci with one sorted sweep; sites closer than max_gap bp join the same locus, and a max_gap of 0 joins overlapping sites only
+def cluster_loci(sites_df, max_gap=0):
+    chroms, chrom_codes, starts, ends = parse_regions(sites_df["region_id"])
+    order = np.lexsort((ends, starts, chrom_codes))
+    labels = np.empty(len(order), dtype=np.int64)
+    labels[order] = cluster_labels(starts[order], ends[order] + max_gap, chrom_codes[order]) - 1
+    return labels, np.asarray(chroms, dtype=object), chrom_codes, starts, ends
+
+# create a function to summarise every locus: its merged interval, contributing motifs, best adjusted p-value and the consensus direction of its correlations
+def summarise_loci(sites_df, max_gap=0):
+    labels, chroms, chrom_codes, starts, ends = cluster_loci(sites_df, max_gap)
+    n_loci = int(labels.max()) + 1 if len(labels) else 0
+    adj_pvalues = sites_df["adj_pvalues"].to_numpy(dtype=float)
+    corr_coeffs = sites_df["corr_coeff"].to_numpy(dtype=float)
+
+    # the best site of a locus is the one with the smallest adjusted p-value; the sort is stable, so ties go to the first site in the input order
+    best = np.lexsort((adj_pvalues, labels))
+    best = best[np.concatenate(([True], labels[best][1:] != labels[best][:-1]))] if len(best) else best
+
+    # the distinct motifs of every locus, sorted by locus then motif name, joined into one comma-separated string per locus
+    motif_codes, motifs = pd.factorize(sites_df["motif_id"], sort=True)
+    pairs = np.sort(pd.unique(labels * max(len(motifs), 1) + motif_codes))
+    pair_loci, pair_motifs = pairs // max(len(motifs), 1), pairs % max(len(motifs), 1)
+    motif_counts = np.bincount(pair_loci, minlength=n_loci)
+    motif_names = np.asarray(motifs, dtype=object)[pair_motifs]
+    bounds = np.concatenate(([0], np.cumsum(motif_counts)))
+    # most loci have a single motif, so only the others are joined
+    motif_lists = motif_names[bounds[:-1]] if n_loci else np.array([], dtype=object)
+    for i in np.flatnonzero(motif_counts > 1):
+        motif_lists[i] = ",".join(motif_names[bounds[i]:bounds[i + 1]])
+
+    n_positive = np.bincount(labels, weights=corr_coeffs > 0, minlength=n_loci).astype(np.int64)
+    n_negative = np.bincount(labels, weights=corr_coeffs < 0, minlength=n_loci).astype(np.int64)
+    n_sites = np.bincount(labels, minlength=n_loci)
+    locus_starts = np.full(n_loci, np.iinfo(np.int64).max)
+    np.minimum.at(locus_starts, labels, starts)
+    locus_ends = np.zeros(n_loci, dtype=np.int64)
+    np.maximum.at(locus_ends, labels, ends)
+    locus_chroms = chroms[chrom_codes[best]]
+
+    loci_df = pd.DataFrame({
+        "locus_id": [f"{chrom}:{start}-{end}" for chrom, start, end in zip(locus_chroms.tolist(), locus_starts.tolist(), locus_ends.tolist())],
+        "Chromosome": locus_chroms,
+        "Start": locus_starts,
+        "End": locus_ends,
+        "n_sites": n_sites,
+        "n_motifs": motif_counts,
+        "motifs": motif_lists,
+        "best_motif_id": sites_df["motif_id"].to_numpy()[best],
+        "best_region_id": sites_df["region_id"].to_numpy()[best],
+        "best_adj_pvalue": adj_pvalues[best],
+        "best_corr_coeff": corr_coeffs[best],
+        "n_positive": n_positive,
+        "n_negative": n_negative,
+        # the direction is a consensus only when all correlations of the locus agree in sign
+        "consensus_direction": np.select([n_positive == n_sites, n_negative == n_sites], ["positive", "negative"], "mixed"),
+    })
+    # the loci are numbered in genomic order by the sweep
+    return loci_df, labels
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3:
+        print("ERROR: Missing required arguments!")
+        print(f"USAGE: python3 AF_FPS_locus_clusters.py <{combined_filename}> <output directory> [max gap between sites of one locus in bp (default: 0, overlapping sites only)]")
+        print(f"Clusters the significant covariant sites of all motifs into loci and writes one summary row per locus to {loci_filename}.")
+        sys.exit(1)
+
+    combined_path = sys.argv[1]
+    output_dir = sys.argv[2]
+    max_gap = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+
+    start = time.perf_counter()
+    sites_df = pd.read_csv(combined_path, sep="\t", usecols=site_columns, dtype={"motif_id": str, "region_id": str})
+    print(f"{len(sites_df)} significant sites loaded in {time.perf_counter() - start:.2f} s")
+    loci_df, _ = summarise_loci(sites_df, max_gap)
+    print(f"{len(sites_df)} sites clustered into {len(loci_df)} loci ({int((loci_df['n_motifs'] > 1).sum())} with more than one motif) in {time.perf_counter() - start:.2f} s")
+    os.makedirs(output_dir, exist_ok=True)
+    loci_df.to_csv(os.path.join(output_dir, loci_filename), sep="\t", index=False)
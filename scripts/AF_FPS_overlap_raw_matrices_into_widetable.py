@@ -7,11 +7,29 @@
 import os
 import sys
 import fnmatch
+import numpy as np
 import pandas as pd
 import pyranges as pr
 import concurrent.futures
 import itertools
 
+from natsort import natsorted
+from AF_FPS_range_index import write_indexed_matrix
+from AF_FPS_kernels import overlap_pairs, cluster_labels
+from AF_FPS_async_writer import write_table, flush_writers
+from AF_FPS_ragged_variants import ragged_suffix, ragged_layout, save_ragged
+from AF_FPS_profiling import profile_hook
+
+####################
+# define globals #
+####################
+
+# filename suffix of the filtered TFBS matrices of the BRCA cohort; the motif ID is the rest of the filename
+tfbs_suffix = "_BRCA-subtype-vcf-filtered-matrix.txt"
+
+# TFBS score columns whose names do not follow the <accession>_<subtype>_score pattern of the others
+score_renames = {"2GAMBDQ_Normal-like_score": "2GAMBDQ_Norm_fps"}
+
 ####################
 # define functions #
 ####################
@@ -40,23 +58,95 @@ def find_files(path, pattern):
             matches.append(os.path.join(root, filename))
     return matches
 
-# function to overlap pyranges objects two at a time
-def pyrange_obj_overlap(gr_fpscore, grs_vcf_dict):
-    count = 0
-    for key, val in grs_vcf_dict.items():  
-        if count == 0:
-            overlap = gr_fpscore.join(val, how='left', suffix=f"_{key}_varsite_pos", preserve_order = True)
-        else:
-            overlap = filtered_gr.join(val, how='left', suffix=f"_{key}_varsite_pos", preserve_order = True)
-    
-        # drop the column "End" column
-        overlap = overlap.drop([f"End_{key}_varsite_pos"])
+# create a function to pair each vcf file with its dataset ID via the sample accession prefix in the filename
+def pair_vcf_paths(vcf_paths, dataset_ids):
+    paired = {}
+    for dataset in dataset_ids:
+        # the accession is the first field of the dataset ID (e.g. 2GAMBDQ in 2GAMBDQ_norm)
+        accession = dataset.split('_')[0]
+        matches = [path for path in vcf_paths if os.path.basename(path).startswith(f"{accession}_")]
+        if len(matches) != 1:
+            print(f"ERROR: Expected one vcf file for dataset ID {dataset}, found {len(matches)}!")
+            print(f"vcf_paths: {vcf_paths}")
+            print("Exiting prematurely...")
+            sys.exit(1)
+        paired[dataset] = matches[0]
+    return paired
 
-        # cluster the pyRanges object by genomic range; overlapping regions wil share the same id
-        overlap = overlap.cluster(slack=-1)
+# define a generator function that yields the input files in lists of batch_size
+def batch_generator(paths, batch_size):
+    batch = []
+    for path in paths:
+        batch.append(path)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
-        # cast back into a dataframe and filter by the AF column's max value (per cluster); this returns a filtered dataframe
-        filtered_df = overlap.df.loc[overlap.df.groupby('Cluster')['AF'].idxmax()]
+# create a function to build the null row that pyranges fills unmatched join rows with: -1 for numbers and "-1" for strings
+def null_row(df):
+    return pd.DataFrame({col: [-1 if ("int" in str(dtype) or "float" in str(dtype)) else "-1"] for col, dtype in df.dtypes.items()})
+
+# create a function to key the site and variant positions by chromosome, so that one sorted array covers the whole genome
+def genome_keys(sites_df, vcf_df):
+    chroms = natsorted(set(sites_df["Chromosome"].astype(str)) | set(vcf_df["Chromosome"].astype(str)))
+    chrom_codes = pd.Series(np.arange(len(chroms), dtype=np.int64), index=chroms)
+    site_chroms = chrom_codes[sites_df["Chromosome"].astype(str)].to_numpy()
+    var_chroms = chrom_codes[vcf_df["Chromosome"].astype(str)].to_numpy()
+    span = int(max(sites_df["End"].max(), vcf_df["End"].max(), 0)) + 1
+    site_starts = site_chroms * span + sites_df["Start"].to_numpy(dtype=np.int64)
+    site_ends = site_chroms * span + sites_df["End"].to_numpy(dtype=np.int64)
+    return site_chroms, site_starts, site_ends, var_chroms * span + vcf_df["Start"].to_numpy(dtype=np.int64)
+
+# create a function to left-join sites to zero-length variant sites and cluster the joined rows, giving the table of the pyranges join(how='left', preserve_order=True) and cluster(slack=-1) calls up to the order of rows with equal starts
+def join_and_cluster(sites_df, vcf_df, suffix, by=None):
+    site_chroms, site_starts, site_ends, var_keys = genome_keys(sites_df, vcf_df)
+    var_order = np.argsort(var_keys, kind="stable")
+    site_index, var_index = overlap_pairs(site_starts, site_ends, var_keys[var_order])
+
+    # unmatched sites take the null row appended after the variants
+    var_df = vcf_df.drop(columns="Chromosome")
+    var_df = pd.concat([var_df, null_row(var_df)], ignore_index=True)
+    var_rows = np.where(var_index >= 0, var_order[np.maximum(var_index, 0)], len(var_df) - 1)
+    left_df = sites_df.iloc[site_index].reset_index(drop=True)
+    right_df = var_df.iloc[var_rows].reset_index(drop=True)
+    right_df = right_df.rename(columns={col: f"{col}{suffix}" for col in right_df.columns if col in left_df.columns})
+    overlap_df = left_df.join(right_df).drop(columns=[f"End{suffix}"])
+
+    # cluster overlapping sites within each chromosome (and each `by` value), in the start order of the pyranges cluster
+    groups = site_chroms[site_index]
+    sort_keys = [overlap_df["Start"].to_numpy()]
+    if by is not None:
+        by_codes, by_values = pd.factorize(overlap_df[by], sort=True)
+        groups = groups * len(by_values) + by_codes
+        sort_keys.append(by_codes)
+    order = np.lexsort([*sort_keys, site_chroms[site_index]])
+    overlap_df = overlap_df.iloc[order].reset_index(drop=True)
+    overlap_df["Cluster"] = cluster_labels(overlap_df["Start"].to_numpy(), overlap_df["End"].to_numpy(), groups[order])
+    return overlap_df
+
+# create a function to order the joined rows of one dataset ID by variant position and alleles, then by site, so that the first of the AF ties within a cluster does not depend on the join order
+def tiebreak_order(overlap_df, key):
+    return overlap_df.sort_values(by=[f"Start_{key}_varsite_pos", "ref_allele", "alt_allele", "Start", "End"], kind="stable")
+
+# function to overlap pyranges objects two at a time
+def pyrange_obj_overlap(gr_fpscore, grs_vcf_dict, by=None, tiebreak=False):
+    filtered_gr = gr_fpscore
+    filtered_df = gr_fpscore.df
+    for key, val in grs_vcf_dict.items():
+        # join the variant sites of this dataset ID and cluster the joined rows by genomic range; overlapping regions will share the same id
+        # in batch mode, `by` holds the motif_id column so that TFBS of different motifs are never merged
+        if tiebreak:
+            # the kernels join and cluster in input order, and the tie-break then fixes which variant and site of a cluster win AF ties
+            overlap_df = tiebreak_order(join_and_cluster(filtered_df, val.df, f"_{key}_varsite_pos", by), key)
+        else:
+            # the pyranges join and cluster calls order tied rows with an unstable sort; AF ties keep the first of them, as in the published matrices
+            overlap = filtered_gr.join(val, how='left', suffix=f"_{key}_varsite_pos", preserve_order=True)
+            overlap = overlap.drop([f"End_{key}_varsite_pos"])
+            overlap_df = overlap.cluster(by=by, slack=-1).df
+        # filter by the AF column's max value (per cluster); this returns a filtered dataframe
+        filtered_df = overlap_df.loc[overlap_df.groupby('Cluster')['AF'].idxmax()]
 
         # then rename the columns
         filtered_df = filtered_df.rename(columns={f"Start_{key}_varsite_pos": f"{key}_varsite_pos", "ref_allele": f"{key}_REF_al", "alt_allele": f"{key}_ALT_al", "AF": f"{key}_AF"})
@@ -71,25 +161,101 @@ def pyrange_obj_overlap(gr_fpscore, grs_vcf_dict):
 
         # cast back into pyrange object
         filtered_gr = pr.PyRanges(filtered_df)
-
-        # increment count
-        count += 1
       
     return filtered_gr
 
-# define concurrent function to process multiple files at once
-def process_file(file, af_path, dataset_ids, output_path):
-    suffix = "_BRCA-subtype-vcf-filtered-matrix.txt"
+# create a function to collect every variant of every dataset ID inside each site of an overlapped dataframe, instead of only the max-AF variant the wide matrix keeps
+def ragged_overlap(target_df, grs_vcf_dict):
+    region_ids = target_df["Chromosome"].astype(str) + ":" + target_df["Start"].astype(str) + "-" + target_df["End"].astype(str)
+    pairs = {}
+    for key, val in grs_vcf_dict.items():
+        vcf_df = val.df
+        _, site_starts, site_ends, var_keys = genome_keys(target_df, vcf_df)
+        # order the variants of a site by position and alleles
+        vcf_df = vcf_df.assign(var_key=var_keys).sort_values(by=["var_key", "ref_allele", "alt_allele"], kind="stable")
+        site_index, var_index = overlap_pairs(site_starts, site_ends, vcf_df["var_key"].to_numpy())
+        matched = var_index >= 0
+        variants = vcf_df.iloc[var_index[matched]]
+        pairs[key] = (site_index[matched], variants["Start"].to_numpy(), variants["ref_allele"].astype(str).to_numpy(), variants["alt_allele"].astype(str).to_numpy(), variants["AF"].to_numpy())
+    return ragged_layout(region_ids.to_numpy(), pairs)
+
+# create a function to write the ragged variant layout of one motif next to its wide matrix
+def write_ragged_variants(target_df, grs_vcf_dict, motif_id, output_path):
+    layout = ragged_overlap(target_df, grs_vcf_dict)
+    save_ragged(layout, os.path.join(output_path, f"{motif_id}{ragged_suffix}"))
+    print(f"Ragged variant layout for {motif_id} has been generated: {len(layout['pos'])} variants in {len(layout['region_id'])} sites")
+
+# create a function to load a filtered TFBS matrix and harmonise its column names
+def load_tfbs(file, suffix=tfbs_suffix):
     motif_id = os.path.basename(file).replace(suffix, '')
-    print(f"Processing filtered TFBS matrix of {motif_id}...")
     # load the data
     df_fps = pd.read_csv(file, sep="\t")
     # drop the column "TFBS_strand" and "TFBS_score"
     df_fps = df_fps.drop(columns=["TFBS_strand", "TFBS_score"])
     # rename columns in the dataframe
-    df_fps = df_fps.rename(columns={"TFBS_chr": "Chromosome", "TFBS_start": "Start", "TFBS_end": "End", "2GAMBDQ_Normal-like_score": "2GAMBDQ_Norm_fps"})
+    df_fps = df_fps.rename(columns={"TFBS_chr": "Chromosome", "TFBS_start": "Start", "TFBS_end": "End", **score_renames})
     # for all column names that end with the string 'score', replace the string with 'fps'
     df_fps = df_fps.rename(columns=lambda x: x.replace('score', 'fps') if x.endswith('score') else x)
+    return motif_id, df_fps
+
+# create a function to finalise the column layout of an overlapped dataframe
+def finalise_wide_matrix(target_df):
+    # create a column called 'region_id'
+    target_df["region_id"] = target_df["Chromosome"].astype(str) + ":" + target_df["Start"].astype(str) + "-" + target_df["End"].astype(str)
+
+    # for all column name ending with the string '_fps', split the string, take the second element, change the first letter in the string to lowercase, and reconstruct the original string with the new first letter
+    target_df = target_df.rename(columns=lambda x: x.split('_')[0] + '_' + x.split('_')[1][0].lower() + x.split('_')[1][1:] + '_fps' if x.endswith('_fps') else x)
+    return target_df
+
+# create a function to finalise the overlapped dataframe of one motif and write it to file
+def write_wide_matrix(target_df, motif_id, output_path, index_mode=None):
+    target_df = finalise_wide_matrix(target_df)
+
+    # construct output filename
+    outfile = os.path.join(output_path, f"{motif_id}_fpscore-af-varsites-combined-matrix-wide.tsv")
+        
+    # save to file on the writer threads, or coordinate sorted with a binned index (and block-compressed) for region lookups
+    if index_mode is None:
+        write_table(target_df, outfile, sep="\t", index=False, na_rep='NULL')
+    else:
+        write_indexed_matrix(target_df, f"{outfile}.gz" if index_mode == "bgzip" else outfile, compress=index_mode == "bgzip")
+
+    # print the dimensions of the dataframe
+    print(f"Shape of the current motif ID ({motif_id}): {target_df.shape}")
+    print(f"Output file for {motif_id} has been generated!")
+
+# create a function to merge the per-motif vcf extracts of many motifs into one sorted variant set per dataset ID
+# every extract is still parsed; only the directory walk is shared, since the genome-wide variant calls are not among the inputs
+def load_merged_variants(af_path, motif_ids, dataset_ids):
+    # walk the vcf directory once for all motifs instead of once per motif
+    all_vcf_paths = find_files(af_path, "*.txt")
+
+    # collect the per-motif vcf extracts of every dataset ID
+    dataset_vcf_dfs = {dataset: [] for dataset in dataset_ids}
+    for motif_id in motif_ids:
+        vcf_paths = [path for path in all_vcf_paths if fnmatch.fnmatch(os.path.basename(path), f"*{motif_id}*.txt")]
+        if len(vcf_paths) != len(dataset_ids):
+            print(f"ERROR: Number of vcf files ({len(vcf_paths)}) for {motif_id} does not match the number of dataset IDs ({len(dataset_ids)})!")
+            print(f"vcf_paths: {vcf_paths}")
+            print(f"dataset_ids: {dataset_ids}")
+            print("Exiting prematurely...")
+            sys.exit(1)
+        for dataset, path in pair_vcf_paths(vcf_paths, dataset_ids).items():
+            dataset_vcf_dfs[dataset].append(load_vcf(path))
+
+    # all extracts of a dataset ID come from the same variant calls, so duplicated calls are dropped
+    grs = {}
+    for name, vcf_dfs in dataset_vcf_dfs.items():
+        vcf = pd.concat(vcf_dfs, ignore_index=True).drop_duplicates()
+        vcf = vcf.sort_values(by=["Chromosome", "Start"], kind="stable")
+        grs[name] = pr.PyRanges(vcf)
+    return grs
+
+# define concurrent function to process multiple files at once
+@profile_hook("overlap", tfbs_suffix)
+def process_file(file, af_path, dataset_ids, output_path, index_mode=None, ragged=False, tiebreak=False):
+    motif_id, df_fps = load_tfbs(file)
+    print(f"Processing filtered TFBS matrix of {motif_id}...")
 
     # load associated vcf files of the motif name for each dataset ID
     # first search for the associated vcf files based on the motif name
@@ -104,7 +270,7 @@ def process_file(file, af_path, dataset_ids, output_path):
         sys.exit(1)
         
     # create a dataset ID:af dataframe dictionary
-    dataset_af_dict = {dataset: load_vcf(path) for dataset, path in zip(dataset_ids, vcf_paths)}
+    dataset_af_dict = {dataset: load_vcf(path) for dataset, path in pair_vcf_paths(vcf_paths, dataset_ids).items()}
     print(dataset_af_dict)
         
     # create a pyranges object for the filtered TFBS footprint matrix
@@ -116,47 +282,95 @@ def process_file(file, af_path, dataset_ids, output_path):
         gr_vcf = pr.PyRanges(vcf)
         grs[name] = gr_vcf
 
-    target_gr = pyrange_obj_overlap(gr_fpscore, grs)
+    target_gr = pyrange_obj_overlap(gr_fpscore, grs, tiebreak=tiebreak)
     target_df = target_gr.df
 
-    # create a column called 'region_id'
-    target_df["region_id"] = target_df["Chromosome"].astype(str) + ":" + target_df["Start"].astype(str) + "-" + target_df["End"].astype(str)
+    write_wide_matrix(target_df, motif_id, output_path, index_mode)
+    # optionally keep all variants per site, not only the max-AF one
+    if ragged:
+        write_ragged_variants(target_df, grs, motif_id, output_path)
+    flush_writers()
 
-    # for all column name ending with the string '_fps', split the string, take the second element, change the first letter in the string to lowercase, and reconstruct the original string with the new first letter
-    target_df = target_df.rename(columns=lambda x: x.split('_')[0] + '_' + x.split('_')[1][0].lower() + x.split('_')[1][1:] + '_fps' if x.endswith('_fps') else x)
+# define concurrent function to process a batch of motifs with one overlap pass per dataset ID
+@profile_hook("overlap-batch", tfbs_suffix)
+def process_batch(files, af_path, dataset_ids, output_path, index_mode=None, ragged=False):
+    # stack the TFBS of all motifs in the batch into one motif-tagged dataframe
+    motif_ids = []
+    tfbs_dfs = []
+    for file in files:
+        motif_id, df_fps = load_tfbs(file)
+        df_fps.insert(3, "motif_id", motif_id)
+        motif_ids.append(motif_id)
+        tfbs_dfs.append(df_fps)
+    print(f"Processing a batch of {len(motif_ids)} filtered TFBS matrices: {motif_ids}")
+    df_fps_stacked = pd.concat(tfbs_dfs, ignore_index=True)
 
-    # construct output filename
-    outfile = os.path.join(output_path, f"{motif_id}_fpscore-af-varsites-combined-matrix-wide.tsv")
-        
-    # save to file
-    target_df.to_csv(outfile, sep="\t", index=False, na_rep='NULL')
+    # load one merged variant set per dataset ID for the whole batch
+    grs = load_merged_variants(af_path, motif_ids, dataset_ids)
 
-    # print the dimensions of the dataframe
-    print(f"Shape of the current motif ID ({motif_id}): {target_df.shape}")
-    print(f"Output file for {motif_id} has been generated!")
+    # overlap the stacked TFBS against each dataset ID once, clustering within each motif only
+    # the stacked join order differs from the per-motif one, so AF ties are always resolved by variant position and alleles here
+    gr_fpscore = pr.PyRanges(df_fps_stacked)
+    target_gr = pyrange_obj_overlap(gr_fpscore, grs, by="motif_id", tiebreak=True)
+    target_df = target_gr.df
+
+    # split the stacked result back into the per-motif wide matrices
+    for motif_id, motif_df in target_df.groupby("motif_id", sort=False):
+        motif_df = motif_df.drop(columns=["motif_id"]).reset_index(drop=True)
+        write_wide_matrix(motif_df, motif_id, output_path, index_mode)
+        if ragged:
+            write_ragged_variants(motif_df, grs, motif_id, output_path)
+    # the next motifs are split and rendered while the earlier ones are written; the batch returns once all of them are on disk
+    flush_writers()
     
-##################
-# load arguments #
-##################
+#############
+# load data #
+############# 
 
-fps_path = sys.argv[1] # path to where the filtered matrices of footprinting scores are stored
+if __name__ == "__main__":
+    ##################
+    # load arguments #
+    ##################
 
-af_path = sys.argv[2] # path to where the allelic frequency variant data are stored
+    # check for the required arguments
+    if len(sys.argv) < 5:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_overlap_raw_matrices_into_widetable.py <fps_path> <af_path> <dataset_ids_file> <output_path> [batch_size (default: 1)] [index or bgzip] [ragged] [tiebreak]")
+        print("A batch_size above 1 overlaps several motifs in one pass and walks the vcf directory once, but still parses every per-motif vcf extract; it always uses the tie-break below.")
+        print("'index' writes coordinate-sorted TSVs with a region index; 'bgzip' writes block-compressed .tsv.gz matrices instead, which serve region lookups (AF_FPS_range_index.py fetch) only, as the covariant site extraction reads plain .tsv matrices.")
+        print("'tiebreak' resolves AF ties within a cluster by variant position and alleles instead of by join order, with the faster overlap kernels; this changes some cells of the published matrices.")
+        sys.exit(1)
 
-# read in file containing dataset IDs with each line an element of a new list
-with open(sys.argv[3]) as file:
-    dataset_ids = [line.rstrip('\n') for line in file]
-print(f"Dataset IDs to be processed: {dataset_ids}")
+    fps_path = sys.argv[1] # path to where the filtered matrices of footprinting scores are stored
 
-output_path = sys.argv[4] # path to where the output files will be stored
+    af_path = sys.argv[2] # path to where the allelic frequency variant data are stored
 
-#############
-# load data #
-############# 
+    # read in file containing dataset IDs with each line an element of a new list
+    with open(sys.argv[3]) as file:
+        dataset_ids = [line.rstrip('\n') for line in file]
+    print(f"Dataset IDs to be processed: {dataset_ids}")
 
-if __name__ == "__main__":
-    # run concurrent processes
+    output_path = sys.argv[4] # path to where the output files will be stored
+
+    # optional number of motifs to overlap together in one pass (default: 1, one motif at a time)
+    batch_size = int(sys.argv[5]) if len(sys.argv) > 5 else 1
+
+    # optional region index of the output matrices: 'index' for plain TSVs, 'bgzip' for block-compressed .tsv.gz files, for region lookups only (default: none)
+    index_mode = sys.argv[6] if len(sys.argv) > 6 and sys.argv[6] in ("index", "bgzip") else None
+
+    # optional 'ragged' to also write all variants per TFBS and dataset ID, not only the max-AF one, as a ragged layout next to each wide matrix
+    ragged = "ragged" in sys.argv[6:9]
+
+    # optional 'tiebreak' to resolve AF ties by variant position and alleles rather than by the pyranges join order (default: join order, as in the published matrices; batches always use the tie-break)
+    tiebreak = "tiebreak" in sys.argv[6:9]
+
+    # run concurrent processes; consuming the results re-raises the errors and exits of the workers here
     with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
-        executor.map(process_file, path_generator(fps_path), itertools.repeat(af_path), itertools.repeat(dataset_ids), itertools.repeat(output_path))  
+        if batch_size > 1:
+            results = executor.map(process_batch, batch_generator(path_generator(fps_path), batch_size), itertools.repeat(af_path), itertools.repeat(dataset_ids), itertools.repeat(output_path), itertools.repeat(index_mode), itertools.repeat(ragged))
+        else:
+            results = executor.map(process_file, path_generator(fps_path), itertools.repeat(af_path), itertools.repeat(dataset_ids), itertools.repeat(output_path), itertools.repeat(index_mode), itertools.repeat(ragged), itertools.repeat(tiebreak))
+        for _ in results:
+            pass
 
-    print ("All footprint matrices have been processed!")
\ No newline at end of file
+    print ("All footprint matrices have been processed!")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import io
+import os
+import sys
+import zlib
+import fcntl
+import pandas as pd
+
+####################
+# define globals #
+####################
+
+# name of the dataset directory under the top output directory
+dataset_dirname = "datasets"
+
+# the span index that maps every (motif, table) to its bytes in a partition file
+index_filename = "span-index.tsv"
+
+index_columns = ["motif_id", "table", "partition", "offset", "nbytes", "nrows"]
+
+# the per-motif tables of the covariant site pipeline and the legacy file each of them replaces
+legacy_tables = {
+    "covariant_sites": ("covariant-sites", "_covariant_sites.tsv"),
+    "correlation_tests": ("correlation-tests", "_correlation_test_results.tsv"),
+    "fdr_corrected": ("correlation-tests", "_correlation_test_results_fdr-corrected.tsv"),
+    "fdr_corrected_sig": ("correlation-tests", "_correlation_test_results_fdr-corrected_sig.tsv"),
+}
+
+# number of partition files per table; motifs are assigned to them by a stable hash of the motif ID
+n_partitions = 16
+
+####################
+# define functions #
+####################
+
+# create a function to assign a motif to a partition, stable across runs and processes
+def partition_of(motif_id, partitions=n_partitions):
+    return zlib.crc32(motif_id.encode()) % partitions
+
+# create a function to get the partition file of a table
+def partition_path(dataset_dir, table, partition):
+    return os.path.join(dataset_dir, table, f"part-{partition:03d}.blocks")
+
+# create a function to append all tables of one motif to the dataset as a single atomic commit
+def write_motif_tables(dataset_dir, motif_id, tables, partitions=n_partitions):
+    partition = partition_of(motif_id, partitions)
+    # serialise every table exactly as its legacy per-motif file, header included
+    blocks = {table: (df.to_csv(sep="\t", index=True).encode(), len(df)) for table, df in tables.items()}
+    os.makedirs(dataset_dir, exist_ok=True)
+    with open(os.path.join(dataset_dir, index_filename), "a") as index_file:
+        # one writer at a time across the worker processes; the index lock guards all partition files
+        fcntl.flock(index_file, fcntl.LOCK_EX)
+        try:
+            index_lines = []
+            spans = {}
+            for table, (block, nrows) in blocks.items():
+                os.makedirs(os.path.join(dataset_dir, table), exist_ok=True)
+                with open(partition_path(dataset_dir, table, partition), "ab") as part_file:
+                    offset = part_file.seek(0, os.SEEK_END)
+                    part_file.write(block)
+                    part_file.flush()
+                    os.fsync(part_file.fileno())
+                index_lines.append(f"{motif_id}\t{table}\t{partition}\t{offset}\t{len(block)}\t{nrows}\n")
+                spans[table] = (partition, offset, len(block))
+            # the motif only becomes visible once its index lines are written, so an interrupted write leaves nothing behind for the readers
+            # the size is read under the lock, as another worker may have written the header since this file was opened
+            if os.fstat(index_file.fileno()).st_size == 0:
+                index_lines.insert(0, "\t".join(index_columns) + "\n")
+            index_file.write("".join(index_lines))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        finally:
+            fcntl.flock(index_file, fcntl.LOCK_UN)
+    # return the (partition, offset, nbytes) of every table that was written
+    return spans
+
+# create a function to load the span index, keeping only the latest commit of every (motif, table)
+def load_span_index(dataset_dir):
+    index_filepath = os.path.join(dataset_dir, index_filename)
+    if not os.path.exists(index_filepath):
+        return pd.DataFrame(columns=index_columns)
+    span_index = pd.read_csv(index_filepath, sep="\t")
+    # a rerun of a motif appends new spans, which supersede the older ones
+    return span_index.drop_duplicates(subset=["motif_id", "table"], keep="last").reset_index(drop=True)
+
+# create a function to read the raw bytes of one span
+def read_span(dataset_dir, span):
+    with open(partition_path(dataset_dir, span["table"], span["partition"]), "rb") as part_file:
+        part_file.seek(span["offset"])
+        return part_file.read(span["nbytes"])
+
+# create a function to get the per-motif view of a table as a dataframe, as the legacy file would have been loaded
+def read_motif_table(dataset_dir, table, motif_id, span_index=None):
+    if span_index is None:
+        span_index = load_span_index(dataset_dir)
+    spans = span_index[(span_index["motif_id"] == motif_id) & (span_index["table"] == table)]
+    if spans.empty:
+        return None
+    return pd.read_csv(io.BytesIO(read_span(dataset_dir, spans.iloc[-1])), sep="\t")
+
+# create a generator over the per-motif views of a table, reading each partition file in one go
+def iter_motif_tables(dataset_dir, table):
+    span_index = load_span_index(dataset_dir)
+    spans = span_index[span_index["table"] == table].sort_values(by=["partition", "offset"])
+    for partition, part_spans in spans.groupby("partition"):
+        with open(partition_path(dataset_dir, table, partition), "rb") as part_file:
+            data = part_file.read()
+        for span in part_spans.itertuples(index=False):
+            yield span.motif_id, pd.read_csv(io.BytesIO(data[span.offset:span.offset + span.nbytes]), sep="\t")
+
+# create a function to write the legacy per-motif files of one motif back out from the dataset
+def export_motif_views(dataset_dir, motif_id, output_path, span_index=None):
+    if span_index is None:
+        span_index = load_span_index(dataset_dir)
+    spans = span_index[span_index["motif_id"] == motif_id]
+    for span in spans.to_dict("records"):
+        subdir, suffix = legacy_tables[span["table"]]
+        os.makedirs(os.path.join(output_path, subdir), exist_ok=True)
+        with open(os.path.join(output_path, subdir, f"{motif_id}{suffix}"), "wb") as file:
+            file.write(read_span(dataset_dir, span))
+    return len(spans)
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_partitioned_output.py <dataset_dir> <output_path> [motif_id ...]")
+        print("Writes the legacy per-motif TSVs of the given motifs (default: all motifs) from a partitioned output dataset.")
+        sys.exit(1)
+
+    dataset_dir = sys.argv[1] # path to the dataset directory written by the covariant site pipeline
+
+    output_path = sys.argv[2] # top directory for the per-motif files
+
+    span_index = load_span_index(dataset_dir)
+    motif_ids = sys.argv[3:] if len(sys.argv) > 3 else span_index["motif_id"].unique().tolist()
+
+    for motif_id in motif_ids:
+        n_files = export_motif_views(dataset_dir, motif_id, output_path, span_index)
+        print(f"{n_files} files of {motif_id} have been written.")
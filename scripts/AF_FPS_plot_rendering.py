@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import json
+import hashlib
+import textwrap
+import numpy as np
+import pandas as pd
+import concurrent.futures as cf
+
+from pathlib import Path
+
+####################
+# define globals #
+####################
+
+# Set color values
+dutchfield_colordict = {'S6R691V_her2': "#e60049", 'ANAB5F7_basal': "#0bb4ff", '98JKPD8_lumA': "#87bc45", 'PU24GB8_lumB': "#ef9b20", '2GAMBDQ_norm': "#b33dc6"}
+
+gray = 'lightgray'
+
+gray_colordict = {'S6R691V_her2': gray, 'ANAB5F7_basal': gray, '98JKPD8_lumA': gray, 'PU24GB8_lumB': gray, '2GAMBDQ_norm': gray}
+
+# the rest of the dutchfield palette, for the samples of other cohorts
+dutchfield_colors = ["#e60049", "#0bb4ff", "#50e991", "#e6d800", "#9b19f5", "#ffa300", "#dc0ab4", "#b3d4ff", "#00bfa0"]
+
+# point layers with more points than this are rasterized inside the otherwise vector PDF
+raster_threshold = 20000
+
+# scatter plots with more points than this are drawn as hexbin densities instead of single points
+density_threshold = 500000
+
+# plot data files are written under {output_path}/output-data/plot-data/{motif_id}/
+plot_data_dirname = "plot-data"
+
+####################
+# define functions #
+####################
+
+# create a function to save the data of one plot for the rendering stage; the statistics workers call this instead of drawing
+def write_plot_data(output_path, motif_id, kind, plot_file, data, **params):
+    plot_data_dir = f'{output_path}/output-data/{plot_data_dirname}/{motif_id}'
+    os.makedirs(plot_data_dir, exist_ok=True)
+    plot_data_path = f'{plot_data_dir}/{Path(plot_file).stem}.pkl'
+    # keep a named index such as region_id as a column
+    data = data.reset_index() if data.index.name is not None else data.reset_index(drop=True)
+    plot_data = {'kind': kind, 'motif_id': motif_id, 'plot_file': plot_file, 'params': params, 'data': data}
+    pd.to_pickle(plot_data, f'{plot_data_path}.tmp')
+    os.replace(f'{plot_data_path}.tmp', plot_data_path)
+
+# create a function to get the colour and gray palettes of a set of samples; the BRCA subtypes keep their colours and other samples cycle through the dutchfield palette
+def sample_palettes(sample_ids):
+    others = [sample_id for sample_id in sorted(set(sample_ids)) if sample_id not in dutchfield_colordict]
+    colordict = {**dutchfield_colordict, **{sample_id: dutchfield_colors[i % len(dutchfield_colors)] for i, sample_id in enumerate(others)}}
+    return colordict, {sample_id: gray for sample_id in colordict}
+
+# create a function to load the plotting libraries on first use, so that the statistics workers that only save plot data never import them
+def plotting_libs():
+    import matplotlib
+    matplotlib.use("Agg")
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+    return sns, plt
+
+# create a function to hash the content of the plot data together with the renderer code
+def plot_data_hash(plot_data):
+    sha = hashlib.sha256()
+    sha.update(pd.util.hash_pandas_object(plot_data['data'], index=False).to_numpy().tobytes())
+    sha.update(json.dumps([plot_data['kind'], list(plot_data['data'].columns), plot_data['params']], sort_keys=True, default=str).encode())
+    with open(__file__, 'rb') as file:
+        sha.update(file.read())
+    return sha.hexdigest()
+
+def plot_jointplot(dataframe, motif_id, output):
+    sns, plt = plotting_libs()
+    # plot scatter plot of AF vs FPS_scaled, or its density when there are too many points to draw one by one
+    if len(dataframe) > density_threshold:
+        g = sns.jointplot(data=dataframe, x='AF', y='FPS_scaled', kind='hex', height=12)
+    else:
+        g = sns.jointplot(data=dataframe, x='AF', y='FPS_scaled', kind='scatter', hue='sample_id', height=12, rasterized=len(dataframe) > raster_threshold)
+    plt.xlim(-0.1, 1.1)
+    g.figure.suptitle(f"Jointpot of AF and scaled FPS values of {motif_id}", fontsize=14)
+    # save the plot
+    g.savefig(output, dpi=150, bbox_inches="tight")
+
+def plot_variance_scatter(filtered_df, motif_id, output):
+    sns, plt = plotting_libs()
+    # plot scatter plot of AF_var vs FPS_scaled_var of the filtered regions
+    if len(filtered_df) > density_threshold:
+        g = sns.jointplot(data=filtered_df, x="FPS_scaled_var", y="AF_var", kind='hex', height=10, ratio=5, color='darkslateblue')
+    else:
+        g = sns.jointplot(data=filtered_df, x="FPS_scaled_var", y="AF_var", height=10, ratio=5, color='darkslateblue', rasterized=len(filtered_df) > raster_threshold)
+    g.fig.suptitle(f'AF vs FPS var for {motif_id} (filtered: {len(filtered_df)} regions)')
+    # save the plot
+    g.savefig(output, dpi=300, bbox_inches="tight")
+
+def plot_region_boxplot(input_df, motif_id, output, highlight=None, threshold='iqr', central_stat=None):
+    sns, plt = plotting_libs()
+    # box plot of AF and scaled FPS distributions per filtered sorted site, with the subtype-hued stripplots on top
+    # highlight is None, 'maxima' or 'minima'; highlighted plots color only the per-site extreme and gray out the others
+    rasterized = len(input_df) > raster_threshold
+    # keep the site order of the filtered sorted table
+    order = input_df['region_id'].unique()
+    colordict, graydict = sample_palettes(input_df['sample_id'].unique())
+    plt.figure(figsize=(10, 10), dpi=300)
+    for row, (col, label) in enumerate((('AF', 'AF per site'), ('FPS_scaled', 'Scaled FPS per site'))):
+        # specify subplot
+        plt.subplot(4, 1, 2 * row + 1)
+        sns.boxplot(x='region_id', y=col, data=input_df, order=order, color='whitesmoke', linecolor='black', showfliers=False)
+        if highlight is None:
+            sns.stripplot(x='region_id', y=col, data=input_df, order=order, hue='sample_id', palette=colordict, size=4, jitter=True, legend=row == 0, linewidth=0.5, edgecolor='black', rasterized=rasterized)
+        else:
+            group_idx = input_df.groupby('region_id', observed=True)[col]
+            extreme_idx = group_idx.idxmax() if highlight == 'maxima' else group_idx.idxmin()
+            extreme = input_df.loc[extreme_idx]
+            others = input_df[~input_df.index.isin(extreme_idx)]
+            sns.stripplot(x='region_id', y=col, data=others, order=order, hue='sample_id', palette=graydict, size=4, jitter=True, legend=False, linewidth=0.5, edgecolor='dimgray', alpha=0.8, rasterized=rasterized)
+            sns.stripplot(x='region_id', y=col, data=extreme, order=order, hue='sample_id', palette=colordict, size=4, jitter=True, legend=row == 0, linewidth=0.5, edgecolor='black', rasterized=rasterized)
+            label = f'{label} ({highlight})'
+        # plot horizontal line at fps_scaled_global_mean
+        if col == 'FPS_scaled' and threshold == 'central':
+            plt.axhline(y=central_stat, color='black', linestyle='--')
+        plt.xticks(ticks=plt.xticks()[0], labels=[])
+        plt.xlabel('')
+        plt.ylabel(textwrap.fill(label, width=15), fontsize=10)
+        if row == 0:
+            # place legend outside of the plot
+            plt.legend(bbox_to_anchor=(1.01, 1), borderaxespad=0, markerscale=2, fontsize=10)
+
+        plt.subplot(4, 1, 2 * row + 2)
+        sns.barplot(x='region_id', y=f'{col}_var', data=input_df, order=order, color='darkslateblue', edgecolor='black')
+        if row == 0:
+            plt.xticks(ticks=plt.xticks()[0], labels=[])
+            plt.xlabel('')
+            plt.ylabel(textwrap.fill('AF variance', width=15), fontsize=10)
+    plt.xticks(rotation=90, fontsize=4)
+    if threshold == 'central':
+        plt.xlabel(f'{motif_id} binding sites with allelic variants (AF > 0.5 and scaled FPS above global mean)', fontsize=10)
+    else:
+        plt.xlabel(f'{motif_id} binding sites with allelic variants (AF > 0.5 and passing IQR threshold)', fontsize=10)
+    plt.ylabel('Scaled FPS variance', fontsize=10)
+    plt.subplots_adjust(hspace=0.05)
+    # save the plot
+    plt.savefig(output, dpi=300, bbox_inches="tight")
+
+def plot_stacked_barplot(longdf, motif_id, output, rotate_xticks=False, xticks_fontsize=5):
+    import matplotlib.patches as mpatches
+    sns, plt = plotting_libs()
+    # Get a list of unique 'sample_id' values
+    sample_ids = longdf['sample_id'].unique()
+    # plot the sorted stacked bar plot
+    plt.figure(figsize=(12, 6), dpi=300)
+    # Initialize a zero array for the 'bottom' parameter of the bar plot
+    bottom = np.zeros(len(longdf['region_id'].unique()))
+    # For each 'sample_id', stack its AF values on top of the previous one
+    for i, sample_id in enumerate(sample_ids):
+        data = longdf[longdf['sample_id'] == sample_id]
+        sns.barplot(data=data, x='region_id', y='AF', bottom=bottom, color=sns.color_palette()[i])
+        bottom += data['AF'].values
+    # Create a patch for each 'sample_id' and add the legend to the plot
+    patches = [mpatches.Patch(color=sns.color_palette()[i], label=sample_id) for i, sample_id in enumerate(sample_ids)]
+    plt.legend(handles=patches)
+    if rotate_xticks:
+        plt.xticks(rotation=90, fontsize=xticks_fontsize)
+    else:
+        plt.xticks([])
+    plt.ylabel('Cumulative allelic frequency (AF)', fontsize=12)
+    plt.xlabel(f'{motif_id} motif sites with called variants ({longdf["region_id"].nunique()})', fontsize=12)
+    plt.savefig(output, dpi=300, bbox_inches='tight')
+
+# the plot kinds the rendering stage knows how to draw
+renderers = {
+    'jointplot': plot_jointplot,
+    'variance_scatter': plot_variance_scatter,
+    'region_boxplot': plot_region_boxplot,
+    'stacked_barplot': plot_stacked_barplot,
+}
+
+# create a function to render one plot from its plot data file, unless the plot is up to date
+def render_plot(plot_data_path, output_path):
+    plot_data = pd.read_pickle(plot_data_path)
+    motif_id = plot_data['motif_id']
+    output = f"{output_path}/output-data/plots/{motif_id}/{plot_data['plot_file']}"
+    data_hash = plot_data_hash(plot_data)
+    # skip plots whose data and renderer have not changed since they were last drawn
+    if os.path.exists(output) and os.path.exists(f'{output}.sha256'):
+        with open(f'{output}.sha256') as file:
+            if file.read().strip() == data_hash:
+                return 'skipped'
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    renderers[plot_data['kind']](plot_data['data'], motif_id, output, **plot_data['params'])
+    # close the plot
+    _, plt = plotting_libs()
+    plt.close('all')
+    with open(f'{output}.sha256', 'w') as file:
+        file.write(data_hash)
+    return 'rendered'
+
+# create a function to render all plots of an output directory on a pool of workers
+def render_all(output_path, max_workers=4):
+    plot_data_paths = sorted(Path(f'{output_path}/output-data/{plot_data_dirname}').glob('*/*.pkl'))
+    with cf.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        statuses = list(executor.map(render_plot, plot_data_paths, [output_path] * len(plot_data_paths)))
+    return statuses.count('rendered'), statuses.count('skipped')
+
+##################
+# load arguments #
+##################
+
+if __name__ == '__main__':
+    # check for the required arguments
+    if len(sys.argv) < 2:
+        print('ERROR: Missing required arguments!')
+        print('USAGE: python3 AF_FPS_plot_rendering.py <top directory for output files> [number of workers (default: 4)]')
+        sys.exit(1)
+
+    output_dir = sys.argv[1]
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    n_rendered, n_skipped = render_all(output_dir, max_workers)
+    print(f'{n_rendered} plots have been rendered; {n_skipped} plots were up to date and have been skipped.')
@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import time
+import zlib
+import fnmatch
+import logging
+import functools
+import itertools
+
+####################
+# define globals #
+####################
+
+# motifs to profile: empty for none, 'all', 'sample:<fraction>' for a deterministic sample of the motif IDs, or comma-separated motif IDs and glob patterns
+profile_spec = os.environ.get("AF_FPS_PROFILE", "")
+
+# directory of the profile dumps, with one subdirectory per stage; every worker writes its own files, so that they never share one
+profile_dir = os.environ.get("AF_FPS_PROFILE_DIR", "AF_FPS-profiles")
+
+# tracemalloc slows a run down more than cProfile does, so the memory profile can be switched off on its own
+profile_memory = os.environ.get("AF_FPS_PROFILE_MEMORY", "1") != "0"
+
+# allocation sites kept per memory profile
+memory_top = 200
+
+# filenames of the merged reports
+hotspots_filename = "AF_FPS-profile_hotspots.tsv"
+packages_filename = "AF_FPS-profile_packages.tsv"
+collapsed_filename = "AF_FPS-profile_stacks.collapsed.txt"
+memory_filename = "AF_FPS-profile_memory.tsv"
+
+# libraries whose share of the time is reported separately, recognised by their directory in the file path of a function
+tracked_packages = ["pandas", "numpy", "natsort", "scipy", "statsmodels", "sklearn", "pyranges", "polars", "numba", "matplotlib", "seaborn"]
+
+# only one profiler runs at a time in a process; a profiled stage that calls another (a cohort run analyzing its wide matrices) is profiled as one
+_active = []
+
+# numbers the profiles of a process, so that a motif profiled twice by one worker keeps both
+_profile_numbers = itertools.count()
+
+####################
+# define functions #
+####################
+
+# create a function to decide whether a motif is profiled; sampling hashes the motif ID, so that every worker and every rerun picks the same motifs
+def profile_selected(motif_id, spec=None):
+    spec = profile_spec if spec is None else spec
+    if not spec:
+        return False
+    if spec == "all":
+        return True
+    if spec.startswith("sample:"):
+        return zlib.crc32(motif_id.encode()) / 2**32 < float(spec[len("sample:"):])
+    return any(fnmatch.fnmatchcase(motif_id, pattern) for pattern in spec.split(","))
+
+# create a function to write the allocation sites of a tracemalloc snapshot, largest first, with the peak of the traced memory
+def write_memory_profile(snapshot, peak, path):
+    stats = snapshot.statistics("lineno")[:memory_top]
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, "w") as file:
+        file.write(f"# peak_bytes\t{peak}\n")
+        file.write("filename\tlineno\tsize\tcount\n")
+        for stat in stats:
+            frame = stat.traceback[0]
+            file.write(f"{frame.filename}\t{frame.lineno}\t{stat.size}\t{stat.count}\n")
+    os.replace(tmp_path, path)
+
+# create a function to run one stage of one motif under cProfile, and tracemalloc if enabled, and dump both profiles to {profile_dir}/{stage}/{motif_id}.{pid}.{number}.prof and .mem.tsv
+def run_profiled(stage, motif_id, function, *args, **kwargs):
+    import cProfile
+    import tracemalloc
+    stage_dir = os.path.join(profile_dir, stage)
+    os.makedirs(stage_dir, exist_ok=True)
+    stem = os.path.join(stage_dir, f"{motif_id}.{os.getpid()}.{next(_profile_numbers)}")
+    # tracemalloc may already be tracing for someone else, in which case it is left running
+    trace_memory = profile_memory and not tracemalloc.is_tracing()
+    if trace_memory:
+        tracemalloc.start()
+    profiler = cProfile.Profile()
+    _active.append(motif_id)
+    start = time.perf_counter()
+    try:
+        return profiler.runcall(function, *args, **kwargs)
+    finally:
+        elapsed = time.perf_counter() - start
+        _active.pop()
+        tmp_path = f"{stem}.prof.tmp"
+        profiler.dump_stats(tmp_path)
+        os.replace(tmp_path, f"{stem}.prof")
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            write_memory_profile(tracemalloc.take_snapshot(), peak, f"{stem}.mem.tsv")
+            tracemalloc.stop()
+        logging.info(f"Profiled the {stage} stage of {motif_id} ({elapsed:.2f} s) into {stem}.prof")
+
+# create a function to wrap a per-motif stage so that it runs profiled for the selected motifs; the motif ID is its first argument's filename without the suffix, and a batch of files is profiled as one run when any of its motifs is selected
+def profile_hook(stage, suffix):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(path, *args, **kwargs):
+            # the hook costs one check when profiling is off
+            if not profile_spec or _active:
+                return function(path, *args, **kwargs)
+            paths = [path] if isinstance(path, (str, os.PathLike)) else list(path)
+            motif_ids = [os.path.basename(str(p)).replace(suffix, '') for p in paths]
+            if not any(profile_selected(motif_id) for motif_id in motif_ids):
+                return function(path, *args, **kwargs)
+            name = motif_ids[0] if len(motif_ids) == 1 else f"{motif_ids[0]}+{len(motif_ids) - 1}"
+            return run_profiled(stage, name, function, path, *args, **kwargs)
+        return wrapper
+    return decorate
+
+# create a function to label a profiled function: its package for library code, the script name for pipeline code, and builtins for C functions
+def function_package(filename, name=""):
+    # module imports run inside the profiled stage when a library is first loaded lazily
+    if filename.startswith("<frozen importlib"):
+        return "imports"
+    if filename == "~" or filename.startswith("<"):
+        # C functions of a library carry its module in their name, such as <built-in method pandas._libs.lib.maybe_convert_objects>
+        tracked = [package for package in tracked_packages if f"{package}." in name or f"'{package}" in name]
+        return tracked[0] if tracked else "builtins"
+    parts = filename.replace("\\", "/").split("/")
+    # the outermost tracked directory names the package (pandas/core/... is pandas)
+    tracked = [part for part in parts[:-1] if part in tracked_packages]
+    if tracked:
+        return tracked[0]
+    if "site-packages" in parts or "dist-packages" in parts:
+        return parts[parts.index("site-packages" if "site-packages" in parts else "dist-packages") + 1].split(".")[0]
+    if os.path.basename(filename).startswith("AF_FPS"):
+        return "pipeline"
+    return "stdlib"
+
+# create a function to name a profiled function in the reports
+def function_label(func):
+    filename, lineno, name = func
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{lineno}({name})"
+
+# create a function to load every profile dump under a directory; returns the merged statistics and, per function, the number of motif profiles it appears in
+def load_profiles(profile_path):
+    import pstats
+    paths = sorted(glob_profiles(profile_path, ".prof"))
+    if not paths:
+        raise FileNotFoundError(f"No profile dumps (*.prof) found under {profile_path}")
+    merged = pstats.Stats(paths[0])
+    n_profiles = {func: 1 for func in merged.stats}
+    for path in paths[1:]:
+        stats = pstats.Stats(path)
+        for func in stats.stats:
+            n_profiles[func] = n_profiles.get(func, 0) + 1
+        merged.add(stats)
+    return merged, n_profiles, paths
+
+# create a function to list the files of one kind under a profile directory and its stage subdirectories
+def glob_profiles(profile_path, extension):
+    for root, _, filenames in os.walk(profile_path):
+        for filename in filenames:
+            if filename.endswith(extension):
+                yield os.path.join(root, filename)
+
+# create a function to rank the functions of the merged profiles by their own time across all motifs
+def hotspot_rows(merged, n_profiles):
+    rows = []
+    for func, (primitive_calls, total_calls, tottime, cumtime, _) in merged.stats.items():
+        rows.append((function_label(func), function_package(func[0], func[2]), func[0], func[1], n_profiles.get(func, 0), primitive_calls, total_calls, tottime, cumtime))
+    return sorted(rows, key=lambda row: row[7], reverse=True)
+
+# create a function to sum the own time of the functions of every package, to see which library dominates
+def package_rows(hotspots):
+    totals = {}
+    for row in hotspots:
+        totals[row[1]] = totals.get(row[1], 0.0) + row[7]
+    grand_total = sum(totals.values()) or 1.0
+    return sorted(((package, seconds, seconds / grand_total) for package, seconds in totals.items()), key=lambda row: row[1], reverse=True)
+
+# create a function to turn the merged profiles into collapsed stacks (caller;callee;... microseconds) for flame graph tools
+# cProfile keeps only caller-callee pairs, not whole stacks, so the cumulative time of a function is split between its callees in proportion to the time of each call edge; recursion is cut where a function reappears on its own stack, and branches below min_fraction of the profiled time are left out, as the call graph of pandas has far too many paths to walk them all
+def collapsed_stacks(merged, max_depth=64, min_fraction=1e-4):
+    labels = {func: function_label(func) for func in merged.stats}
+    callees = {}
+    for func, (_, _, _, _, callers) in merged.stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    # the roots are the functions nobody in the profile called, such as the profiled stage itself
+    roots = [func for func, stat in merged.stats.items() if not stat[4]]
+    min_share = min_fraction * sum(merged.stats[root][3] for root in roots)
+    stacks = {}
+
+    def walk(func, share, stack, on_stack):
+        _, _, tottime, cumtime, _ = merged.stats[func]
+        key = f"{stack};{labels[func]}" if stack else labels[func]
+        scale = share / cumtime if cumtime > 0 else 0.0
+        stacks[key] = stacks.get(key, 0.0) + tottime * scale
+        if len(on_stack) >= max_depth:
+            return
+        on_stack.add(func)
+        for callee, edge_time in callees.get(func, []):
+            if callee not in on_stack and edge_time * scale >= min_share and edge_time * scale > 0:
+                walk(callee, edge_time * scale, key, on_stack)
+        on_stack.discard(func)
+
+    for root in roots:
+        walk(root, merged.stats[root][3], "", set())
+    return [(stack, int(round(seconds * 1e6))) for stack, seconds in stacks.items() if seconds * 1e6 >= 1]
+
+# create a function to merge the memory profiles of all motifs: the bytes still held per allocation site summed over motifs, and the peak of every motif
+def merge_memory_profiles(profile_path):
+    import pandas as pd
+    site_dfs, peaks = [], []
+    for path in sorted(glob_profiles(profile_path, ".mem.tsv")):
+        with open(path) as file:
+            peaks.append((os.path.basename(path)[:-len(".mem.tsv")], int(file.readline().split("\t")[1])))
+        site_dfs.append(pd.read_csv(path, sep="\t", comment="#").assign(profiles=1))
+    if not site_dfs:
+        return None, peaks
+    sites_df = pd.concat(site_dfs, ignore_index=True).groupby(["filename", "lineno"], as_index=False)[["size", "count", "profiles"]].sum()
+    sites_df.insert(0, "package", sites_df["filename"].map(function_package))
+    return sites_df.sort_values(by="size", ascending=False, kind="stable"), peaks
+
+# create a function to write the cross-motif hotspot, package and memory reports and the collapsed stacks of every profile dump under a directory
+def merge_profiles(profile_path, output_path, top_n=50):
+    merged, n_profiles, paths = load_profiles(profile_path)
+    os.makedirs(output_path, exist_ok=True)
+    hotspots = hotspot_rows(merged, n_profiles)
+    with open(os.path.join(output_path, hotspots_filename), "w") as file:
+        file.write("function\tpackage\tfilename\tlineno\tprofiles\tprimitive_calls\tcalls\ttottime\tcumtime\n")
+        for row in hotspots:
+            file.write("\t".join(str(value) for value in row) + "\n")
+    packages = package_rows(hotspots)
+    with open(os.path.join(output_path, packages_filename), "w") as file:
+        file.write("package\ttottime\tshare\n")
+        for package, seconds, share in packages:
+            file.write(f"{package}\t{seconds}\t{share}\n")
+    with open(os.path.join(output_path, collapsed_filename), "w") as file:
+        for stack, microseconds in collapsed_stacks(merged):
+            file.write(f"{stack} {microseconds}\n")
+    sites_df, peaks = merge_memory_profiles(profile_path)
+    if sites_df is not None:
+        sites_df.to_csv(os.path.join(output_path, memory_filename), sep="\t", index=False)
+
+    print(f"{len(paths)} profile dumps merged, {merged.total_tt:.2f} s of profiled time.")
+    print("Own time per package:")
+    for package, seconds, share in packages:
+        print(f"  {package:<12} {seconds:10.3f} s  {share:6.1%}")
+    print(f"Top {top_n} functions by own time across motifs:")
+    for row in hotspots[:top_n]:
+        print(f"  {row[7]:10.3f} s  {row[8]:10.3f} s cumulative  {row[6]:>10} calls  {row[4]:>4} profiles  {row[0]}")
+    if peaks:
+        motif, peak = max(peaks, key=lambda item: item[1])
+        print(f"Largest traced memory peak: {peak / 2**20:.1f} MiB ({motif}).")
+    print(f"Reports written to {output_path}: {hotspots_filename}, {packages_filename}, {collapsed_filename}" + (f", {memory_filename}" if sites_df is not None else ""))
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_profiling.py <profile directory> <output directory> [number of functions to print (default: 50)]")
+        print("Profiles are dumped by the pipeline scripts when AF_FPS_PROFILE is set: 'all', 'sample:<fraction>' or comma-separated motif IDs or glob patterns; AF_FPS_PROFILE_DIR sets the profile directory (default: AF_FPS-profiles) and AF_FPS_PROFILE_MEMORY=0 skips the memory profile.")
+        print("Merges the profile dumps into a cross-motif hotspot report, the own time per package, the largest allocation sites and collapsed stacks for flame graph tools.")
+        sys.exit(1)
+
+    if not any(glob_profiles(sys.argv[1], ".prof")):
+        print(f"ERROR: No profile dumps (*.prof) found under {sys.argv[1]}!")
+        sys.exit(1)
+    merge_profiles(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 50)
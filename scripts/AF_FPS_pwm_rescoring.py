@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import struct
+import itertools
+import numpy as np
+import pandas as pd
+import concurrent.futures as cf
+
+####################
+# define globals #
+####################
+
+tfbs_suffix = "_BRCA-subtype-vcf-filtered-matrix.txt"
+wide_suffix = "_fpscore-af-varsites-combined-matrix-wide.tsv"
+delta_suffix = "_variant-delta-pwm.tsv"
+
+# pseudocount added to the letter probabilities of a motif before they are turned into log2 odds against the background
+pseudocount = 0.01
+
+# base codes: A, C, G, T and 4 for N or any other letter; an N contributes nothing to a log-odds score
+base_codes = np.full(256, 4, dtype=np.int8)
+for code, letters in enumerate((b"Aa", b"Cc", b"Gg", b"Tt")):
+    base_codes[list(letters)] = code
+
+# complement lookup of uppercase ASCII bases
+complement = np.arange(256, dtype=np.uint8)
+complement[list(b"ACGTN")] = list(b"TGCAN")
+
+# one-hot rows of the base codes, with an all-zero row for N
+one_hot = np.vstack([np.eye(4), np.zeros(4)])
+
+# the 2bit letters of the codes 0-3
+twobit_letters = np.frombuffer(b"TCAG", dtype=np.uint8)
+
+# memory-mapped references opened in this process, keyed by path
+_references = {}
+
+####################
+# define functions #
+####################
+
+# create a function to build the samtools-style .fai index of a FASTA file if it does not have one yet
+def build_fai(fasta_path):
+    entries = []
+    with open(fasta_path, "rb") as file:
+        offset, name = 0, None
+        for line in file:
+            if line.startswith(b">"):
+                if name is not None:
+                    entries.append((name, length, seq_offset, linebases, linewidth))
+                name = line[1:].split()[0].decode()
+                length, seq_offset, linebases, linewidth = 0, offset + len(line), None, None
+            elif name is not None:
+                if linebases is None:
+                    linebases, linewidth = len(line.rstrip(b"\r\n")), len(line)
+                length += len(line.rstrip(b"\r\n"))
+            offset += len(line)
+        if name is not None:
+            entries.append((name, length, seq_offset, linebases or 0, linewidth or 0))
+    with open(f"{fasta_path}.fai", "w") as fai:
+        fai.writelines(f"{name}\t{length}\t{seq_offset}\t{linebases}\t{linewidth}\n" for name, length, seq_offset, linebases, linewidth in entries)
+
+# create a function to read the sequence index of a 2bit file
+def read_2bit_index(data):
+    signature, version, n_seqs, _ = struct.unpack_from("<IIII", data, 0)
+    if signature != 0x1A412743:
+        raise ValueError("Invalid 2bit file: only little-endian 2bit files are supported.")
+    index, pos = {}, 16
+    for _ in range(n_seqs):
+        name_size = data[pos]
+        name = bytes(data[pos + 1:pos + 1 + name_size]).decode()
+        (seq_offset,) = struct.unpack_from("<I", data, pos + 1 + name_size)
+        pos += 1 + name_size + 4
+        length, n_blocks = struct.unpack_from("<II", data, seq_offset)
+        n_starts = np.frombuffer(data, dtype="<u4", count=n_blocks, offset=seq_offset + 8).astype(np.int64)
+        n_sizes = np.frombuffer(data, dtype="<u4", count=n_blocks, offset=seq_offset + 8 + 4 * n_blocks).astype(np.int64)
+        (n_masks,) = struct.unpack_from("<I", data, seq_offset + 8 + 8 * n_blocks)
+        # the soft-mask blocks only mark lowercase bases, which are scored like uppercase ones, so they are skipped
+        dna_offset = seq_offset + 8 + 8 * n_blocks + 4 + 8 * n_masks + 4
+        index[name] = (length, dna_offset, n_starts, n_sizes)
+    return index
+
+# create a function to memory-map an indexed FASTA or a 2bit reference, once per process
+def open_reference(reference_path):
+    if reference_path not in _references:
+        data = np.memmap(reference_path, dtype=np.uint8, mode="r")
+        if reference_path.endswith(".2bit"):
+            _references[reference_path] = {"kind": "2bit", "data": data, "index": read_2bit_index(data)}
+        else:
+            if not os.path.exists(f"{reference_path}.fai"):
+                build_fai(reference_path)
+            fai = pd.read_csv(f"{reference_path}.fai", sep="\t", header=None, usecols=range(5), dtype={0: str})
+            index = {name: (length, offset, linebases, linewidth) for name, length, offset, linebases, linewidth in fai.itertuples(index=False)}
+            _references[reference_path] = {"kind": "fasta", "data": data, "index": index}
+    return _references[reference_path]
+
+# create a function to fetch the uppercase bases at an array of 0-based positions of one chromosome, with N outside the chromosome
+def fetch_bases(reference, chrom, positions):
+    positions = np.asarray(positions, dtype=np.int64)
+    bases = np.full(positions.shape, ord("N"), dtype=np.uint8)
+    if chrom not in reference["index"]:
+        return bases
+    inside = (positions >= 0) & (positions < reference["index"][chrom][0])
+    pos = positions[inside]
+    if reference["kind"] == "fasta":
+        _, offset, linebases, linewidth = reference["index"][chrom]
+        # skip the newline bytes of the wrapped lines before every position
+        raw = reference["data"][offset + pos // linebases * linewidth + pos % linebases]
+        bases[inside] = np.where((raw >= 97) & (raw <= 122), raw - 32, raw)
+    else:
+        _, dna_offset, n_starts, n_sizes = reference["index"][chrom]
+        # four bases per byte, first base in the two high bits
+        packed = reference["data"][dna_offset + pos // 4]
+        fetched = twobit_letters[(packed >> (6 - 2 * (pos % 4)).astype(np.uint8)) & 3]
+        # the N blocks are stored as T in the packed DNA; a chromosome may have none
+        if len(n_starts):
+            block = np.searchsorted(n_starts, pos, side="right") - 1
+            in_n_block = (block >= 0) & (pos < n_starts[np.maximum(block, 0)] + n_sizes[np.maximum(block, 0)])
+            fetched[in_n_block] = ord("N")
+        bases[inside] = fetched
+    return bases
+
+# create a function to load the motifs of a MEME motif file as log2-odds PWMs of shape (motif length, 4)
+def load_meme_motifs(meme_path):
+    with open(meme_path) as file:
+        lines = [line.strip() for line in file]
+    background = np.full(4, 0.25)
+    for i, line in enumerate(lines):
+        if line.startswith("Background letter frequencies"):
+            values = lines[i + 1].split()
+            background = np.array([float(value) for value in values[1::2]][:4])
+    motifs = {}
+    for i, line in enumerate(lines):
+        if not line.startswith("MOTIF"):
+            continue
+        fields = line.split()
+        names = [fields[1]] + ([fields[2], f"{fields[2]}_{fields[1]}"] if len(fields) > 2 else [])
+        start = next(j for j in range(i + 1, len(lines)) if lines[j].startswith("letter-probability matrix"))
+        width = int(lines[start].split("w=")[1].split()[0])
+        probs = np.array([[float(value) for value in row.split()[:4]] for row in lines[start + 1:start + 1 + width]])
+        probs = (probs + pseudocount) / (probs + pseudocount).sum(axis=1, keepdims=True)
+        pwm = np.log2(probs / background)
+        # a motif can be looked up by its ID, its name, or the name_ID of the TOBIAS output files
+        for name in names:
+            motifs[name] = pwm
+    return motifs
+
+# create a function to score windows of uppercase ASCII bases with a PWM by a one-hot convolution, all windows at once
+def score_windows(windows, pwm):
+    return np.einsum("nlk,lk->n", one_hot[base_codes[windows]], pwm)
+
+# create a function to get the variants of every sample from a wide matrix as a long table
+def variant_table(wide_df):
+    samples = [col[:-len("_varsite_pos")] for col in wide_df.columns if col.endswith("_varsite_pos")]
+    variant_dfs = []
+    for sample_id in samples:
+        cols = {f"{sample_id}_varsite_pos": "varsite_pos", f"{sample_id}_REF_al": "REF_al", f"{sample_id}_ALT_al": "ALT_al", f"{sample_id}_AF": "AF"}
+        sample_df = wide_df[["Chromosome", "Start", "End", "region_id", *cols]].rename(columns=cols)
+        sample_df = sample_df[sample_df["varsite_pos"].notna() & sample_df["REF_al"].notna() & sample_df["ALT_al"].notna()]
+        variant_dfs.append(sample_df.assign(sample_id=sample_id))
+    variants_df = pd.concat(variant_dfs, ignore_index=True) if variant_dfs else pd.DataFrame(columns=["Chromosome", "Start", "End", "region_id", "varsite_pos", "REF_al", "ALT_al", "AF", "sample_id"])
+    variants_df["varsite_pos"] = variants_df["varsite_pos"].astype(np.int64)
+    return variants_df
+
+# create a function to compute the PWM score of every site before and after applying each of its variants
+def rescore_variants(reference, sites_df, pwm):
+    # sites_df has one row per (site, variant), with Chromosome, Start, End, TFBS_strand, varsite_pos (1-based), REF_al and ALT_al columns
+    motif_len = len(pwm)
+    ref_len = sites_df["REF_al"].str.len().to_numpy()
+    alt_len = sites_df["ALT_al"].str.len().to_numpy()
+    # a context around the site that is long enough for any variant of the batch to be applied and the site to be re-read
+    margin = motif_len + int(max(ref_len.max(initial=0), alt_len.max(initial=0)))
+    width = (sites_df["End"] - sites_df["Start"]).max() + 2 * margin
+    ctx_start = sites_df["Start"].to_numpy(dtype=np.int64) - margin
+    contexts = np.empty((len(sites_df), width), dtype=np.uint8)
+    for chrom, rows in sites_df.groupby("Chromosome", sort=False).indices.items():
+        contexts[rows] = fetch_bases(reference, str(chrom), ctx_start[rows, None] + np.arange(width))
+
+    var_offset = sites_df["varsite_pos"].to_numpy(dtype=np.int64) - 1 - ctx_start
+    plus = sites_df["TFBS_strand"].to_numpy() != "-"
+    site_start = sites_df["Start"].to_numpy(dtype=np.int64) - ctx_start
+    site_end = sites_df["End"].to_numpy(dtype=np.int64) - ctx_start
+    # a + strand site is read from its start and a - strand site back from its end; a length change upstream of the anchor moves it
+    shift = alt_len - ref_len
+    anchor = np.where(plus, site_start + np.where(var_offset + ref_len <= site_start, shift, 0), site_end + np.where(var_offset < site_end, shift, 0) - motif_len)
+    ref_anchor = np.where(plus, site_start, site_end - motif_len)
+
+    # apply the variants: substitutions of equal length in place, indels by splicing the context row
+    alt_contexts = contexts.copy()
+    ref_mismatch = np.zeros(len(sites_df), dtype=bool)
+    snv = (ref_len == 1) & (alt_len == 1)
+    rows = np.flatnonzero(snv)
+    ref_base = np.frombuffer("".join(sites_df["REF_al"].to_numpy()[rows]).upper().encode(), dtype=np.uint8)
+    ref_mismatch[rows] = contexts[rows, var_offset[rows]] != ref_base
+    alt_contexts[rows, var_offset[rows]] = np.frombuffer("".join(sites_df["ALT_al"].to_numpy()[rows]).upper().encode(), dtype=np.uint8)
+    for row in np.flatnonzero(~snv):
+        ref_allele, alt_allele = sites_df["REF_al"].iat[row].upper().encode(), sites_df["ALT_al"].iat[row].upper().encode()
+        offset = var_offset[row]
+        ref_mismatch[row] = contexts[row, offset:offset + len(ref_allele)].tobytes() != ref_allele
+        spliced = np.concatenate([contexts[row, :offset], np.frombuffer(alt_allele, dtype=np.uint8), contexts[row, offset + len(ref_allele):]])
+        alt_contexts[row] = np.pad(spliced, (0, max(width - len(spliced), 0)), constant_values=ord("N"))[:width]
+
+    # read the motif-length window of every site, reverse complemented on the - strand, and score all of them together
+    window = np.arange(motif_len)
+    ref_windows = np.take_along_axis(contexts, ref_anchor[:, None] + window, axis=1)
+    alt_windows = np.take_along_axis(alt_contexts, np.clip(anchor[:, None] + window, 0, width - 1), axis=1)
+    ref_windows[~plus] = complement[ref_windows[~plus]][:, ::-1]
+    alt_windows[~plus] = complement[alt_windows[~plus]][:, ::-1]
+    ref_scores = score_windows(ref_windows, pwm)
+    alt_scores = score_windows(alt_windows, pwm)
+    # sites on chromosomes that the reference does not have cannot be scored
+    missing = ~sites_df["Chromosome"].astype(str).isin(list(reference["index"])).to_numpy()
+    ref_scores[missing], alt_scores[missing] = np.nan, np.nan
+    return ref_scores, alt_scores, ref_mismatch
+
+# create a function to annotate every variant of one motif's wide matrix with the change of its site's PWM score
+def annotate_motif(wide_path, tfbs_path, reference_path, motifs, output_path):
+    motif_id = os.path.basename(wide_path).replace(wide_suffix, "")
+    if motif_id not in motifs:
+        print(f"WARNING: No PWM found for {motif_id}. Skipping...")
+        return motif_id, 0
+    reference = open_reference(reference_path)
+    wide_df = pd.read_csv(wide_path, sep="\t", na_values="NULL", dtype={"Chromosome": str})
+    variants_df = variant_table(wide_df)
+    # the strand and the original match score of every site come from the TFBS matrix
+    tfbs_df = pd.read_csv(tfbs_path, sep="\t", usecols=["TFBS_chr", "TFBS_start", "TFBS_end", "TFBS_strand", "TFBS_score"], dtype={"TFBS_chr": str})
+    tfbs_df = tfbs_df.rename(columns={"TFBS_chr": "Chromosome", "TFBS_start": "Start", "TFBS_end": "End"}).drop_duplicates(subset=["Chromosome", "Start", "End", "TFBS_strand"])
+    variants_df = variants_df.merge(tfbs_df, on=["Chromosome", "Start", "End"], how="inner")
+    # every distinct (site, variant) is scored once, however many samples carry it
+    keys = ["Chromosome", "Start", "End", "TFBS_strand", "varsite_pos", "REF_al", "ALT_al"]
+    unique_df = variants_df[keys].drop_duplicates().reset_index(drop=True)
+    ref_scores, alt_scores, ref_mismatch = rescore_variants(reference, unique_df, motifs[motif_id])
+    unique_df["ref_mismatch"] = ref_mismatch
+    unique_df["ref_pwm_score"] = ref_scores
+    unique_df["alt_pwm_score"] = alt_scores
+    unique_df["delta_pwm"] = alt_scores - ref_scores
+    delta_df = variants_df.merge(unique_df, on=keys, how="left")
+    delta_df = delta_df[["region_id", "TFBS_strand", "TFBS_score", "sample_id", "varsite_pos", "REF_al", "ALT_al", "AF", "ref_mismatch", "ref_pwm_score", "alt_pwm_score", "delta_pwm"]]
+    delta_df.to_csv(os.path.join(output_path, f"{motif_id}{delta_suffix}"), sep="\t", index=False)
+    return motif_id, len(unique_df)
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 6:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_pwm_rescoring.py <reference FASTA (indexed or not) or 2bit> <MEME motif file> <directory of the filtered TFBS matrices> <directory of the wide matrices> <output directory> [number of workers (default: 8)]")
+        sys.exit(1)
+
+    reference_path = sys.argv[1] # path to the reference genome; a FASTA without a .fai index gets one built next to it
+    motifs = load_meme_motifs(sys.argv[2])
+    tfbs_dir = sys.argv[3]
+    wide_dir = sys.argv[4]
+    output_path = sys.argv[5]
+    max_workers = int(sys.argv[6]) if len(sys.argv) > 6 else 8
+
+    # build the FASTA index once before the workers map the reference
+    open_reference(reference_path)
+    os.makedirs(output_path, exist_ok=True)
+    wide_paths = sorted(os.path.join(wide_dir, file) for file in os.listdir(wide_dir) if file.endswith(wide_suffix))
+    tfbs_paths = [os.path.join(tfbs_dir, os.path.basename(path).replace(wide_suffix, tfbs_suffix)) for path in wide_paths]
+    with cf.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for motif_id, n_variants in executor.map(annotate_motif, wide_paths, tfbs_paths, itertools.repeat(reference_path), itertools.repeat(motifs), itertools.repeat(output_path)):
+            print(f"{n_variants} variants of {motif_id} have been re-scored.")
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+####################
+# define globals #
+####################
+
+# the ragged variant layout of a motif is written next to its wide matrix
+ragged_suffix = "_fpscore-af-varsites-ragged.npz"
+
+####################
+# define functions #
+####################
+
+# create a function to lay out every variant of every dataset ID inside each site as flat arrays with per-sample offsets
+# pairs holds, per dataset ID, the site index of each variant (non-decreasing) and its position, REF allele, ALT allele and AF
+# the variants of site r in dataset ID s are the flat entries offsets[s, r]:offsets[s, r + 1]; alleles are stored as codes into one allele vocabulary
+def ragged_layout(region_ids, pairs):
+    n_rows = len(region_ids)
+    dataset_ids = list(pairs)
+    counts = np.array([np.bincount(pairs[dataset][0], minlength=n_rows) for dataset in dataset_ids], dtype=np.int64).reshape(len(dataset_ids), n_rows)
+    # the samples follow each other in the flat arrays, so the offsets of one sample start where those of the previous one end
+    offsets = np.zeros((len(dataset_ids), n_rows + 1), dtype=np.int64)
+    offsets[:, 1:] = np.cumsum(counts, axis=1)
+    offsets += np.concatenate([[0], np.cumsum(counts.sum(axis=1))[:-1]])[:, None]
+    ref = np.concatenate([np.asarray(pairs[dataset][2], dtype=str) for dataset in dataset_ids] or [np.array([], dtype=str)])
+    alt = np.concatenate([np.asarray(pairs[dataset][3], dtype=str) for dataset in dataset_ids] or [np.array([], dtype=str)])
+    allele_codes, alleles = pd.factorize(np.concatenate([ref, alt]), sort=True)
+    return {
+        "region_id": np.asarray(region_ids, dtype=str),
+        "dataset_ids": np.asarray(dataset_ids, dtype=str),
+        "offsets": offsets,
+        "pos": np.concatenate([np.asarray(pairs[dataset][1], dtype=np.int64) for dataset in dataset_ids] or [np.array([], dtype=np.int64)]),
+        "ref_code": allele_codes[:len(ref)].astype(np.int32),
+        "alt_code": allele_codes[len(ref):].astype(np.int32),
+        "AF": np.concatenate([np.asarray(pairs[dataset][4], dtype=np.float64) for dataset in dataset_ids] or [np.array([], dtype=np.float64)]),
+        "alleles": np.asarray(alleles, dtype=str),
+    }
+
+# create a function to save a ragged layout atomically, so that readers never see a partial file
+def save_ragged(layout, path):
+    tmp_path = f"{path}.tmp{os.getpid()}.npz"
+    np.savez_compressed(tmp_path, **layout)
+    os.replace(tmp_path, path)
+    return path
+
+# create a function to load a ragged layout; it holds no Python objects, so nothing is unpickled
+def load_ragged(path):
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+# create a function to get the (sample, site) segment of every flat entry
+def segment_index(layout):
+    n_samples, n_rows = len(layout["dataset_ids"]), len(layout["region_id"])
+    counts = np.diff(layout["offsets"], axis=1)
+    segments = np.repeat(np.arange(n_samples * n_rows), counts.ravel())
+    return segments // max(n_rows, 1), segments % max(n_rows, 1)
+
+# create a function to count the variants of every dataset ID per site
+def variant_counts(layout):
+    return pd.DataFrame(np.diff(layout["offsets"], axis=1).T, index=pd.Index(layout["region_id"], name="region_id"), columns=[f"{dataset}_n_variants" for dataset in layout["dataset_ids"]])
+
+# create a function to sum the AF of all variants of every dataset ID per site
+def af_sums(layout):
+    n_samples, n_rows = len(layout["dataset_ids"]), len(layout["region_id"])
+    samples, rows = segment_index(layout)
+    sums = np.bincount(samples * n_rows + rows, weights=layout["AF"], minlength=n_samples * n_rows).reshape(n_samples, n_rows)
+    return pd.DataFrame(sums.T, index=pd.Index(layout["region_id"], name="region_id"), columns=[f"{dataset}_AF_sum" for dataset in layout["dataset_ids"]])
+
+# create a function to find, per site, the largest AF difference of one variant between two dataset IDs; a variant missing from a dataset ID has an AF of 0 there, as in the wide matrix
+def max_delta_af(layout):
+    n_samples, n_rows = len(layout["dataset_ids"]), len(layout["region_id"])
+    samples, rows = segment_index(layout)
+    # the same variant of a site in different dataset IDs shares one row of the AF matrix
+    keys = np.stack([rows, layout["pos"], layout["ref_code"], layout["alt_code"]], axis=1)
+    variants, variant_index = np.unique(keys, axis=0, return_inverse=True)
+    af_matrix = np.zeros((len(variants), n_samples))
+    np.maximum.at(af_matrix, (variant_index.ravel(), samples), layout["AF"])
+    delta = af_matrix.max(axis=1, initial=0.0) - af_matrix.min(axis=1, initial=0.0) if n_samples else np.zeros(len(variants))
+    max_delta = np.zeros(n_rows)
+    np.maximum.at(max_delta, variants[:, 0], delta)
+    return pd.Series(max_delta, index=pd.Index(layout["region_id"], name="region_id"), name="max_delta_AF")
+
+# create a function to summarise the full variant burden of every site in one table
+def summarise_ragged(layout):
+    summary_df = pd.concat([variant_counts(layout), af_sums(layout), max_delta_af(layout)], axis=1)
+    return summary_df.reset_index()
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 2:
+        print("ERROR: Missing required arguments!")
+        print(f"USAGE: python3 AF_FPS_ragged_variants.py <motif{ragged_suffix} file> [output tsv (default: stdout)]")
+        print("Summarises all variants per TFBS: the variant count and AF sum per dataset ID, and the largest AF difference of one variant between dataset IDs.")
+        sys.exit(1)
+
+    summary_df = summarise_ragged(load_ragged(sys.argv[1]))
+    summary_df.to_csv(sys.argv[2] if len(sys.argv) > 2 else sys.stdout, sep="\t", index=False)
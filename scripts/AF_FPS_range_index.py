@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import io
+import os
+import sys
+import json
+import zlib
+import bisect
+import numpy as np
+import pandas as pd
+
+from natsort import natsorted
+
+####################
+# define globals #
+####################
+
+# width of the bins of the linear index; a lookup starts reading at most one bin before the query
+bin_size = 16384
+
+# uncompressed size of a block of a block-compressed matrix
+block_size = 65536
+
+index_suffix = ".ridx.json"
+
+####################
+# define functions #
+####################
+
+# create a function to sort a wide matrix by chromosome in natural order, then start and end
+def sort_by_coordinate(target_df):
+    chroms = target_df["Chromosome"].astype(str)
+    chrom_rank = chroms.map({chrom: rank for rank, chrom in enumerate(natsorted(chroms.unique()))})
+    order = np.lexsort((target_df["End"].to_numpy(), target_df["Start"].to_numpy(), chrom_rank.to_numpy()))
+    return target_df.iloc[order].reset_index(drop=True)
+
+# create a function to compress text blocks into independent gzip members, so that any block can be decompressed on its own
+def compress_block(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+# create a function to write a coordinate sorted wide matrix with its binned coordinate index
+def write_indexed_matrix(target_df, outfile, compress=False):
+    target_df = sort_by_coordinate(target_df)
+    header, *lines = target_df.to_csv(sep="\t", index=False, na_rep='NULL').encode().splitlines(keepends=True)
+
+    # the position of every row is a (block offset, offset within the block) pair; uncompressed files are a single block at offset 0
+    positions = []
+    with open(outfile, "wb") as file:
+        if not compress:
+            file.write(header)
+            offset = len(header)
+            for line in lines:
+                positions.append((offset, 0))
+                offset += len(line)
+            file.write(b"".join(lines))
+        else:
+            block, block_offset = [header], 0
+            block_len = len(header)
+            for line in lines:
+                if block_len + len(line) > block_size and block_len > 0:
+                    compressed = compress_block(b"".join(block))
+                    file.write(compressed)
+                    block_offset += len(compressed)
+                    block, block_len = [], 0
+                positions.append((block_offset, block_len))
+                block.append(line)
+                block_len += len(line)
+            file.write(compress_block(b"".join(block)))
+
+    # record the first row of every non-empty bin per chromosome, and the longest region as the lookback of a query
+    chroms = {}
+    starts = target_df["Start"].to_numpy()
+    spans = (target_df["End"] - target_df["Start"]).to_numpy()
+    for chrom, rows in target_df.groupby(target_df["Chromosome"].astype(str), sort=False).indices.items():
+        bins, first_rows = np.unique(starts[rows] // bin_size, return_index=True)
+        chroms[chrom] = {
+            "max_span": int(spans[rows].max()),
+            "bins": bins.tolist(),
+            "positions": [positions[rows[row]] for row in first_rows],
+        }
+    index = {"bin_size": bin_size, "compressed": compress, "header": header.decode().rstrip("\n"), "chroms": chroms}
+    with open(f"{outfile}{index_suffix}", "w") as file:
+        json.dump(index, file)
+
+# create a function to index an existing wide matrix file, rewriting it in coordinate order if needed
+def index_matrix(matrix_path, compress=False, outfile=None):
+    target_df = pd.read_csv(matrix_path, sep="\t", keep_default_na=False, dtype=str)
+    target_df[["Start", "End"]] = target_df[["Start", "End"]].astype(np.int64)
+    write_indexed_matrix(target_df, outfile or matrix_path, compress)
+
+# create a function to iterate over the lines of a matrix from a (block offset, offset within the block) position
+def iter_lines(file, position, compressed):
+    block_offset, within_offset = position
+    file.seek(block_offset)
+    if not compressed:
+        yield from file
+        return
+    pending = b""
+    raw = file.read(block_size)
+    decompressor = zlib.decompressobj(31)
+    while raw:
+        data = decompressor.decompress(raw)
+        # a block ends where its gzip member ends; the next one needs a fresh decompressor
+        while decompressor.eof:
+            raw = decompressor.unused_data
+            decompressor = zlib.decompressobj(31)
+            data += decompressor.decompress(raw)
+        if within_offset:
+            skip = min(within_offset, len(data))
+            data, within_offset = data[skip:], within_offset - skip
+        lines = (pending + data).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + b"\n"
+        raw = file.read(block_size)
+    if pending:
+        yield pending
+
+# create a function to load the coordinate index of a matrix
+def load_index(matrix_path):
+    with open(f"{matrix_path}{index_suffix}") as file:
+        return json.load(file)
+
+# create a function to fetch the rows of a matrix that overlap a chrom:start-end region by seeking instead of parsing the whole file
+def fetch_region(matrix_path, region, index=None):
+    if index is None:
+        index = load_index(matrix_path)
+    chrom, span = region.rsplit(":", 1)
+    start, end = (int(value) for value in span.replace(",", "").split("-"))
+    header = index["header"]
+    columns = header.split("\t")
+    chrom_index = index["chroms"].get(chrom)
+    if chrom_index is None:
+        return pd.read_csv(io.StringIO(header + "\n"), sep="\t", na_values="NULL")
+
+    # start at the first bin that can hold a region reaching into the query
+    first_bin = max(start - chrom_index["max_span"], 0) // index["bin_size"]
+    pos = bisect.bisect_left(chrom_index["bins"], first_bin)
+    if pos == len(chrom_index["bins"]):
+        return pd.read_csv(io.StringIO(header + "\n"), sep="\t", na_values="NULL")
+
+    chrom_col, start_col, end_col = columns.index("Chromosome"), columns.index("Start"), columns.index("End")
+    rows = []
+    with open(matrix_path, "rb") as file:
+        for line in iter_lines(file, chrom_index["positions"][pos], index["compressed"]):
+            fields = line.decode().rstrip("\n").split("\t")
+            # rows are sorted by start within a chromosome, so the first row past the query or on the next chromosome ends the scan
+            if fields[chrom_col] != chrom or int(fields[start_col]) > end:
+                break
+            if int(fields[end_col]) >= start:
+                rows.append(line.decode())
+    return pd.read_csv(io.StringIO(header + "\n" + "".join(rows)), sep="\t", na_values="NULL")
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3 or sys.argv[1] not in ("index", "bgzip", "fetch"):
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_range_index.py index <wide matrix files ...>")
+        print("       python3 AF_FPS_range_index.py bgzip <wide matrix files ...>")
+        print("       python3 AF_FPS_range_index.py fetch <chrom:start-end> <indexed wide matrix files ...>")
+        print("bgzip keeps each matrix and writes a block-compressed .tsv.gz copy next to it for region lookups; the covariant site extraction reads only the plain .tsv matrices.")
+        sys.exit(1)
+
+    if sys.argv[1] == "fetch":
+        region = sys.argv[2]
+        for matrix_path in sys.argv[3:]:
+            motif_id = os.path.basename(matrix_path).split("_fpscore-af-varsites-combined-matrix-wide.tsv")[0]
+            region_df = fetch_region(matrix_path, region)
+            region_df.insert(0, "motif_id", motif_id)
+            region_df.to_csv(sys.stdout, sep="\t", index=False, na_rep='NULL', header=matrix_path == sys.argv[3])
+    else:
+        # bgzip writes a block-compressed copy next to each matrix; index rewrites each matrix in place
+        for matrix_path in sys.argv[2:]:
+            compress = sys.argv[1] == "bgzip"
+            index_matrix(matrix_path, compress, f"{matrix_path}.gz" if compress else None)
+            print(f"{matrix_path} has been indexed.")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import sys
+import numpy as np
+import pandas as pd
+
+####################
+# define globals #
+####################
+
+# how a tie for the extreme value of a region is broken: 'first' keeps the first sample in sorted sample order (as idxmax/idxmin on the
+# filtered sorted long tables do), 'last' keeps the last one, and 'none' gives the region no winner
+tie_policies = ("first", "last", "none")
+
+####################
+# define functions #
+####################
+
+# create a function to turn a long table into regions x samples arrays, keeping the region order of the table and sorting the samples
+def long_to_arrays(long_df, columns=("AF", "FPS_scaled")):
+    region_codes, region_ids = pd.factorize(long_df["region_id"].astype(str), sort=False)
+    sample_codes, sample_ids = pd.factorize(long_df["sample_id"].astype(str), sort=True)
+    arrays = {}
+    for col in columns:
+        values = np.full((len(region_ids), len(sample_ids)), np.nan)
+        values[region_codes, sample_codes] = long_df[col].to_numpy(dtype=float)
+        arrays[col] = values
+    return np.asarray(region_ids), np.asarray(sample_ids), arrays
+
+# create a function to find the sample with the maximum or minimum value of every region; regions without a winner get -1
+def region_winners(values, extreme="max", tie="first"):
+    if tie not in tie_policies:
+        raise ValueError(f'Invalid tie policy. Please choose one of {", ".join(tie_policies)}.')
+    # a table without regions or samples has no winners
+    if values.size == 0:
+        return np.full(values.shape[0], -1, dtype=np.int64)
+    # missing values never win
+    fill = -np.inf if extreme == "max" else np.inf
+    filled = np.where(np.isnan(values), fill, values)
+    best = filled.max(axis=1) if extreme == "max" else filled.min(axis=1)
+    is_best = (filled == best[:, None]) & ~np.isnan(values)
+    if tie == "last":
+        winners = values.shape[1] - 1 - is_best[:, ::-1].argmax(axis=1)
+    else:
+        winners = is_best.argmax(axis=1)
+    n_best = is_best.sum(axis=1)
+    no_winner = (n_best == 0) | ((n_best > 1) & (tie == "none"))
+    return np.where(no_winner, -1, winners)
+
+# create a function to find the argmax and argmin sample of AF and FPS_scaled for every region of a long table in one pass
+def find_region_extrema(long_df, columns=("AF", "FPS_scaled"), tie="first"):
+    region_ids, sample_ids, arrays = long_to_arrays(long_df, columns)
+    extrema, wins = {}, {}
+    for col in columns:
+        for extreme in ("max", "min"):
+            winners = region_winners(arrays[col], extreme, tie)
+            extrema[f"{col}_{extreme}"] = np.where(winners >= 0, sample_ids[np.maximum(winners, 0)], None)
+            # the number of regions every sample wins, zero included
+            wins[f"{col}_{extreme}"] = np.bincount(winners[winners >= 0], minlength=len(sample_ids))
+    # the winning sample per region, and the per-sample win counts
+    extrema_df = pd.DataFrame(extrema, index=pd.Index(region_ids, name="region_id"))
+    wins_df = pd.DataFrame(wins, index=pd.Index(sample_ids, name="sample_id"))
+    return extrema_df, wins_df
+
+# create a function to get the (region_id, sample_id) pairs of one extreme, as the rows selected by idxmax/idxmin would give them
+def winner_pairs(extrema_df, key):
+    return extrema_df[key].dropna().rename("sample_id").reset_index()
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 2:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_region_extrema.py <long table with region_id, sample_id, AF and FPS_scaled columns> [tie policy (default: first)]")
+        sys.exit(1)
+
+    long_df = pd.read_csv(sys.argv[1], sep="\t")
+    tie = sys.argv[2] if len(sys.argv) > 2 else "first"
+    _, wins_df = find_region_extrema(long_df, tie=tie)
+    wins_df.to_csv(sys.stdout, sep="\t")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+import pyranges as pr
+
+from natsort import natsorted
+
+from AF_FPS_overlap_raw_matrices_into_widetable import path_generator, load_tfbs, load_merged_variants, pyrange_obj_overlap, finalise_wide_matrix
+from AF_FPS_kernels import cluster_labels
+
+####################
+# define globals #
+####################
+
+# the coordinate columns that define a distinct TFBS region
+coord_cols = ["Chromosome", "Start", "End"]
+
+registry_filename = "cohort_region-registry-matrix-wide.tsv"
+
+motif_index_filename = "cohort_region-registry-motif-index.tsv"
+
+####################
+# define functions #
+####################
+
+# create a function to collect the distinct TFBS regions of all motifs and the per-motif index lists into them
+def build_registry(files):
+    tfbs_dfs = []
+    index_dfs = []
+    for file in files:
+        motif_id, df_fps = load_tfbs(file)
+        print(f"Registering TFBS of {motif_id}...")
+        tfbs_dfs.append(df_fps)
+        # keep the original row order of the motif so that its matrix can be rebuilt as it was
+        index_df = df_fps[coord_cols].copy()
+        index_df.insert(0, "motif_id", motif_id)
+        index_dfs.append(index_df)
+
+    # footprint scores are per region and not per motif, so one copy per distinct coordinate is kept
+    regions = pd.concat(tfbs_dfs, ignore_index=True).drop_duplicates(subset=coord_cols)
+    # sort the regions in natural chromosome order, as pyranges returns them
+    chrom_order = pd.Categorical(regions["Chromosome"], categories=natsorted(regions["Chromosome"].unique()), ordered=True)
+    regions = regions.assign(chrom_order=chrom_order).sort_values(by=["chrom_order", "Start", "End"]).drop(columns=["chrom_order"]).reset_index(drop=True)
+    # assign every distinct region an integer ID
+    regions.insert(0, "region_idx", np.arange(len(regions), dtype=np.int64))
+    print(f"{len(regions)} distinct TFBS regions found across {len(index_dfs)} motifs.")
+
+    # translate the coordinates of each motif into region IDs
+    motif_index = pd.concat(index_dfs, ignore_index=True).merge(regions[["region_idx"] + coord_cols], on=coord_cols, how="left")
+    # a site listed twice in one motif is one region of that motif
+    motif_index = motif_index[["motif_id", "region_idx"]].drop_duplicates().reset_index(drop=True)
+    return regions, motif_index
+
+# create a function to overlap the distinct regions against the variants once for the whole cohort
+def overlap_registry(regions, motif_ids, af_path, dataset_ids):
+    grs = load_merged_variants(af_path, motif_ids, dataset_ids)
+    # cluster within each region so that distinct regions of different motifs are never merged
+    # as in batch mode, the join order differs from the per-motif one, so AF ties are resolved by variant position and alleles
+    target_gr = pyrange_obj_overlap(pr.PyRanges(regions), grs, by="region_idx", tiebreak=True)
+    registry = target_gr.df.sort_values(by="region_idx").reset_index(drop=True)
+    # finalise the columns like a motif wide matrix and move region_idx to the front
+    region_idx = registry.pop("region_idx")
+    registry = finalise_wide_matrix(registry)
+    registry.insert(0, "region_idx", region_idx)
+    return registry
+
+# create a function to load the registry and the motif index from an output directory
+def load_registry(registry_path):
+    registry = pd.read_csv(os.path.join(registry_path, registry_filename), sep="\t", na_values="NULL")
+    motif_index = pd.read_csv(os.path.join(registry_path, motif_index_filename), sep="\t")
+    return registry, motif_index
+
+# create a function to merge the overlapping regions of one motif as the per-motif overlap does: for each dataset ID in turn, the regions left are clustered and only the one with the max-AF variant of each cluster is kept
+# AF ties are resolved by the tie-break of the overlap (variant position, alleles, then site), and regions without a variant count with an AF of -1 as in the join
+def collapse_clusters(motif_df):
+    chrom_codes = pd.factorize(motif_df["Chromosome"])[0]
+    keep = np.arange(len(motif_df))
+    for af_col in [col for col in motif_df.columns if col.endswith("_AF")]:
+        dataset = af_col[:-len("_AF")]
+        rows = motif_df.iloc[keep]
+        matched = rows[f"{dataset}_varsite_pos"].notna()
+        keys = pd.DataFrame({
+            "Cluster": cluster_labels(rows["Start"].to_numpy(), rows["End"].to_numpy(), chrom_codes[keep]),
+            "AF": rows[af_col].where(matched, -1).to_numpy(dtype=float),
+            "pos": rows[f"{dataset}_varsite_pos"].where(matched, -1).to_numpy(dtype=float),
+            "ref": rows[f"{dataset}_REF_al"].where(matched, "-1").astype(str).to_numpy(),
+            "alt": rows[f"{dataset}_ALT_al"].where(matched, "-1").astype(str).to_numpy(),
+            "Start": rows["Start"].to_numpy(),
+            "End": rows["End"].to_numpy(),
+            "row": keep,
+        })
+        keys = keys.sort_values(by=["pos", "ref", "alt", "Start", "End"], kind="stable")
+        keep = np.sort(keys.loc[keys.groupby("Cluster")["AF"].idxmax(), "row"].to_numpy())
+    return motif_df.iloc[keep].reset_index(drop=True)
+
+# create a function to rebuild the wide matrix of one motif from the registry
+def motif_view(registry, motif_index, motif_id):
+    region_idxs = motif_index.loc[motif_index["motif_id"] == motif_id, "region_idx"].unique()
+    # registry rows are ordered by region_idx, so sorting the index list keeps the genomic order of the per-motif matrices
+    motif_df = registry.set_index("region_idx").loc[np.sort(region_idxs)].reset_index(drop=True)
+    # the registry overlaps every region on its own, so the overlapping regions of the motif are merged here
+    return collapse_clusters(motif_df)
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 5:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_region_registry.py <fps_path> <af_path> <dataset_ids_file> <output_path> [expand]")
+        sys.exit(1)
+
+    fps_path = sys.argv[1] # path to where the filtered matrices of footprinting scores are stored
+
+    af_path = sys.argv[2] # path to where the allelic frequency variant data are stored
+
+    # read in file containing dataset IDs with each line an element of a new list
+    with open(sys.argv[3]) as file:
+        dataset_ids = [line.rstrip('\n') for line in file]
+    print(f"Dataset IDs to be processed: {dataset_ids}")
+
+    output_path = sys.argv[4] # path to where the output files will be stored
+
+    # optionally write the per-motif wide matrices from the registry for the downstream scripts
+    expand = len(sys.argv) > 5 and sys.argv[5] == "expand"
+
+    # build and overlap the registry
+    regions, motif_index = build_registry(path_generator(fps_path))
+    motif_ids = motif_index["motif_id"].unique().tolist()
+    registry = overlap_registry(regions, motif_ids, af_path, dataset_ids)
+
+    # save to file
+    registry.to_csv(os.path.join(output_path, registry_filename), sep="\t", index=False, na_rep='NULL')
+    motif_index.to_csv(os.path.join(output_path, motif_index_filename), sep="\t", index=False)
+    print(f"Region registry of shape {registry.shape} and motif index of {len(motif_index)} rows have been saved!")
+
+    if expand:
+        for motif_id in motif_ids:
+            motif_df = motif_view(registry, motif_index, motif_id)
+            outfile = os.path.join(output_path, f"{motif_id}_fpscore-af-varsites-combined-matrix-wide.tsv")
+            motif_df.to_csv(outfile, sep="\t", index=False, na_rep='NULL')
+            print(f"Output file for {motif_id} has been generated from the registry!")
+
+    print("Region registry has been built!")
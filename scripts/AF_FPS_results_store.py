@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import sqlite3
+import pandas as pd
+
+from AF_FPS_stage_cache import file_digest
+from AF_FPS_partitioned_output import index_filename, load_span_index, read_motif_table
+from AF_FPS_async_writer import compression_suffixes, read_table, resolve_table
+
+####################
+# define globals #
+####################
+
+fdr_suffix = "_correlation_test_results_fdr-corrected.tsv"
+
+# sites holds every tested covariant site; the R-tree indexes them by (chromosome, position) for range queries
+schema = """
+CREATE TABLE IF NOT EXISTS chromosomes (chrom TEXT PRIMARY KEY, chrom_idx INTEGER UNIQUE);
+CREATE TABLE IF NOT EXISTS motifs (motif_id TEXT PRIMARY KEY, source_digest TEXT, n_sites INTEGER);
+CREATE TABLE IF NOT EXISTS sites (
+    site_id INTEGER PRIMARY KEY,
+    motif_id TEXT NOT NULL,
+    region_id TEXT NOT NULL,
+    chrom TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    corr_coeff REAL,
+    pvalue REAL,
+    adj_pvalue REAL
+);
+CREATE INDEX IF NOT EXISTS sites_motif ON sites (motif_id);
+CREATE INDEX IF NOT EXISTS sites_adj_pvalue ON sites (adj_pvalue);
+CREATE VIRTUAL TABLE IF NOT EXISTS sites_rtree USING rtree_i32 (site_id, chrom_lo, chrom_hi, pos_lo, pos_hi);
+"""
+
+site_columns = ["motif_id", "region_id", "chrom", "start", "end", "corr_coeff", "pvalue", "adj_pvalue"]
+
+####################
+# define functions #
+####################
+
+# create a function to open the store, creating the schema on first use
+def open_store(db_path):
+    # several pipeline workers may add motifs at the same time, so wait on the write lock instead of failing
+    conn = sqlite3.connect(db_path, timeout=600)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # in WAL mode this still keeps the store consistent on a crash, without an fsync per motif
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(schema)
+    return conn
+
+# create a function to parse a chrom:start-end region string into its parts
+def parse_region(region):
+    chrom, span = region.rsplit(":", 1)
+    start, end = span.replace(",", "").split("-")
+    return chrom, int(start), int(end)
+
+# create a function to look up the integer index of a chromosome for the R-tree, registering it if it is new
+def chrom_index(conn, chrom, create=True):
+    row = conn.execute("SELECT chrom_idx FROM chromosomes WHERE chrom = ?", (chrom,)).fetchone()
+    if row is not None or not create:
+        return None if row is None else row[0]
+    chrom_idx = conn.execute("SELECT COALESCE(MAX(chrom_idx) + 1, 0) FROM chromosomes").fetchone()[0]
+    conn.execute("INSERT INTO chromosomes VALUES (?, ?)", (chrom, chrom_idx))
+    return chrom_idx
+
+# create a function to replace all sites of one motif in a single transaction
+def add_motif(conn, motif_id, fdr_df, source_digest=None):
+    # fdr_df is a motif's FDR-corrected correlation table, with region_id, corr_coeff, pvalue and adj_pvalues columns
+    coords = fdr_df["region_id"].str.extract(r"^(?P<chrom>.+):(?P<start>\d+)-(?P<end>\d+)$")
+    with conn:
+        old_ids = "SELECT site_id FROM sites WHERE motif_id = ?"
+        conn.execute(f"DELETE FROM sites_rtree WHERE site_id IN ({old_ids})", (motif_id,))
+        conn.execute("DELETE FROM sites WHERE motif_id = ?", (motif_id,))
+        chrom_idxs = {chrom: chrom_index(conn, chrom) for chrom in coords["chrom"].dropna().unique()}
+        # assign the site IDs up front so that the table and the R-tree can be filled with bulk inserts
+        first_id = conn.execute("SELECT COALESCE(MAX(site_id) + 1, 0) FROM sites").fetchone()[0]
+        site_ids = range(first_id, first_id + len(fdr_df))
+        starts, ends = coords["start"].astype(int).tolist(), coords["end"].astype(int).tolist()
+        conn.executemany("INSERT INTO sites VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", zip(site_ids, [motif_id] * len(fdr_df), fdr_df["region_id"], coords["chrom"], starts, ends, fdr_df["corr_coeff"].astype(float), fdr_df["pvalue"].astype(float), fdr_df["adj_pvalues"].astype(float)))
+        conn.executemany("INSERT INTO sites_rtree VALUES (?, ?, ?, ?, ?)", ((site_id, chrom_idxs[chrom], chrom_idxs[chrom], start, end) for site_id, chrom, start, end in zip(site_ids, coords["chrom"], starts, ends)))
+        conn.execute("INSERT OR REPLACE INTO motifs VALUES (?, ?, ?)", (motif_id, source_digest, len(fdr_df)))
+
+# create a function to identify a dataset span; a motif committed again always lands at a new offset
+def span_digest(partition, offset, nbytes):
+    return f"{partition}:{offset}:{nbytes}"
+
+# create a function to find the FDR-corrected tables of a results directory, plain or compressed, and the path and digest of each to detect changes
+def find_results(results_dir):
+    if os.path.exists(os.path.join(results_dir, index_filename)):
+        span_index = load_span_index(results_dir)
+        spans = span_index[span_index["table"] == "fdr_corrected"]
+        return {span.motif_id: (None, span_digest(span.partition, span.offset, span.nbytes)) for span in spans.itertuples(index=False)}
+    fdr_endings = tuple(f"{fdr_suffix}{suffix}" for suffix in compression_suffixes.values())
+    motif_ids = sorted({file.split(fdr_suffix)[0] for file in os.listdir(results_dir) if file.endswith(fdr_endings)})
+    paths = {motif_id: resolve_table(os.path.join(results_dir, f"{motif_id}{fdr_suffix}")) for motif_id in motif_ids}
+    # the digest is taken of the file process_data stored, whatever its compression
+    return {motif_id: (path, file_digest(path)) for motif_id, path in paths.items()}
+
+# create a function to load the motifs that are new or have changed since the last update into the store
+def update_store(db_path, results_dir):
+    conn = open_store(db_path)
+    stored = dict(conn.execute("SELECT motif_id, source_digest FROM motifs").fetchall())
+    results = find_results(results_dir)
+    changed = [motif_id for motif_id, (_, digest) in results.items() if stored.get(motif_id) != digest]
+    dataset = os.path.exists(os.path.join(results_dir, index_filename))
+    span_index = load_span_index(results_dir) if dataset else None
+    for motif_id in changed:
+        if dataset:
+            fdr_df = read_motif_table(results_dir, "fdr_corrected", motif_id, span_index)
+        else:
+            fdr_df = read_table(results[motif_id][0], sep="\t")
+        add_motif(conn, motif_id, fdr_df, results[motif_id][1])
+    conn.close()
+    return len(changed), len(results)
+
+# create a function to query sites by genomic range, motif and p-value thresholds; every filter is optional
+def query_sites(db_path, region=None, motif_ids=None, max_adj_pvalue=None, max_pvalue=None):
+    conn = open_store(db_path)
+    clauses, params = [], []
+    if region is not None:
+        chrom, start, end = parse_region(region) if isinstance(region, str) else region
+        chrom_idx = chrom_index(conn, chrom, create=False)
+        if chrom_idx is None:
+            conn.close()
+            return pd.DataFrame(columns=site_columns)
+        # overlap of closed intervals, answered by the R-tree
+        clauses.append("s.site_id IN (SELECT site_id FROM sites_rtree WHERE chrom_lo <= ? AND chrom_hi >= ? AND pos_lo <= ? AND pos_hi >= ?)")
+        params += [chrom_idx, chrom_idx, end, start]
+    if motif_ids is not None:
+        clauses.append(f"s.motif_id IN ({', '.join('?' * len(motif_ids))})")
+        params += list(motif_ids)
+    if max_adj_pvalue is not None:
+        clauses.append("s.adj_pvalue < ?")
+        params.append(max_adj_pvalue)
+    if max_pvalue is not None:
+        clauses.append("s.pvalue < ?")
+        params.append(max_pvalue)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sites_df = pd.read_sql_query(f"SELECT {', '.join(f's.{col}' for col in site_columns)} FROM sites s {where} ORDER BY s.motif_id, s.chrom, s.start", conn, params=params)
+    conn.close()
+    return sites_df
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 4 or sys.argv[1] not in ("update", "query"):
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_results_store.py update <db_path> <correlation-tests directory or datasets directory>")
+        print("       python3 AF_FPS_results_store.py query <db_path> <chrom:start-end or -> [max adj p-value or -] [motif_id ...]")
+        sys.exit(1)
+
+    db_path = sys.argv[2] # path to the SQLite results store, created if it does not exist
+
+    if sys.argv[1] == "update":
+        n_changed, n_total = update_store(db_path, sys.argv[3])
+        print(f"{n_changed} of {n_total} motifs have been loaded into the results store.")
+    else:
+        region = sys.argv[3] if sys.argv[3] != "-" else None
+        max_adj_pvalue = float(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4] != "-" else None
+        motif_ids = sys.argv[5:] if len(sys.argv) > 5 else None
+        sites_df = query_sites(db_path, region, motif_ids, max_adj_pvalue)
+        sites_df.to_csv(sys.stdout, sep="\t", index=False)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import json
+import hashlib
+import pandas as pd
+
+####################
+# define globals #
+####################
+
+# default upper bound of the on-disk cache size before the least recently used entries are evicted
+cache_max_bytes = 10 * 1024**3
+
+# in-process memo of file digests, keyed by (path, size, mtime) so that unchanged inputs are only hashed once
+_digest_memo = {}
+
+####################
+# define functions #
+####################
+
+# create a function to hash the content of a file in chunks
+def file_digest(path):
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _digest_memo:
+        sha = hashlib.sha256()
+        with open(path, "rb") as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b""):
+                sha.update(chunk)
+        _digest_memo[memo_key] = sha.hexdigest()
+    return _digest_memo[memo_key]
+
+# create a function to read the digest of the wide matrix a Welford accumulator file was written for, from its '# wide_digest' header line; files written before the header existed have none
+def accumulator_source(acc_filepath):
+    with open(acc_filepath) as file:
+        first_line = file.readline()
+    return first_line.rstrip("\n").split("\t")[1] if first_line.startswith("# wide_digest\t") else None
+
+# create a function to derive the cache file of a stage from the input digest, the stage parameters and the code version
+def stage_cache_path(cache_dir, stage, input_digest, params, code_version):
+    if cache_dir is None:
+        return None
+    key_source = json.dumps({"input": input_digest, "stage": stage, "params": params, "code": code_version}, sort_keys=True)
+    key = hashlib.sha256(key_source.encode()).hexdigest()
+    return os.path.join(cache_dir, f"{stage}-{key}.pkl")
+
+# create a function to load a cached stage output; returns None on a miss or when caching is disabled
+def cache_load(path):
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        obj = pd.read_pickle(path)
+    except (FileNotFoundError, EOFError):
+        # the entry was evicted or is being replaced by another worker
+        return None
+    # refresh the modification time, which is used as the LRU clock
+    os.utime(path)
+    return obj
+
+# create a function to store a stage output and keep the cache within its size bound
+def cache_store(path, obj, max_bytes=cache_max_bytes):
+    if path is None:
+        return
+    cache_dir = os.path.dirname(path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a worker-specific temporary file first so that readers never see a partial entry
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pd.to_pickle(obj, tmp_path)
+    os.replace(tmp_path, path)
+    evict_lru(cache_dir, max_bytes)
+
+# create a function to remove the least recently used entries until the cache fits into max_bytes
+def evict_lru(cache_dir, max_bytes=cache_max_bytes):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(".pkl"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # another worker has already evicted it
+            pass
+        total -= size
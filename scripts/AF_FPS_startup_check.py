@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import json
+import subprocess
+
+####################
+# define globals #
+####################
+
+# target time for a fresh worker to import a pipeline script, as a spawn or forkserver worker does before its first task
+startup_budget = 0.75
+
+# libraries that only the stages using them may import
+heavy_modules = ("matplotlib", "seaborn", "sklearn", "statsmodels", "scipy")
+
+# imports a script by path under a module name other than __main__ in a fresh interpreter, like a spawned worker, and reports the time and the heavy libraries loaded
+probe = """
+import sys, time, json, importlib.util
+sys.path.insert(0, {script_dir!r})
+start = time.perf_counter()
+spec = importlib.util.spec_from_file_location("__mp_main__", {script_path!r})
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "heavy": sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy_modules!r}))}}))
+"""
+
+####################
+# define functions #
+####################
+
+# create a function to measure the import time of a script in a fresh interpreter, taking the best of several runs
+def worker_startup(script_path, repeats=3):
+    script_path = os.path.abspath(script_path)
+    code = probe.format(script_dir=os.path.dirname(script_path), script_path=script_path, heavy_modules=heavy_modules)
+    runs = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return min(run["seconds"] for run in runs), runs[-1]["heavy"]
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 2:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_startup_check.py <pipeline scripts ...>")
+        print(f"Fails if importing a script takes longer than {startup_budget} s or loads any of {', '.join(heavy_modules)}.")
+        sys.exit(1)
+
+    failed = False
+    for script_path in sys.argv[1:]:
+        seconds, heavy = worker_startup(script_path)
+        ok = seconds <= startup_budget and not heavy
+        failed = failed or not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {os.path.basename(script_path)}: {seconds:.3f} s{' (loads ' + ', '.join(heavy) + ')' if heavy else ''}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import json
+import fcntl
+import numpy as np
+import pandas as pd
+
+####################
+# define globals #
+####################
+
+# every motif appends its summary records to this file under {output_path}/output-data/; the covariant site extraction writes them for every motif it processes
+summary_filename = "AF_FPS-motif_summary_records.jsonl"
+
+# number of bins per axis of the 2-D AF/FPS_scaled histograms; both values lie in [0, 1]
+hist_bins = 20
+
+# the 2x2 region counts of the central thresholding, in [[HI-AF/HI-FPS, HI-AF/LO-FPS], [LO-AF/HI-FPS, LO-AF/LO-FPS]] order
+contingency_fields = ["hi_af_hi_fps", "hi_af_lo_fps", "lo_af_hi_fps", "lo_af_lo_fps"]
+
+# the cohort tables written by the reducer
+site_counts_filename = "1360_motifs_variable_site_counts-sorted.tsv"
+common_max_filename = "All-motifs_common_max_AF-FPS_regions.tsv"
+variant_counts_filename = "All-motifs_variant_site_counts.tsv"
+contingency_filename = "All-motifs_AF-FPS_region_contingency_counts.tsv"
+histogram_filename = "All-motifs_AF_FPS-scaled_histogram2d.tsv"
+
+####################
+# define functions #
+####################
+
+# create a function to get the summary record file of an output directory
+def summary_path(output_path):
+    return os.path.join(output_path, "output-data", summary_filename)
+
+# create a function to count the AF/FPS_scaled pairs of a long table on the fixed histogram grid
+def afps_histogram(long_df):
+    values = long_df[["AF", "FPS_scaled"]].dropna()
+    counts, _, _ = np.histogram2d(values["AF"], values["FPS_scaled"], bins=hist_bins, range=[[0, 1], [0, 1]])
+    return counts.astype(np.int64).tolist()
+
+# create a function to append one summary record of a motif; a record holds any subset of the summary fields
+def write_summary_record(output_path, motif_id, **fields):
+    record_path = summary_path(output_path)
+    os.makedirs(os.path.dirname(record_path), exist_ok=True)
+    line = json.dumps({"motif_id": motif_id, **fields}) + "\n"
+    with open(record_path, "a") as record_file:
+        # one writer at a time across the worker processes, so that records never interleave
+        fcntl.flock(record_file, fcntl.LOCK_EX)
+        try:
+            record_file.write(line)
+            record_file.flush()
+        finally:
+            fcntl.flock(record_file, fcntl.LOCK_UN)
+
+# create a function to load the summary records and merge them per motif; later records override the fields of earlier ones
+def load_summary_records(record_path):
+    records = {}
+    with open(record_path) as record_file:
+        for line in record_file:
+            # skip a partial last line left by an interrupted worker
+            if not line.endswith("\n"):
+                continue
+            record = json.loads(line)
+            records.setdefault(record["motif_id"], {}).update(record)
+    return records
+
+# create a function to reduce the merged records of all motifs into the cohort tables in one pass
+def reduce_summaries(records):
+    site_counts, common_max, variant_counts, contingency = [], [], [], []
+    histogram = np.zeros((hist_bins, hist_bins), dtype=np.int64)
+    for motif_id in sorted(records):
+        record = records[motif_id]
+        if "max_af_region_counts" in record:
+            max_fps_counts = record["max_fps_region_counts"]
+            site_counts += [(motif_id, sample_id, count, max_fps_counts.get(sample_id)) for sample_id, count in record["max_af_region_counts"].items()]
+        if "common_max_regions" in record:
+            common_max += [(motif_id, region_id, sample_id) for region_id, sample_id in record["common_max_regions"]]
+        if "variant_site_counts" in record:
+            variant_counts += [(motif_id, sample_id, count) for sample_id, count in record["variant_site_counts"].items()]
+        if "contingency" in record:
+            contingency.append((motif_id, *record["contingency"]))
+        if "afps_histogram" in record:
+            histogram += np.asarray(record["afps_histogram"], dtype=np.int64)
+    edges = np.linspace(0, 1, hist_bins + 1)
+    bin_labels = [f"{low:.2f}-{high:.2f}" for low, high in zip(edges[:-1], edges[1:])]
+    return {
+        site_counts_filename: pd.DataFrame(site_counts, columns=["motif_id", "sample_id", "max_AF_region_count", "max_FPS_region_count"]),
+        common_max_filename: pd.DataFrame(common_max, columns=["motif_id", "region_id", "sample_id"]),
+        variant_counts_filename: pd.DataFrame(variant_counts, columns=["motif_id", "sample_id", "variant_site_count"]),
+        contingency_filename: pd.DataFrame(contingency, columns=["motif_id", *contingency_fields]),
+        # rows are AF bins and columns are FPS_scaled bins
+        histogram_filename: pd.DataFrame(histogram, index=pd.Index(bin_labels, name="AF"), columns=bin_labels),
+    }
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    # check for the required arguments
+    if len(sys.argv) < 3:
+        print("ERROR: Missing required arguments!")
+        print("USAGE: python3 AF_FPS_summary_records.py <top directory of the covariant site extraction (or data-viz) outputs> <output_dir>")
+        sys.exit(1)
+
+    records = load_summary_records(summary_path(sys.argv[1]))
+    print(f"Summary records of {len(records)} motifs have been loaded.")
+
+    output_dir = sys.argv[2]
+    os.makedirs(output_dir, exist_ok=True)
+    for filename, table_df in reduce_summaries(records).items():
+        table_df.to_csv(os.path.join(output_dir, filename), sep="\t", index=filename == histogram_filename)
+        print(f"{filename} has been written.")
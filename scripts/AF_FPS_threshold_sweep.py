@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import numpy as np
+import pandas as pd
+
+####################
+# define functions #
+####################
+
+# create a function to parse a comma-separated list of thresholds from the command line
+def parse_grid(arg):
+    return [float(value) for value in arg.split(',')]
+
+# create a function to compute the upper IQR fences of AF_var and FPS_scaled_var for a list of multipliers
+def upper_fences(merged_stat_vars, multipliers):
+    # same quantiles as get_covariant_sites, computed once for all multipliers
+    q1 = merged_stat_vars[['AF_var', 'FPS_scaled_var']].quantile(0.25).to_numpy()
+    q3 = merged_stat_vars[['AF_var', 'FPS_scaled_var']].quantile(0.75).to_numpy()
+    # shape (n_multipliers, 2): one AF_var and one FPS_scaled_var fence per multiplier
+    return q3[None, :] + np.asarray(multipliers, dtype=float)[:, None] * (q3 - q1)[None, :]
+
+# create a function to count covariant and BH-significant regions for every combination of thresholds
+def sweep_counts(region_stats, fences, multipliers, af_cutoffs, alphas):
+    # region_stats holds one row per region with AF_var, FPS_scaled_var, max_AF and pvalue (NaN where no test was run)
+    af_var = region_stats['AF_var'].to_numpy()
+    fps_var = region_stats['FPS_scaled_var'].to_numpy()
+    max_af = region_stats['max_AF'].to_numpy()
+    # NaN p-values (degenerate tests) are ordered last
+    missing = region_stats['pvalue'].isna().to_numpy()
+    pvalues = np.nan_to_num(region_stats['pvalue'].to_numpy(dtype=float), nan=1.0)
+
+    # order regions by p-value once so that the BH step-up can be evaluated with cumulative sums
+    order = np.argsort(pvalues, kind='stable')
+    af_var, fps_var, max_af, pvalues, missing = af_var[order], fps_var[order], max_af[order], pvalues[order], missing[order]
+
+    # boolean masks of shape (n_multipliers, n_af_cutoffs, n_regions)
+    fence_mask = (af_var[None, :] > fences[:, 0, None]) & (fps_var[None, :] > fences[:, 1, None])
+    af_mask = max_af[None, :] > np.asarray(af_cutoffs, dtype=float)[:, None]
+    mask = fence_mask[:, None, :] & af_mask[None, :, :]
+    n_tests = mask.sum(axis=-1)
+
+    # BH: the number of adj_pvalues below alpha is the largest rank k with p_(k) * n / k < alpha
+    ranks = np.cumsum(mask, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = np.where(mask, pvalues[None, None, :] * n_tests[..., None] / ranks, np.inf)
+    alphas_arr = np.asarray(alphas, dtype=float)
+    passing = scaled[..., None, :] < alphas_arr[None, None, :, None]
+    n_significant = np.where(passing, ranks[..., None, :], 0).max(axis=-1)
+    # multipletests returns NaN for every adjusted p-value when one of the p-values is NaN, so correct_for_fdr finds no significant sites then
+    n_significant[(mask & missing[None, None, :]).any(axis=-1)] = 0
+
+    # flatten the grid into a compact long table
+    grid_m, grid_c, grid_a = np.meshgrid(np.arange(len(multipliers)), np.arange(len(af_cutoffs)), np.arange(len(alphas)), indexing='ij')
+    sweep_df = pd.DataFrame({
+        'iqr_multiplier': np.asarray(multipliers, dtype=float)[grid_m.ravel()],
+        'af_cutoff': np.asarray(af_cutoffs, dtype=float)[grid_c.ravel()],
+        'fdr_alpha': alphas_arr[grid_a.ravel()],
+        'covariant_sites': n_tests[grid_m.ravel(), grid_c.ravel()],
+        'significant_sites': n_significant.ravel(),
+    })
+    return sweep_df
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+####################
+# import libraries #
+####################
+
+import os
+import sys
+import json
+import time
+import fnmatch
+import socket
+import logging
+import threading
+import importlib.util
+import concurrent.futures as cf
+
+from AF_FPS_profiling import profile_hook
+
+####################
+# define globals #
+####################
+
+# default number of warm worker processes kept by the daemon
+max_workers = 4
+
+# wide matrices written by the overlap stage and read by the covariant stage
+matrix_suffix = "_fpscore-af-varsites-combined-matrix-wide.tsv"
+tfbs_suffix = "_BRCA-subtype-vcf-filtered-matrix.txt"
+
+# per-worker warm state: parsed variant sites by vcf path (with the mtime and size they were parsed at), and the vcf file listing of every AF directory
+_variant_store = {}
+_af_listings = {}
+_modules = {}
+
+####################
+# define functions #
+####################
+
+# create a function to set up logging, in the daemon and in every pool worker
+def setup_logging():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# create a function to load a pipeline script once per process; the covariant script has a hyphenated filename, so it is loaded by path
+def pipeline_module(name):
+    if name not in _modules:
+        filename = {"overlap": "AF_FPS_overlap_raw_matrices_into_widetable.py", "covariant": "AF_FPS-covariant_site_extraction.py"}[name]
+        spec = importlib.util.spec_from_file_location(filename[:-3].replace("-", "_"), os.path.join(os.path.dirname(os.path.abspath(__file__)), filename))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _modules[name] = module
+    return _modules[name]
+
+# create a function to list the vcf extracts of an AF directory once per process
+def af_listing(af_path, refresh=False):
+    if refresh or af_path not in _af_listings:
+        _af_listings[af_path] = pipeline_module("overlap").find_files(af_path, "*.txt")
+    return _af_listings[af_path]
+
+# create a function to get the variant sites of a vcf extract as a pyranges object, parsing the file only when it is new or has changed
+def variant_ranges(vcf_path):
+    import pyranges as pr
+    stat = os.stat(vcf_path)
+    cached = _variant_store.get(vcf_path)
+    if cached is None or cached[0] != (stat.st_mtime_ns, stat.st_size):
+        cached = ((stat.st_mtime_ns, stat.st_size), pr.PyRanges(pipeline_module("overlap").load_vcf(vcf_path)))
+        _variant_store[vcf_path] = cached
+    return cached[1]
+
+# create a function to warm a new pool worker: import the pipeline scripts and their libraries, and optionally parse every vcf extract of an AF directory
+def warm_worker(af_path=None):
+    setup_logging()
+    pipeline_module("overlap")
+    pipeline_module("covariant")
+    # the libraries the covariant stage imports lazily are loaded up front, as a daemon worker pays for them only once
+    import scipy.special, sklearn.preprocessing, statsmodels.stats.multitest
+    if af_path:
+        for vcf_path in af_listing(af_path):
+            variant_ranges(vcf_path)
+
+# create a function to report the size of the warm state of a worker
+def worker_state():
+    return {"pid": os.getpid(), "variant_files": len(_variant_store), "af_listings": len(_af_listings)}
+
+# create a function to overlap the TFBS matrix of one motif with the warm variant sites of every dataset ID, as process_file does
+@profile_hook("overlap", tfbs_suffix)
+def overlap_job(file, af_path, dataset_ids, output_path, index_mode=None):
+    import pyranges as pr
+    overlap = pipeline_module("overlap")
+    motif_id, df_fps = overlap.load_tfbs(file)
+    pattern = f"*{motif_id}*.txt"
+    vcf_paths = [path for path in af_listing(af_path) if fnmatch.fnmatch(os.path.basename(path), pattern)]
+    if len(vcf_paths) != len(dataset_ids):
+        # new extracts may have been added since the directory was listed
+        vcf_paths = [path for path in af_listing(af_path, refresh=True) if fnmatch.fnmatch(os.path.basename(path), pattern)]
+    if len(vcf_paths) != len(dataset_ids):
+        raise ValueError(f"Number of vcf files ({len(vcf_paths)}) for {motif_id} does not match the number of dataset IDs ({len(dataset_ids)})!")
+    grs = {dataset: variant_ranges(path) for dataset, path in overlap.pair_vcf_paths(vcf_paths, dataset_ids).items()}
+    target_df = overlap.pyrange_obj_overlap(pr.PyRanges(df_fps), grs).df
+    os.makedirs(output_path, exist_ok=True)
+    overlap.write_wide_matrix(target_df, motif_id, output_path, index_mode)
+    overlap.flush_writers()
+    outfile = os.path.join(output_path, f"{motif_id}{matrix_suffix}")
+    return motif_id, [f"{outfile}.gz" if index_mode == "bgzip" else outfile]
+
+# create a function to run the covariant site extraction of one wide matrix, as process_data does
+def covariant_job(tsv_filepath, output_path, iqr_multiplier=1.5, fdr_alpha=0.05, cache_dir=None, dataset_output=False, store_path=None, plot_data=False):
+    from AF_FPS_partitioned_output import legacy_tables, dataset_dirname
+    covariant = pipeline_module("covariant")
+    motif_id = os.path.basename(tsv_filepath).replace(matrix_suffix, "")
+    for subdir, _ in legacy_tables.values():
+        os.makedirs(os.path.join(output_path, subdir), exist_ok=True)
+    covariant.process_data(tsv_filepath, output_path, iqr_multiplier, fdr_alpha, cache_dir, dataset_output, store_path, plot_data)
+    if dataset_output:
+        return motif_id, [os.path.join(output_path, dataset_dirname)]
+    return motif_id, [os.path.join(output_path, subdir, f"{motif_id}{suffix}") for subdir, suffix in legacy_tables.values()]
+
+# create a function to turn a job request into the worker calls of its motifs
+def job_calls(request):
+    motif_ids = set(request.get("motifs") or [])
+    if request["job"] == "overlap":
+        inputs = sorted(os.path.join(request["fps_path"], name) for name in os.listdir(request["fps_path"]) if name.endswith(".txt"))
+        inputs = [path for path in inputs if not motif_ids or os.path.basename(path).replace(tfbs_suffix, "") in motif_ids]
+        return [(overlap_job, (path, request["af_path"], request["dataset_ids"], request["output_path"], request.get("index_mode"))) for path in inputs]
+    if request["job"] == "covariant":
+        inputs = sorted(os.path.join(request["matrix_path"], name) for name in os.listdir(request["matrix_path"]) if name.endswith(matrix_suffix))
+        inputs = [path for path in inputs if not motif_ids or os.path.basename(path).replace(matrix_suffix, "") in motif_ids]
+        options = (request.get("iqr_multiplier", 1.5), request.get("fdr_alpha", 0.05), request.get("cache_dir"), request.get("dataset_output", False), request.get("store_path"), request.get("plot_data", False))
+        return [(covariant_job, (path, request["output_path"], *options)) for path in inputs]
+    raise ValueError(f"Unknown job type: {request['job']}")
+
+# create a function to send one status message as a JSON line
+def send(conn_file, message):
+    conn_file.write(json.dumps(message) + "\n")
+    conn_file.flush()
+
+# create a function to serve one client connection: run its jobs on the pool and stream back the status of every motif as it finishes
+def handle_connection(conn, executor, stop_event):
+    with conn, conn.makefile("rw") as conn_file:
+        try:
+            request = json.loads(conn_file.readline())
+            if request["job"] == "shutdown":
+                send(conn_file, {"status": "shutting down"})
+                stop_event.set()
+                return
+            if request["job"] == "status":
+                send(conn_file, {"status": "ready", "worker": executor.submit(worker_state).result()})
+                return
+            calls = job_calls(request)
+        except (ValueError, KeyError, OSError) as e:
+            send(conn_file, {"status": "error", "error": f"Invalid request: {e}"})
+            return
+
+        start = time.perf_counter()
+        futures = {}
+        for function, args in calls:
+            futures[executor.submit(function, *args)] = os.path.basename(str(args[0]))
+            send(conn_file, {"status": "queued", "input": os.path.basename(str(args[0]))})
+        n_failed = 0
+        for future in cf.as_completed(futures):
+            try:
+                motif_id, outputs = future.result()
+                send(conn_file, {"status": "done", "motif_id": motif_id, "outputs": outputs, "seconds": round(time.perf_counter() - start, 3)})
+            # a worker calling sys.exit must not take the daemon down with it
+            except BaseException as e:
+                n_failed += 1
+                send(conn_file, {"status": "error", "input": futures[future], "error": repr(e)})
+        send(conn_file, {"status": "finished", "done": len(futures) - n_failed, "failed": n_failed, "seconds": round(time.perf_counter() - start, 3)})
+
+# create a function to run the daemon: a warm worker pool behind a Unix socket, one thread per client connection
+def serve(socket_path, n_workers=max_workers, af_path=None):
+    setup_logging()
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    stop_event = threading.Event()
+    with cf.ProcessPoolExecutor(max_workers=n_workers, initializer=warm_worker, initargs=(af_path,)) as executor:
+        # start every worker now, so that the first jobs find them warm
+        list(executor.map(time.sleep, [0.1] * n_workers))
+        logging.info(f"{n_workers} workers are warm; listening on {socket_path}")
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(socket_path)
+            server.listen()
+            # wake up regularly to notice a shutdown request
+            server.settimeout(0.5)
+            while not stop_event.is_set():
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                threading.Thread(target=handle_connection, args=(conn, executor, stop_event), daemon=True).start()
+    os.unlink(socket_path)
+    logging.info("Daemon has shut down.")
+
+# create a function to submit a request to a running daemon and yield its status messages as they arrive
+def submit(socket_path, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        with client.makefile("rw") as conn_file:
+            send(conn_file, request)
+            for line in conn_file:
+                yield json.loads(line)
+
+##################
+# load arguments #
+##################
+
+if __name__ == "__main__":
+    usage = [
+        "USAGE: python3 AF_FPS_worker_daemon.py serve <socket_path> [number of workers (default: 4)] [AF directory to preload]",
+        "       python3 AF_FPS_worker_daemon.py overlap <socket_path> <fps_path> <af_path> <dataset_ids_file> <output_path> [motif IDs ...]",
+        "       python3 AF_FPS_worker_daemon.py covariant <socket_path> <wide matrix directory> <output_path> [motif IDs ...]",
+        "       python3 AF_FPS_worker_daemon.py status|shutdown <socket_path>",
+    ]
+    # check for the required arguments
+    if len(sys.argv) < 3 or sys.argv[1] not in ("serve", "overlap", "covariant", "status", "shutdown"):
+        print("ERROR: Missing required arguments!")
+        print("\n".join(usage))
+        sys.exit(1)
+
+    mode, socket_path = sys.argv[1], sys.argv[2]
+    if mode == "serve":
+        serve(socket_path, int(sys.argv[3]) if len(sys.argv) > 3 else max_workers, sys.argv[4] if len(sys.argv) > 4 else None)
+        sys.exit(0)
+
+    if mode == "overlap":
+        with open(sys.argv[5]) as file:
+            dataset_ids = [line.rstrip('\n') for line in file]
+        request = {"job": "overlap", "fps_path": os.path.abspath(sys.argv[3]), "af_path": os.path.abspath(sys.argv[4]), "dataset_ids": dataset_ids, "output_path": os.path.abspath(sys.argv[6]), "motifs": sys.argv[7:]}
+    elif mode == "covariant":
+        request = {"job": "covariant", "matrix_path": os.path.abspath(sys.argv[3]), "output_path": os.path.abspath(sys.argv[4]), "motifs": sys.argv[5:]}
+    else:
+        request = {"job": mode}
+
+    failed = False
+    for message in submit(socket_path, request):
+        print(json.dumps(message), flush=True)
+        failed = failed or message["status"] == "error"
+    sys.exit(1 if failed else 0)
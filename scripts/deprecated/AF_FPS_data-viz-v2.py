@@ -6,17 +6,18 @@
 
 import os
 import sys
-import textwrap
-import matplotlib
-matplotlib.use("Agg")
 import pandas as pd
-import seaborn as sns
 import itertools as it
-import matplotlib.pyplot as plt
 import concurrent.futures as cf
 from pathlib import Path
 from natsort import index_natsorted
-from sklearn.preprocessing import MinMaxScaler
+
+# the pipeline helpers live in scripts/, one level above this deprecated driver; on the cluster both sit in plotting/, which is on the path already
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from AF_FPS_plot_rendering import write_plot_data
+from AF_FPS_summary_records import afps_histogram, write_summary_record
+from AF_FPS_region_extrema import find_region_extrema, winner_pairs
+from AF_FPS_grouped_correlation import append_cohort_rows
 
 ####################
 # define functions #
@@ -53,6 +54,8 @@ def load_data(tsv_filepath):
 
 def scale_data(matrix):
 	# scale the FPS values to a range of 0-1
+	# sklearn is only imported here, so that it does not slow down the startup of every worker
+	from sklearn.preprocessing import MinMaxScaler
 	# Initialize a MinMaxScaler
 	scaler = MinMaxScaler()
 	# copy df
@@ -121,29 +124,6 @@ def accessory_df(afps_stats_mergesorted):
 	filtered_df = unfiltered_df[(unfiltered_df['FPS_scaled_var'] > 0.001) & (unfiltered_df['AF_var'] > 0.001)]
 	return filtered_df
 
-def accessory_plot(filtered_df, motif_id, output_path):
-	################ PLOT ASIDE ################
-	# plot scatter plot of AF_var vs FPS_scaled_var unfiltered
-	# print(f'Plotting {motif_id} scatter plot of AF_var vs FPS_scaled_var (unfiltered)...')
-	# g = sns.jointplot(data=unfiltered_df, x="FPS_scaled_var", y="AF_var", height=10, ratio=5, color='darkslateblue' )
-	# g.fig.suptitle(f'AF vs FPS var for {motif_id} (unfiltered: {len(unfiltered_df)} regions)')
-	# # save the plot
-	# print(f'Saving {motif_id} scatter plot of AF and scaled FPS variance (unfiltered)...')
-	# g.savefig(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AF_vs_FPS-scaled_variance_scatterplot-unfilt.pdf', dpi=300, bbox_inches="tight")
-	# g.fig.clear()
-	# now plot the filtered scatterplot
-	print(f'Plotting {motif_id} scatter plot of AF_var vs FPS_scaled_var (filtered)...')
-	g = sns.jointplot(data=filtered_df, x="FPS_scaled_var", y="AF_var", height=10, ratio=5, color='darkslateblue' )
-	g.fig.suptitle(f'AF vs FPS var for {motif_id} (filtered: {len(filtered_df)} regions)')
-	# save the plot
-	print(f'Saving {motif_id} scatter plot of AF and scaled FPS variance (filtered)...')
-	g.savefig(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AF_vs_FPS-scaled_variance_scatterplot-filt.pdf', dpi=300, bbox_inches="tight")
-	# close the plot
-	plt.close("all")
-	del g
-	print('Plot space closed and plots have been saved to file.')
-	################ END PLOT ASIDE ################
-
 def basic_filtering(afps_stats_mergesorted):
 	# filter out unique region_id rows that have ALL fps == 0; group by 'region_id' first 
 	merged_filt = afps_stats_mergesorted.groupby('region_id').filter(lambda x: x['FPS'].sum() > 0)
@@ -211,200 +191,7 @@ def filtersort_df(input_df):
 	nzaf_df_filtsorted = dataset_copy.groupby('region_id', sort=False, observed=False).apply(lambda x: x.sort_values('sample_id')).reset_index(drop=True)
 	return nzaf_df_filtsorted
 
-def find_min_max(input_df):
-	######### FIND MAXIMA AND MINIMA #########
-	# Find the index of the max FPS_scaled value for each region_id
-	idx_max = input_df.groupby('region_id', observed=True)['FPS_scaled'].idxmax()
-	idx_min = input_df.groupby('region_id', observed=True)['FPS_scaled'].idxmin()
-	# Select the corresponding rows
-	max_fps_scaled = input_df.loc[idx_max]
-	min_fps_scaled = input_df.loc[idx_min]
-	# do the same for AF
-	idx_max_af = input_df.groupby('region_id', observed=True)['AF'].idxmax()
-	idx_min_af = input_df.groupby('region_id', observed=True)['AF'].idxmin()
-	# Select the corresponding rows
-	max_af_raw = input_df.loc[idx_max_af]
-	min_af_raw = input_df.loc[idx_min_af]
-	# create masks for the inverse of max and min values
-	mask = ~input_df.index.isin(idx_max)
-	max_fps_scaled_inv = input_df[mask]
-	mask = ~input_df.index.isin(idx_min)
-	min_fps_scaled_inv = input_df[mask]
-	# do the same for AF
-	mask = ~input_df.index.isin(idx_max_af)
-	max_af_raw_inv = input_df[mask]
-	mask = ~input_df.index.isin(idx_min_af)
-	min_af_raw_inv = input_df[mask]
-	return max_fps_scaled, min_fps_scaled, max_af_raw, min_af_raw, max_fps_scaled_inv, min_fps_scaled_inv, max_af_raw_inv, min_af_raw_inv
-
-def boxplot_region_filtsorted(input_df, motif_id, output_path, palette_col, threshold, central_stat=None):
-	################# START box plot of AF distr on filtered sorted sites as well as the substype-hued stripplot ################
-	# check existence of output directory
-	if not os.path.exists(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AFdist_per_site_AFvar_filtsorted_by_FPS_var_boxplot-IQR.pdf') or not os.path.exists(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AFdist_per_site_AFvar_filtsorted_by_FPS_var_boxplot-gbl-mean.pdf'):
-		print(f'Plotting {motif_id} boxplot of AF distribution on filtered sites sorted by FPS variance...')
-		plt.figure(figsize=(10, 10), dpi=300)
-		# specify subplot
-		plt.subplot(4, 1, 1)
-		sns.boxplot(x='region_id', y='AF', data=input_df, color='whitesmoke', linecolor='black', showfliers=False)
-		sns.stripplot(x='region_id', y='AF', data=input_df, hue='sample_id', palette=palette_col, size=4, jitter=True, linewidth=0.5, edgecolor='black')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('AF per site', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-		# place legend outside of the plot
-		plt.legend(bbox_to_anchor=(1.01, 1),borderaxespad=0, markerscale=2, fontsize=10)
-
-		plt.subplot(4, 1, 2)
-		sns.barplot(x='region_id', y='AF_var', data=input_df, color='darkslateblue', edgecolor='black')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('AF variance', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-		
-		plt.subplot(4, 1, 3)
-		sns.boxplot(x='region_id', y='FPS_scaled', data=input_df, color='whitesmoke', linecolor='black', showfliers=False)
-		sns.stripplot(x='region_id', y='FPS_scaled', data=input_df, hue='sample_id', palette=palette_col, size=4, jitter=True, legend=False, linewidth=0.5, edgecolor='black')
-		# plot horizontal line at fps_scaled_global_mean
-		if threshold == 'central':
-			plt.axhline(y=central_stat, color='black', linestyle='--')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('Scaled FPS per site', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-
-		plt.subplot(4, 1, 4)
-		sns.barplot(x='region_id', y='FPS_scaled_var', data=input_df, color='darkslateblue', edgecolor='black')
-		plt.xticks(rotation=90, fontsize=4)
-		if threshold == 'iqr':
-			plt.xlabel(f'{motif_id} binding sites with allelic variants (AF > 0.5 and passing IQR threshold)', fontsize=10)
-		elif threshold == 'central':
-			plt.xlabel(f'{motif_id} binding sites with allelic variants (AF > 0.5 and scaled FPS above global mean)', fontsize=10)
-		plt.ylabel('Scaled FPS variance', fontsize=10)
-		plt.subplots_adjust(hspace=0.05)
-		# save the plot
-		if threshold == 'iqr':
-			print(f'Saving {motif_id} boxplot of AF distribution on filtered sorted sites...')
-			plt.savefig(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AFdist_per_site_AFvar_filtsorted_by_FPS_var_boxplot-IQR.pdf', dpi=300, bbox_inches="tight")
-			print('Plot saved.')
-			# close the plot
-			plt.close('all')
-			print('Plot space closed.')
-		elif threshold == 'central':
-			print(f'Saving {motif_id} boxplot of AF distribution on filtered sorted sites...')
-			plt.savefig(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AFdist_per_site_AFvar_filtsorted_by_FPS_var_boxplot-gbl-mean.pdf', dpi=300, bbox_inches="tight")
-			print('Plot saved.')
-			# close the plot
-			plt.close('all')
-			print('Plot space closed.')
-	else:
-		print(f'{motif_id} box plots of AF distribution on filtered sites already exists. Skipping...')
-	################# END box plot of AF distr on filtered sorted sites as well as the substype-hued stripplot ################
-
-def boxplot_maxima(input_df, max_af, max_af_inv, max_fps, max_fps_inv, motif_id, output_path, palette_col, gray_palette):
-	###################################### START box plot of AF distr on filtered sorted sites (with maxima) ################
-	if not os.path.exists(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AFdist_per_site_AFvar_filtsorted_with_FPS_boxplot-maxima.pdf'):
-		print(f'Plotting {motif_id} boxplot of AF distribution on filtered sorted sites, highlighting maxima...')
-		plt.figure(figsize=(10, 10), dpi=300)
-		# specify subplot
-		plt.subplot(4, 1, 1)
-		sns.boxplot(x='region_id', y='AF', data=input_df, color='whitesmoke', linecolor='black', showfliers=False)
-		sns.stripplot(x='region_id', y='AF', data=max_af_inv, hue='sample_id', palette=gray_palette, size=4, jitter=True, legend=False, linewidth=0.5, edgecolor='dimgray', alpha=0.8)
-		sns.stripplot(x='region_id', y='AF', data=max_af, hue='sample_id', palette=palette_col, size=4, jitter=True, linewidth=0.5, edgecolor='black')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('AF per site (maxima)', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-		# place legend outside of the plot
-		plt.legend(bbox_to_anchor=(1.01, 1),borderaxespad=0, markerscale=2, fontsize=10)
-
-		plt.subplot(4, 1, 2)
-		sns.barplot(x='region_id', y='AF_var', data=input_df, color='darkslateblue', edgecolor='black')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('AF variance', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-
-		plt.subplot(4, 1, 3)
-		sns.boxplot(x='region_id', y='FPS_scaled', data=input_df, color='whitesmoke', linecolor='black', showfliers=False)
-		sns.stripplot(x='region_id', y='FPS_scaled', data=max_fps_inv, hue='sample_id', palette=gray_palette, size=4, jitter=True, legend=False, linewidth=0.5, edgecolor='dimgray', alpha=0.8)
-		sns.stripplot(x='region_id', y='FPS_scaled', data=max_fps, hue='sample_id', palette=palette_col, size=4, jitter=True, legend=False, linewidth=0.5, edgecolor='black')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('Scaled FPS per site (maxima)', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-
-		plt.subplot(4, 1, 4)
-		sns.barplot(x='region_id', y='FPS_scaled_var', data=input_df, color='darkslateblue', edgecolor='black')
-		plt.xticks(rotation=90, fontsize=4)
-		plt.xlabel(f'{motif_id} binding sites with allelic variants (AF > 0.5 and passing IQR threshold)', fontsize=10)
-		plt.ylabel('Scaled FPS variance', fontsize=10)
-		plt.subplots_adjust(hspace=0.05)
-		# save the plot
-		print(f'Saving {motif_id} boxplot of AF distribution on filtered sorted sites...')
-		plt.savefig(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AFdist_per_site_AFvar_filtsorted_with_FPS_boxplot-maxima.pdf', dpi=300, bbox_inches="tight")
-		print('Plot saved.')
-		# close the plot
-		plt.close('all')
-		print('Plot space closed.')
-	else:
-		print(f'{motif_id} box plots of AF distribution on filtered sites already exists. Skipping...')
-		################### END box plot of AF distr on filtered sorted sites (with maxima) ################
-
-def boxplot_minima(input_df, min_af, min_af_inv, min_fps, min_fps_inv, motif_id, output_path, palette_col, gray_palette):
-	################### START box plot of AF distr on filtered sorted sites (with minima) ################
-	if not os.path.exists(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AFdist_per_site_AFvar_filtsorted_with_FPS_boxplot-minima.pdf'):
-		print(f'Plotting {motif_id} boxplot of AF distribution on filtered sorted sites, highlighting minima...')
-		plt.figure(figsize=(10, 10), dpi=300)
-		# specify subplot
-		plt.subplot(4, 1, 1)
-		sns.boxplot(x='region_id', y='AF', data=input_df, color='whitesmoke', linecolor='black', showfliers=False)
-		sns.stripplot(x='region_id', y='AF', data=min_af_inv, hue='sample_id', palette=gray_palette, size=4, jitter=True, legend=False, linewidth=0.5, edgecolor='dimgray', alpha=0.8)
-		sns.stripplot(x='region_id', y='AF', data=min_af, hue='sample_id', palette=palette_col, size=4, jitter=True, linewidth=0.5, edgecolor='black')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('AF per site (minima)', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-		# place legend outside of the plot
-		plt.legend(bbox_to_anchor=(1.01, 1),borderaxespad=0, markerscale=2, fontsize=10)
-
-		plt.subplot(4, 1, 2)
-		sns.barplot(x='region_id', y='AF_var', data=input_df, color='darkslateblue', edgecolor='black')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('AF variance', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-
-		plt.subplot(4, 1, 3)
-		sns.boxplot(x='region_id', y='FPS_scaled', data=input_df, color='whitesmoke', linecolor='black', showfliers=False)
-		sns.stripplot(x='region_id', y='FPS_scaled', data=min_fps_inv, hue='sample_id', palette=gray_palette, size=4, jitter=True, legend=False, linewidth=0.5, edgecolor='dimgray', alpha=0.8)
-		sns.stripplot(x='region_id', y='FPS_scaled', data=min_fps, hue='sample_id', palette=palette_col, size=4, jitter=True, legend=False, linewidth=0.5, edgecolor='black')
-		plt.xticks(ticks=plt.xticks()[0], labels=[])
-		plt.xlabel('')
-		ylabel = textwrap.fill('Scaled FPS per site (maxima)', width=15)
-		plt.ylabel(ylabel, fontsize=10)
-
-		plt.subplot(4, 1, 4)
-		sns.barplot(x='region_id', y='FPS_scaled_var', data=input_df, color='darkslateblue', edgecolor='black')
-		plt.xticks(rotation=90, fontsize=4)
-		plt.xlabel(f'{motif_id} binding sites with allelic variants (AF > 0.5 and passing IQR threshold)', fontsize=10)
-		plt.ylabel('Scaled FPS variance', fontsize=10)
-		plt.subplots_adjust(hspace=0.05)
-		# save the plot
-		print(f'Saving {motif_id} boxplot of AF distribution on filtered sorted sites...')
-		plt.savefig(f'{output_path}/output-data/plots/{motif_id}/{motif_id}_AFdist_per_site_AFvar_filtsorted_with_FPS_boxplot-minima.pdf', dpi=300, bbox_inches="tight")
-		print('Plot saved.')
-		# close the plot
-		plt.close('all')
-		print('Plot space closed.')
-	else:
-		print(f'{motif_id} box plots of AF distribution on filtered sites already exists. Skipping...')
-	#################### END box plot of AF distr on filtered sorted sites (with minima) ################
-
 def process_data(target_file, output_path, threshold, plot=True):
-	################ define color palettes ################
-	dutchfield_colordict = {'S6R691V_her2': "#e60049", 'ANAB5F7_basal': "#0bb4ff", '98JKPD8_lumA': "#87bc45", 'PU24GB8_lumB': "#ef9b20", '2GAMBDQ_norm': "#b33dc6"}
-	gray = 'lightgray'
-	gray_colordict = {'S6R691V_her2': gray, 'ANAB5F7_basal': gray, '98JKPD8_lumA': gray, 'PU24GB8_lumB': gray, '2GAMBDQ_norm': gray}
 	################ START ################
 	print(f'Processing {target_file}...')
 	# load the data
@@ -419,6 +206,9 @@ def process_data(target_file, output_path, threshold, plot=True):
 	# merge the two dataframes
 	afps_full_dfl = afps_df_lpv.merge(fps_df_scaled_lpv, on=['region_id', 'sample_id'])
 	print(f'{motif_id} matrix has been scaled and processed.')
+	# record the per-subtype variant site counts and the AF/FPS_scaled histogram of the motif for the cohort summaries
+	variant_site_counts = afps_full_dfl[afps_full_dfl['AF'] > 0].groupby('sample_id')['region_id'].nunique().reindex(sorted(afps_full_dfl['sample_id'].unique()), fill_value=0)
+	write_summary_record(output_path, motif_id, variant_site_counts={sample_id: int(count) for sample_id, count in variant_site_counts.items()}, afps_histogram=afps_histogram(afps_full_dfl))
 	################ SAVEPOINT ################
 	###########################################
 	if not os.path.exists(f'{output_path}/output-data/tables/{motif_id}/{motif_id}_afps_fullscaled_longtable.tsv'):
@@ -452,9 +242,9 @@ def process_data(target_file, output_path, threshold, plot=True):
 	print(f'Saving {motif_id} FPS_scaled and AF variances filtered for values more than 0.001...')
 	# save file
 	filtered_df.to_csv(f'{output_path}/output-data/tables/{motif_id}/{motif_id}_afps_var_filtered_unique_regions.tsv', sep='\t', index=True)
-	# plot scatter plot of AF_var vs FPS_scaled_var
-	print(f'Plotting {motif_id} scatter plot of AF_var vs FPS_scaled_var...')
-	accessory_plot(filtered_df, motif_id, output_path)
+	# save the data of the scatter plot of AF_var vs FPS_scaled_var for the plot rendering stage
+	print(f'Saving {motif_id} plot data of AF_var vs FPS_scaled_var...')
+	write_plot_data(output_path, motif_id, 'variance_scatter', f'{motif_id}_AF_vs_FPS-scaled_variance_scatterplot-filt.pdf', filtered_df)
 	###########################################
 	################ SAVEPOINT ################
 	
@@ -491,29 +281,37 @@ def process_data(target_file, output_path, threshold, plot=True):
 		else:
 			print(f'{motif_id} data table of regions passing IQR threshold already exists. Skipping...')
 		###########################################
-		# find maxima and minima
-		max_fps_scaled, min_fps_scaled, max_af_raw, min_af_raw, max_fps_scaled_inv, min_fps_scaled_inv, max_af_raw_inv, min_af_raw_inv = find_min_max(high_af_fps_outliers_filtsorted)
+		# add the regions to the cohort long table of the grouped per-subtype correlations
+		append_cohort_rows(output_path, motif_id, high_af_fps_outliers_filtsorted)
+		# find the subtype with the maximum and minimum AF and FPS_scaled of every region, and the number of regions each subtype wins
+		extrema_df, wins_df = find_region_extrema(high_af_fps_outliers_filtsorted)
 		print(f'{motif_id} processed matrix has been extensively filtered and sorted. Entering plotting phase...')
 
 		if plot == True:
-			boxplot_region_filtsorted(high_af_fps_outliers_filtsorted, motif_id, output_path, dutchfield_colordict, threshold)
-			boxplot_maxima(high_af_fps_outliers_filtsorted, max_af_raw, max_af_raw_inv, max_fps_scaled, max_fps_scaled_inv, motif_id, output_path, dutchfield_colordict, gray_colordict)
-			boxplot_minima(high_af_fps_outliers_filtsorted, min_af_raw, min_af_raw_inv, min_fps_scaled, min_fps_scaled_inv, motif_id, output_path, dutchfield_colordict, gray_colordict)
-			# close all plots
-			plt.close('all')
+			# the box plots are drawn by the plot rendering stage (AF_FPS_plot_rendering.py) from the saved plot data
+			plot_cols = ['region_id', 'sample_id', 'AF', 'FPS_scaled', 'AF_var', 'FPS_scaled_var']
+			write_plot_data(output_path, motif_id, 'region_boxplot', f'{motif_id}_AFdist_per_site_AFvar_filtsorted_by_FPS_var_boxplot-IQR.pdf', high_af_fps_outliers_filtsorted[plot_cols], threshold=threshold)
+			write_plot_data(output_path, motif_id, 'region_boxplot', f'{motif_id}_AFdist_per_site_AFvar_filtsorted_with_FPS_boxplot-maxima.pdf', high_af_fps_outliers_filtsorted[plot_cols], highlight='maxima')
+			write_plot_data(output_path, motif_id, 'region_boxplot', f'{motif_id}_AFdist_per_site_AFvar_filtsorted_with_FPS_boxplot-minima.pdf', high_af_fps_outliers_filtsorted[plot_cols], highlight='minima')
 		else:
 			print('Skipping plotting phase...')
 		
 		print('Now quantifying the number of sites where a subtype has maximum FPS_scaled value...')
 		# quantify the number of filtered sites per sample_id
-		max_af_raw_subset = max_af_raw[['region_id', 'sample_id']]
-		max_af_raw_df = max_af_raw_subset.groupby('sample_id', observed=False)['region_id'].count().to_frame()
-		max_fps_scaled_subset = max_fps_scaled[['region_id', 'sample_id']]
-		max_fps_scaled_df = max_fps_scaled_subset.groupby('sample_id', observed=False)['region_id'].count().to_frame()
+		max_af_raw_subset = winner_pairs(extrema_df, 'AF_max')
+		max_af_raw_df = wins_df['AF_max'].rename('region_id').to_frame()
+		max_fps_scaled_subset = winner_pairs(extrema_df, 'FPS_scaled_max')
+		max_fps_scaled_df = wins_df['FPS_scaled_max'].rename('region_id').to_frame()
 		max_af_raw_subset.to_csv(f'{output_path}/output-data/tables/{motif_id}/{motif_id}_max_af_region-ids_unique.tsv', sep='\t', index=False)
 		max_af_raw_df.to_csv(f'{output_path}/output-data/tables/{motif_id}/{motif_id}_max_af_regions_count.tsv', sep='\t', index=True)
 		max_fps_scaled_subset.to_csv(f'{output_path}/output-data/tables/{motif_id}/{motif_id}_max_fps-scaled_region-ids_unique.tsv', sep='\t', index=False)
 		max_fps_scaled_df.to_csv(f'{output_path}/output-data/tables/{motif_id}/{motif_id}_max_fps-scaled_regions_count.tsv', sep='\t', index=True)
+		# record the counts and the regions where one subtype has both the maximum AF and the maximum FPS_scaled, so the cohort tables need no crawl over these files
+		common_max = max_af_raw_subset.merge(max_fps_scaled_subset, on=['region_id', 'sample_id'], how='inner')
+		write_summary_record(output_path, motif_id,
+			max_af_region_counts={str(sample_id): int(count) for sample_id, count in max_af_raw_df['region_id'].items()},
+			max_fps_region_counts={str(sample_id): int(count) for sample_id, count in max_fps_scaled_df['region_id'].items()},
+			common_max_regions=[[str(region_id), str(sample_id)] for region_id, sample_id in common_max.itertuples(index=False)])
 		print('Region counts have been performed and saved to files.')
 		print('Data analysis complete. Exiting...')
 
@@ -523,6 +321,8 @@ def process_data(target_file, output_path, threshold, plot=True):
 		high_af_blwmean_fs = filtersort_df(high_af_belowmean)
 		low_af_abvmean_fs = filtersort_df(low_af_abovemean)
 		low_af_blwmean_fs = filtersort_df(low_af_belowmean)
+		# record the 2x2 region counts of the motif for the batch Fisher exact tests
+		write_summary_record(output_path, motif_id, contingency=[int(df['region_id'].nunique()) for df in (high_af_abvmean_fs, high_af_blwmean_fs, low_af_abvmean_fs, low_af_blwmean_fs)])
 		###########################################
 		################ SAVEPOINT ################
 		if not os.path.exists(f'{output_path}/output-data/tables/{motif_id}/{motif_id}_HI_AF_regs_abv_FPS-mean_sorted_by_FPS_var_table.tsv'):
@@ -560,20 +360,17 @@ def process_data(target_file, output_path, threshold, plot=True):
 ##################
 # load arguments #
 ##################
-# check for the required arguments
-if len(sys.argv) < 3:
-	print(f'ERROR: Missing required arguments!')
-	print(f'USAGE: python3 AF_FPS_data-viz.py <root_dir> <output_dir>')
-	sys.exit(1)
-else:
-    root_dir = sys.argv[1]
-    output_dir = sys.argv[2]
 
-##################
-# define globals #
-##################
+def main():
+	# check for the required arguments
+	if len(sys.argv) < 3:
+		print(f'ERROR: Missing required arguments!')
+		print(f'USAGE: python3 AF_FPS_data-viz.py <root_dir> <output_dir>')
+		sys.exit(1)
+
+	root_dir = sys.argv[1]
+	output_dir = sys.argv[2]
 
-if __name__ == '__main__':
 	inputs = process_input_tsv(root_dir)
 	# uncomment this to run serially
 	# for target_file in inputs:
@@ -581,6 +378,11 @@ if __name__ == '__main__':
 
 	# uncomment this to run in parallel
 	with cf.ProcessPoolExecutor(max_workers=8) as executor:
-		executor.map(process_data, inputs, it.repeat(output_dir), it.repeat('iqr'), it.repeat(True))
+		# consume the results so that an exception in a worker is raised here instead of being dropped
+		for _ in executor.map(process_data, inputs, it.repeat(output_dir), it.repeat('iqr'), it.repeat(True)):
+			pass
 
 	print ("Pipeline finished! All footprint matrices have been processed.")
+
+if __name__ == '__main__':
+	main()